@@ -6,21 +6,73 @@ def optional_int(val: Optional[str]) -> Optional[int]:
     return int(val) if val else None
 
 
+def parse_bool(val: Optional[str], default: bool = False) -> bool:
+    if not val:
+        return default
+    return val.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 class AppSettings(object):
     def __init__(self, env: Mapping[str, str]):
         self.MAIN_CHAT_ID = int(env.get('MAIN_CHAT_ID', '0'))
         self.TELEGRAM_BOT_TOKEN = env.get('TELEGRAM_BOT_TOKEN')
         self.WEBHOOK_SECRET = env.get('TELEGRAM_BOT_API_SECRET_TOKEN')
+        # 'dynamo', 'dynamo_chats' to keep each chat's state apart in DYNAMO_STATE_TABLE_NAME (needed to serve more than
+        # one chat), or 'sqlite' to keep everything in the SQLITE_PATH file (only for running as a single process).
+        self.DATABASE_BACKEND = env.get('DATABASE_BACKEND', 'dynamo')
+        self.DYNAMO_STATE_TABLE_NAME = env.get('DYNAMO_STATE_TABLE_NAME')
+        # Chats other than MAIN_CHAT_ID, and their settings. See chats.py.
+        self.DYNAMO_CHATS_TABLE_NAME = env.get('DYNAMO_CHATS_TABLE_NAME')
+        self.CHAT_SETTINGS_CACHE_SECONDS = int(env.get('CHAT_SETTINGS_CACHE_SECONDS', '300'))
+        # Chat membership learned from chat_member updates and getChatMember, shared between containers if this is set.
+        self.DYNAMO_MEMBERS_TABLE_NAME = env.get('DYNAMO_MEMBERS_TABLE_NAME')
+        self.MEMBERSHIP_TTL_SECONDS = int(env.get('MEMBERSHIP_TTL_SECONDS', str(60 * 60 * 6)))
+        self.MEMBERSHIP_CACHE_SECONDS = int(env.get('MEMBERSHIP_CACHE_SECONDS', '60'))
+        self.SQLITE_PATH = env.get('SQLITE_PATH', 'barbot.sqlite3')
         self.DYNAMODB_ENDPOINT_URL = env.get('DYNAMODB_ENDPOINT_URL')
+        # DynamoDB client profile. The defaults keep a throttled or stuck call from eating the whole lambda timeout.
+        self.DYNAMODB_CONNECT_TIMEOUT = float(env.get('DYNAMODB_CONNECT_TIMEOUT', '1'))
+        self.DYNAMODB_READ_TIMEOUT = float(env.get('DYNAMODB_READ_TIMEOUT', '2'))
+        # 'standard' or 'adaptive' (which also slows down our own requests while DynamoDB is throttling them).
+        self.DYNAMODB_RETRY_MODE = env.get('DYNAMODB_RETRY_MODE', 'adaptive')
+        # Including the first try.
+        self.DYNAMODB_MAX_ATTEMPTS = int(env.get('DYNAMODB_MAX_ATTEMPTS', '3'))
+        self.DYNAMODB_MAX_POOL_CONNECTIONS = int(env.get('DYNAMODB_MAX_POOL_CONNECTIONS', '10'))
+        self.DYNAMODB_TCP_KEEPALIVE = parse_bool(env.get('DYNAMODB_TCP_KEEPALIVE'), default=True)
         self.DYNAMO_WEEK_TABLE_NAME = env.get('DYNAMO_WEEK_TABLE_NAME')
         self.DYNAMO_EVENTS_TABLE_NAME = env.get('DYNAMO_EVENTS_TABLE_NAME')
+        # Cached suggestions are checked against the week item's version on every read, this only bounds their age.
+        self.SUGGESTIONS_CACHE_SECONDS = int(env.get('SUGGESTIONS_CACHE_SECONDS', '600'))
+        # Update ids we've already handled, so re-deliveries can be dropped. Kept in memory only if this isn't set.
+        self.DYNAMO_UPDATES_TABLE_NAME = env.get('DYNAMO_UPDATES_TABLE_NAME')
+        self.UPDATE_LEDGER_TTL_SECONDS = int(env.get('UPDATE_LEDGER_TTL_SECONDS', str(60 * 60 * 24)))
+        self.UPDATE_LEDGER_CACHE_SIZE = int(env.get('UPDATE_LEDGER_CACHE_SIZE', '1024'))
         self.BOT_USERNAME = env.get('BOT_USERNAME')
         self.WEBHOOK_URL = env.get('WEBHOOK_URL')
         self.SCHEDULE_GROUP_NAME = env.get('SCHEDULE_GROUP_NAME', '')
         self.CREATE_POLL_SCHEDULE_NAME = env.get('CREATE_POLL_SCHEDULE_NAME', '')
         self.CLOSE_POLL_SCHEDULE_NAME = env.get('CLOSE_POLL_SCHEDULE_NAME', '')
         self.BAR_SPREADSHEET = env.get('BAR_SPREADSHEET', '')
+        # Where to keep the last downloaded bar list, for the next process to start with. Empty to not keep it.
+        self.BAR_SNAPSHOT_DIR = env.get('BAR_SNAPSHOT_DIR', '/tmp')
         self.SELENIUM_SERVER_URL = env.get('SELENIUM_SERVER_URL', 'http://localhost:4444')
+        # Browser sessions kept open between map renders, and how many renders each gets before it's replaced.
+        self.SELENIUM_POOL_SIZE = int(env.get('SELENIUM_POOL_SIZE', '2'))
+        self.SELENIUM_SESSION_MAX_RENDERS = int(env.get('SELENIUM_SESSION_MAX_RENDERS', '50'))
+        # How long a render waits for a session when they're all in use.
+        self.SELENIUM_POOL_WAIT_SECONDS = float(env.get('SELENIUM_POOL_WAIT_SECONDS', '60'))
+        # Idle sessions older than this are quit rather than reused. Keep it under the selenium server's own session
+        # timeout (300s by default), which would otherwise leave us holding sessions it's already dropped.
+        self.SELENIUM_SESSION_MAX_IDLE_SECONDS = float(env.get('SELENIUM_SESSION_MAX_IDLE_SECONDS', '240'))
+        # How long to wait for a map's tiles and markers to load before taking its screenshot regardless.
+        self.MAP_RENDER_TIMEOUT_SECONDS = float(env.get('MAP_RENDER_TIMEOUT_SECONDS', '10'))
+        # Rendered maps are kept in memory, then on disk (empty to not), then in a blob store shared between
+        # processes: '' for none, or 'local' for the MAP_BLOB_STORE_DIR directory. See map_cache.py
+        self.MAP_CACHE_MEMORY_ENTRIES = int(env.get('MAP_CACHE_MEMORY_ENTRIES', '16'))
+        self.MAP_CACHE_DIR = env.get('MAP_CACHE_DIR', '/tmp/barbot-maps')
+        self.MAP_CACHE_DISK_ENTRIES = int(env.get('MAP_CACHE_DISK_ENTRIES', '256'))
+        self.MAP_BLOB_STORE = env.get('MAP_BLOB_STORE', '')
+        self.MAP_BLOB_STORE_DIR = env.get('MAP_BLOB_STORE_DIR', '')
 
         # If set, bar decision announcements will be sent to this chat_id instead of MAIN_CHAT_ID.
         self.ANNOUNCEMENT_CHAT_ID = optional_int(env.get('ANNOUNCEMENT_CHAT_ID'))
@@ -30,13 +82,43 @@ class AppSettings(object):
         self.MAIN_EVENT_CRON = env.get('MAIN_EVENT_CRON', '')
         self.MAIN_EVENT_DURATION_MINUTES = int(env.get('MAIN_EVENT_DURATION_MINUTES', str(60 * 4)))
 
+        # HTTP transport used to talk to the Telegram Bot API. Connections are kept open between warm invocations.
+        self.TELEGRAM_POOL_SIZE = int(env.get('TELEGRAM_POOL_SIZE', '8'))
+        self.TELEGRAM_CONNECT_TIMEOUT = float(env.get('TELEGRAM_CONNECT_TIMEOUT', '5'))
+        self.TELEGRAM_READ_TIMEOUT = float(env.get('TELEGRAM_READ_TIMEOUT', '5'))
+        self.TELEGRAM_WRITE_TIMEOUT = float(env.get('TELEGRAM_WRITE_TIMEOUT', '5'))
+        self.TELEGRAM_POOL_TIMEOUT = float(env.get('TELEGRAM_POOL_TIMEOUT', '1'))
+        self.TELEGRAM_KEEPALIVE_SECONDS = float(env.get('TELEGRAM_KEEPALIVE_SECONDS', '300'))
+        # HTTP/2 needs the `h2` package (python-telegram-bot[http2]). Falls back to HTTP/1.1 if it isn't installed.
+        self.TELEGRAM_HTTP2 = parse_bool(env.get('TELEGRAM_HTTP2'))
+        # Open a connection to the Bot API (and verify the token) when the container starts, rather than on the first
+        # call a handler makes.
+        self.TELEGRAM_PRECONNECT = parse_bool(env.get('TELEGRAM_PRECONNECT'), default=True)
+
+        # Flood limits for outgoing Bot API calls. See outbox.py
+        self.OUTBOX_GLOBAL_RATE = float(env.get('OUTBOX_GLOBAL_RATE', '30'))
+        self.OUTBOX_CHAT_RATE = float(env.get('OUTBOX_CHAT_RATE', '1'))
+        self.OUTBOX_CHAT_BURST = float(env.get('OUTBOX_CHAT_BURST', '5'))
+        self.OUTBOX_MAX_RETRIES = int(env.get('OUTBOX_MAX_RETRIES', '3'))
+
+        # Only used when running as a long lived process with `python -m barbot.polling`
+        self.POLLING_WORKERS = int(env.get('POLLING_WORKERS', '8'))
+        self.POLLING_QUEUE_SIZE = int(env.get('POLLING_QUEUE_SIZE', '32'))
+        self.POLLING_TIMEOUT_SECONDS = int(env.get('POLLING_TIMEOUT_SECONDS', '30'))
+
 
 BARNIGHT_HASHTAG = '#barnight'
 
 # This limit is imposed by the max number of poll options in a Telegram poll.\
 # Change this if Telegram's limit changes in the future.
 MAX_SUGGESTIONS = 10
+# The updates we ask Telegram for. chat_member isn't sent unless it's asked for.
+ALLOWED_UPDATES = ['message', 'inline_query', 'chat_member', 'my_chat_member']
 MIN_VENUE_LENGTH = 1
 MAX_VENUE_LENGTH = 100
+# Bars from the bar list offered in inline query results, on top of the current suggestions.
+MAX_INLINE_BAR_RESULTS = 5
+# How many bars /near lists.
+NEAR_RESULTS = 5
 
 asyncio_loop = asyncio.get_event_loop()
@@ -0,0 +1,72 @@
+"""
+Typo tolerant name search for inline queries.
+
+Names are compared the way bars are matched (see `bars._normalize_name`). Short queries are looked up by prefix,
+longer ones by the trigrams they share with each name, so a search only looks at names that have something in common
+with the query rather than every name there is.
+"""
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .bars import _normalize_name
+
+# Queries shorter than a trigram are matched by prefix, up to this long.
+MAX_PREFIX = 2
+# How similar (Dice coefficient of the trigrams) a name has to be to the query to be offered.
+MIN_SCORE = 0.3
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"${key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex(object):
+    def __init__(self, entries: Iterable[Tuple[str, Iterable[str]]]):
+        """Index names by (display name, every spelling it can be found by)."""
+        # Each normalized spelling, its trigram count, and the display name it finds.
+        self.keys: List[Tuple[str, int, str]] = []
+        self.trigrams: Dict[str, List[int]] = {}
+        self.prefixes: Dict[str, List[int]] = {}
+        seen: Set[str] = set()
+        for name, spellings in entries:
+            for spelling in spellings:
+                key = _normalize_name(spelling)
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                position = len(self.keys)
+                grams = _trigrams(key)
+                self.keys.append((key, len(grams), name))
+                for gram in grams:
+                    self.trigrams.setdefault(gram, []).append(position)
+                for length in range(1, min(MAX_PREFIX, len(key)) + 1):
+                    self.prefixes.setdefault(key[:length], []).append(position)
+
+    def search(self, query: str, limit: int = 5) -> List[str]:
+        """Display names matching the query, best first."""
+        query_key = _normalize_name(query)
+        if not query_key:
+            return []
+
+        scores: Dict[str, float] = {}
+        if len(query_key) <= MAX_PREFIX:
+            for position in self.prefixes.get(query_key, []):
+                key, _, name = self.keys[position]
+                # Among prefix matches, prefer the shortest names, which are the closest to what's been typed.
+                scores[name] = max(scores.get(name, 0.0), 1.0 + len(query_key) / len(key))
+        else:
+            query_grams = _trigrams(query_key)
+            shared: Dict[int, int] = {}
+            for gram in query_grams:
+                for position in self.trigrams.get(gram, []):
+                    shared[position] = shared.get(position, 0) + 1
+            for position, count in shared.items():
+                key, gram_count, name = self.keys[position]
+                score = 2 * count / (len(query_grams) + gram_count)
+                if key.startswith(query_key):
+                    score += 1.0
+                if score >= MIN_SCORE:
+                    scores[name] = max(scores.get(name, 0.0), score)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [name for name, _ in ranked[:limit]]
@@ -0,0 +1,91 @@
+"""
+Parsed bar lists saved to disk, so a new process can start matching with the last list that was downloaded instead of
+waiting for the spreadsheet.
+
+A snapshot file is MAGIC, the length of a JSON header, the header, and then the bar columns and their index,
+marshalled.
+Marshal loads quickly straight out of a memory map, but its format can change between Python versions, so snapshots
+written by another version are ignored.
+"""
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+MAGIC = b"BARSNAP2"
+HEADER_LENGTH = struct.Struct("<I")
+# The coordinate and offset arrays are saved as their raw bytes, which depend on the machine.
+FORMAT = f"{sys.implementation.cache_tag}/marshal{marshal.version}/{sys.byteorder}"
+
+# See bars.BarColumns: names, addresses, plus_codes, latitudes, longitudes, alias_offsets, aliases
+Columns = Tuple[List[str], List[str], List[str], bytes, bytes, bytes, List[str]]
+
+
+class SnapshotData(NamedTuple):
+    content_hash: str
+    # Unix time, since the snapshot can outlive the process that wrote it.
+    fetched_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+    columns: Columns
+    # Normalized name or alias -> which bar it is
+    positions: Dict[str, int]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def snapshot_path(directory: str, url: str) -> str:
+    # Each spreadsheet gets its own file, since chats can have different bar lists.
+    return os.path.join(directory, f"bars-{content_hash(url)[:16]}.snapshot")
+
+
+def save(path: str, data: SnapshotData) -> None:
+    header = json.dumps({
+        "format": FORMAT,
+        "content_hash": data.content_hash,
+        "fetched_at": data.fetched_at,
+        "etag": data.etag,
+        "last_modified": data.last_modified,
+    }).encode("utf-8")
+    payload = marshal.dumps((data.columns, data.positions))
+    # Written next to the snapshot and renamed over it, so a reader never sees half a file.
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(payload)
+    os.replace(temp_path, path)
+
+
+def load(path: str) -> Optional[SnapshotData]:
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                return _parse(view)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        print(f"Ignoring the bar snapshot at {path}: {err!r}")
+        return None
+
+
+def _parse(view: memoryview) -> Optional[SnapshotData]:
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a bar snapshot")
+    start = len(MAGIC) + HEADER_LENGTH.size
+    (header_length,) = HEADER_LENGTH.unpack(view[len(MAGIC):start])
+    header: Dict[str, Any] = json.loads(bytes(view[start:start + header_length]))
+    if header["format"] != FORMAT:
+        return None
+    with view[start + header_length:] as payload:
+        columns, positions = marshal.loads(payload)
+    return SnapshotData(
+        header["content_hash"], header["fetched_at"], header["etag"], header["last_modified"], columns, positions
+    )
@@ -1,12 +1,35 @@
+"""
+The bar list, which lives in a spreadsheet (BAR_SPREADSHEET) with name, address, latitude, longitude, plus_code and
+aliases columns.
+
+The spreadsheet is slow to download, so it's never fetched on the way to answering someone. Whatever list we already
+have is used right away, and if it's out of date a refresh starts in the background and replaces it when it's done.
+Only the very first load has to be waited for (see `Bars.ensure_loaded`), and not even that if there's a snapshot on
+disk from an earlier process (see bar_snapshot.py).
+"""
+import array
+import asyncio
 import csv
-import datetime
+import hashlib
 import re
+import sys
+import time
 import traceback
-import urllib.request
-from typing import NamedTuple, List, Optional, Tuple, Sequence, Set
+from typing import Callable, Dict, Iterable, NamedTuple, List, Optional, Tuple, Sequence, Set, Union, TYPE_CHECKING
+
+import httpx
+
+from . import bar_snapshot
+
+if TYPE_CHECKING:
+    from .autocomplete import NameIndex
+    from .spatial import SpatialIndex
 
 
-CACHE_LIFETIME = datetime.timedelta(seconds=60)
+CACHE_LIFETIME_SECONDS = 60
+# How soon to try again when there's no bar list at all yet.
+FIRST_LOAD_RETRY_SECONDS = 5
+FETCH_TIMEOUT_SECONDS = 10
 
 
 class Bar(NamedTuple):
@@ -31,75 +54,364 @@ def _normalize_spreadsheet_url(url: str) -> str:
     return f"https://docs.google.com/spreadsheets/d/{identifier}/export?format=csv"
 
 
-def _fetch_bars(url: str) -> List[Bar]:
-    with urllib.request.urlopen(url) as response:
-        data = response.read().decode("utf-8")
-        return _parse_bars(data)
+class BarColumns:
+    """
+    The bar list stored a column at a time, which takes a fraction of the memory of a Bar (and a set) per bar.
+    Bar i's aliases are aliases[alias_offsets[i]:alias_offsets[i + 1]].
+    """
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.addresses: List[str] = []
+        self.plus_codes: List[str] = []
+        self.latitudes = array.array("d")
+        self.longitudes = array.array("d")
+        self.alias_offsets = array.array("L", [0])
+        self.aliases: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def append(self, name: str, address: str, latitude: float, longitude: float, plus_code: str,
+               aliases: Iterable[str]) -> None:
+        # Floats first, so a bad coordinate doesn't leave a half added bar behind.
+        self.latitudes.append(latitude)
+        try:
+            self.longitudes.append(longitude)
+        except:
+            self.latitudes.pop()
+            raise
+        self.names.append(sys.intern(name))
+        self.addresses.append(address)
+        self.plus_codes.append(plus_code)
+        self.aliases.extend(sys.intern(alias) for alias in aliases)
+        self.alias_offsets.append(len(self.aliases))
+
+    def get_aliases(self, i: int) -> List[str]:
+        return self.aliases[self.alias_offsets[i]:self.alias_offsets[i + 1]]
+
+    def row(self, i: int) -> Bar:
+        return Bar(
+            self.names[i],
+            self.addresses[i],
+            self.latitudes[i],
+            self.longitudes[i],
+            self.plus_codes[i],
+            set(self.get_aliases(i)),
+        )
+
+    @staticmethod
+    def from_bars(bars: Iterable[Bar]) -> "BarColumns":
+        columns = BarColumns()
+        for bar in bars:
+            columns.append(bar.name, bar.address, bar.latitude, bar.longitude, bar.plus_code, sorted(bar.aliases))
+        return columns
+
+    def to_snapshot(self) -> bar_snapshot.Columns:
+        return (
+            self.names, self.addresses, self.plus_codes,
+            self.latitudes.tobytes(), self.longitudes.tobytes(), self.alias_offsets.tobytes(), self.aliases,
+        )
+
+    @staticmethod
+    def from_snapshot(data: bar_snapshot.Columns) -> "BarColumns":
+        columns = BarColumns()
+        names, addresses, plus_codes, latitudes, longitudes, alias_offsets, aliases = data
+        columns.names = [sys.intern(name) for name in names]
+        columns.addresses = addresses
+        columns.plus_codes = plus_codes
+        columns.latitudes = array.array("d", latitudes)
+        columns.longitudes = array.array("d", longitudes)
+        columns.alias_offsets = array.array("L", alias_offsets)
+        columns.aliases = [sys.intern(alias) for alias in aliases]
+        return columns
+
+
+class BarParser:
+    """Parses the spreadsheet's CSV into BarColumns as it's downloaded, rather than all at once at the end."""
+
+    def __init__(self) -> None:
+        self.columns = BarColumns()
+        self.hash = hashlib.sha256()
+        self._header: Optional[Dict[str, int]] = None
+        self._partial_line = ""
+        self._record: List[str] = []
+        self._quotes = 0
+
+    def feed(self, text: str) -> None:
+        self.hash.update(text.encode("utf-8"))
+        lines = (self._partial_line + text).splitlines(keepends=True)
+        self._partial_line = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            self._add_line(line)
+
+    def finish(self) -> BarColumns:
+        if self._partial_line:
+            self._add_line(self._partial_line)
+            self._partial_line = ""
+        if self._record:
+            self._add_record("".join(self._record))
+            self._record = []
+        return self.columns
+
+    def _add_line(self, line: str) -> None:
+        # A quoted field can have line breaks in it, so a record isn't over until its quotes are.
+        self._record.append(line)
+        self._quotes += line.count('"')
+        if self._quotes % 2 == 0:
+            self._add_record("".join(self._record))
+            self._record = []
+            self._quotes = 0
+
+    def _add_record(self, record: str) -> None:
+        fields = next(csv.reader([record]), [])
+        if not fields:
+            return
+        if self._header is None:
+            self._header = {name: i for i, name in enumerate(fields)}
+            return
+        header = self._header
+        try:
+            self.columns.append(
+                name=fields[header["name"]],
+                address=fields[header["address"]],
+                latitude=float(fields[header["latitude"]]),
+                longitude=float(fields[header["longitude"]]),
+                plus_code=fields[header["plus_code"]],
+                aliases=(a for a in fields[header["aliases"]].split("|") if a),
+            )
+        except Exception as err:
+            print(f"Bad bar specification (`{err!r}`): `{record.strip()}`")
+
+
+class FetchResult(NamedTuple):
+    # None if the spreadsheet hasn't changed since the etag/last_modified we sent.
+    columns: Optional[BarColumns]
+    content_hash: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+async def _fetch_bars(
+    client: httpx.AsyncClient, url: str, etag: Optional[str], last_modified: Optional[str]
+) -> FetchResult:
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 304:
+            return FetchResult(None, None, etag, last_modified)
+        response.raise_for_status()
+        parser = BarParser()
+        async for text in response.aiter_text():
+            parser.feed(text)
+        columns = parser.finish()
+        return FetchResult(
+            columns, parser.hash.hexdigest(), response.headers.get("ETag"), response.headers.get("Last-Modified")
+        )
 
 
 def _parse_bars(csv_str: str) -> List[Bar]:
-    reader = csv.DictReader(csv_str.splitlines())
-    bars = []
-    for row in reader:
-        if isinstance(row, str):
-            # Skip possible header row in csv data
-            pass
-        elif isinstance(row, dict):
-            try:
-                row["latitude"] = float(row["latitude"])
-                row["longitude"] = float(row["longitude"])
-                bars.append(
-                    Bar(
-                        name=row["name"],
-                        address=row["address"],
-                        latitude=float(row["latitude"]),
-                        longitude=float(row["longitude"]),
-                        plus_code=row["plus_code"],
-                        aliases=set(a for a in row["aliases"].split("|") if a),
-                    )
-                )
-            except Exception as err:
-                print(f"Bad bar specification (`{err}`): `{row}`")
-    return bars
+    parser = BarParser()
+    parser.feed(csv_str)
+    columns = parser.finish()
+    return [columns.row(i) for i in range(len(columns))]
+
+
+class BarCatalog:
+    """
+    One version of the bar list, indexed by normalized name and alias so matching is a dict lookup.
+
+    Bars are kept as BarColumns, and only turned into Bar objects when they're asked for.
+    """
+
+    def __init__(self, bars: Union[Sequence[Bar], BarColumns], index: Optional[Dict[str, int]] = None):
+        # The same bar always comes back as the same object.
+        self._rows: Dict[int, Bar] = {}
+        if isinstance(bars, BarColumns):
+            self.columns = bars
+        else:
+            self.columns = BarColumns.from_bars(bars)
+            self._rows = dict(enumerate(bars))
+        self._search_index: Optional["NameIndex"] = None
+        self._spatial_index: Optional["SpatialIndex"] = None
+        if index is not None:
+            self.index = index
+            return
+        self.index = {}
+        columns = self.columns
+        # Names go in first, so an alias can never hide another bar's actual name.
+        for i, name in enumerate(columns.names):
+            self._add(_normalize_name(name), i, "name")
+        for i in range(len(columns)):
+            for alias in columns.get_aliases(i):
+                self._add(_normalize_name(alias), i, f"alias `{alias}`")
+
+    def _add(self, key: str, i: int, what: str) -> None:
+        if not key:
+            return
+        existing = self.index.get(key)
+        if existing is None:
+            self.index[key] = i
+        elif existing != i:
+            names = self.columns.names
+            print(f"Ignoring the {what} of `{names[i]}`, which is already used for `{names[existing]}`")
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def row(self, i: int) -> Bar:
+        bar = self._rows.get(i)
+        if bar is None:
+            bar = self._rows[i] = self.columns.row(i)
+        return bar
+
+    @property
+    def bars(self) -> List[Bar]:
+        """Every bar as a Bar. Prefer match_bar or the indexes, which don't need them all."""
+        return [self.row(i) for i in range(len(self.columns))]
+
+    def match_bar(self, search: str) -> Optional[Bar]:
+        i = self.index.get(_normalize_name(search))
+        return self.row(i) if i is not None else None
+
+    @property
+    def search_index(self) -> "NameIndex":
+        """For inline query autocomplete. Built the first time it's needed, once per version of the list."""
+        if self._search_index is None:
+            from .autocomplete import NameIndex
+            columns = self.columns
+            self._search_index = NameIndex(
+                (name, [name, *columns.get_aliases(i)]) for i, name in enumerate(columns.names)
+            )
+        return self._search_index
+
+    @property
+    def spatial_index(self) -> "SpatialIndex":
+        """For /near. Also built the first time it's needed, since it needs numpy."""
+        if self._spatial_index is None:
+            from .spatial import SpatialIndex
+            self._spatial_index = SpatialIndex(self)
+        return self._spatial_index
 
 
 class Bars:
-    def __init__(self, bar_spreadsheet: str):
+    def __init__(self, bar_spreadsheet: str, clock: Callable[[], float] = time.monotonic,
+                 snapshot_dir: Optional[str] = None):
         self._bar_spreadsheet = _normalize_spreadsheet_url(bar_spreadsheet)
-        self._cache: Optional[Tuple[datetime.datetime, List[Bar]]] = None
+        self._clock = clock
+        self._catalog: Optional[BarCatalog] = None
+        self._content_hash: Optional[str] = None
+        self._checked_at: Optional[float] = None
+        self._snapshot_path: Optional[str] = None
+        # Only worth trying once. After that, the refresh takes over.
+        self._snapshot_tried = False
+        if snapshot_dir and self._bar_spreadsheet:
+            self._snapshot_path = bar_snapshot.snapshot_path(snapshot_dir, self._bar_spreadsheet)
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._refresh: Optional[asyncio.Task[None]] = None
 
-    def get_bars(self) -> List[Bar]:
-        now = datetime.datetime.now()
-        if self._cache and (now - self._cache[0]) < CACHE_LIFETIME:
-            return self._cache[1]
+    def get_catalog(self) -> BarCatalog:
+        """The current bar list, right away. If it's out of date, a refresh is started in the background."""
+        if self._catalog is None and not self._snapshot_tried:
+            self._load_snapshot()
+        if self._checked_at is None or self._clock() - self._checked_at >= CACHE_LIFETIME_SECONDS:
+            self._start_refresh()
+        return self._catalog if self._catalog is not None else BarCatalog([])
+
+    async def ensure_loaded(self) -> BarCatalog:
+        """Like get_catalog, but waits for the first load if there's no bar list at all yet."""
+        catalog = self.get_catalog()
+        if self._catalog is None and self._refresh is not None:
+            await asyncio.shield(self._refresh)
+            catalog = self.get_catalog()
+        return catalog
+
+    def _load_snapshot(self) -> None:
+        self._snapshot_tried = True
+        data = bar_snapshot.load(self._snapshot_path) if self._snapshot_path is not None else None
+        if data is None:
+            return
+        self._catalog = BarCatalog(BarColumns.from_snapshot(data.columns), data.positions)
+        self._content_hash = data.content_hash
+        self._etag = data.etag
+        self._last_modified = data.last_modified
+        # Revalidated as soon as it would have been had this process fetched it.
+        self._checked_at = self._clock() - (time.time() - data.fetched_at)
+
+    def _save_snapshot(self) -> None:
+        if self._snapshot_path is None or self._catalog is None or self._content_hash is None:
+            return
+        data = bar_snapshot.SnapshotData(
+            self._content_hash,
+            time.time(),
+            self._etag,
+            self._last_modified,
+            self._catalog.columns.to_snapshot(),
+            self._catalog.index,
+        )
+        try:
+            bar_snapshot.save(self._snapshot_path, data)
+        except Exception as err:
+            print(f"Unable to save the bar list to {self._snapshot_path}: {err!r}")
+
+    def _start_refresh(self) -> None:
+        if self._refresh is not None and not self._refresh.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Nowhere to run it. Someone will ask again from a handler soon enough.
+            return
+        self._refresh = loop.create_task(self.refresh())
+
+    async def refresh(self) -> None:
+        # Don't try again until the cache lifetime is up, unless there's still no bar list (see below).
+        self._checked_at = self._clock()
+        if not self._bar_spreadsheet:
+            self._catalog = BarCatalog([])
+            return
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=FETCH_TIMEOUT_SECONDS, follow_redirects=True)
         try:
-            data = _fetch_bars(self._bar_spreadsheet)
+            result = await _fetch_bars(self._client, self._bar_spreadsheet, self._etag, self._last_modified)
         except Exception as err:
+            # if we can't get new data, keep using the old data even if it's expired
             print(f"Unable to update bar list: {err}")
             traceback.print_exc()
-            # if we can't get new data, use old data even if it's expired
-            if self._cache:
-                return self._cache[1]
-            # otherwise just say we have nothing I guess :<
-            return []
-        self._cache = (now, data)
-        return data
+            # otherwise just say we have nothing I guess :<, and try again soon rather than waiting out the lifetime
+            if self._catalog is None:
+                self._checked_at = self._clock() - CACHE_LIFETIME_SECONDS + FIRST_LOAD_RETRY_SECONDS
+            return
+        if result.columns is None and self._catalog is not None:
+            return
+        self._etag = result.etag
+        self._last_modified = result.last_modified
+        if result.content_hash == self._content_hash and self._catalog is not None:
+            return
+        # Replaced in one go, so matching never sees half of an update.
+        self._catalog = BarCatalog(result.columns if result.columns is not None else BarColumns())
+        self._content_hash = result.content_hash
+        self._save_snapshot()
+
+    def get_bars(self) -> List[Bar]:
+        return self.get_catalog().bars
 
     def match_bar(self, search: str) -> Optional[Bar]:
-        search = _normalize_name(search)
-        for bar in self.get_bars():
-            if search == _normalize_name(bar.name):
-                return bar
-            if any(search == _normalize_name(a) for a in bar.aliases):
-                return bar
-        return None
+        return self.get_catalog().match_bar(search)
 
     def match_bars(self, searches: Sequence[str]) -> Tuple[List[str], List[Bar]]:
         """Match fuzzy names to actual bars, also providing all fuzzy names that didn't match"""
+        # Everything is matched against the same version of the list, even if it's refreshed halfway through.
+        catalog = self.get_catalog()
         unknown = []
         known = []
         for search in searches:
-            bar = self.match_bar(search)
+            bar = catalog.match_bar(search)
             if bar:
                 known.append(bar)
             else:
@@ -0,0 +1,83 @@
+"""
+A long lived HTTP transport for the Telegram Bot API.
+
+The default transport that `telegram.Bot` builds has a single connection, and httpx drops idle connections after five
+seconds, so nearly every invocation used to pay for a fresh TCP + TLS handshake with api.telegram.org. The transport
+built here keeps a pool of connections alive for as long as the container is warm. Because httpx connections belong to
+the event loop they were opened on, the bot must only be used from `app.asyncio_loop`.
+"""
+import asyncio
+import importlib.util
+import socket
+import traceback
+from typing import Optional
+
+import httpx
+import telegram
+from telegram.request import HTTPXRequest
+
+from .app import AppSettings
+
+
+def _make_transport(app: AppSettings, http2: bool) -> httpx.AsyncHTTPTransport:
+    limits = httpx.Limits(
+        max_connections=app.TELEGRAM_POOL_SIZE,
+        max_keepalive_connections=app.TELEGRAM_POOL_SIZE,
+        keepalive_expiry=app.TELEGRAM_KEEPALIVE_SECONDS,
+    )
+    return httpx.AsyncHTTPTransport(
+        limits=limits,
+        http1=not http2,
+        http2=http2,
+        # Lets the OS notice connections that died while the container was frozen.
+        socket_options=[(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
+    )
+
+
+def make_request(app: AppSettings) -> HTTPXRequest:
+    http2 = app.TELEGRAM_HTTP2
+    if http2 and importlib.util.find_spec('h2') is None:
+        print('HTTP/2 needs the h2 package, which is not installed. Falling back to HTTP/1.1')
+        http2 = False
+    transport = _make_transport(app, http2)
+
+    # When given a transport, httpx ignores the client's own limits and http version, so they're set on the transport
+    # above. The values passed here are only used by python-telegram-bot itself.
+    return HTTPXRequest(
+        connection_pool_size=app.TELEGRAM_POOL_SIZE,
+        connect_timeout=app.TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=app.TELEGRAM_READ_TIMEOUT,
+        write_timeout=app.TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=app.TELEGRAM_POOL_TIMEOUT,
+        http_version='2' if http2 else '1.1',
+        httpx_kwargs={'transport': transport},
+    )
+
+
+def make_bot(app: AppSettings) -> telegram.Bot:
+    assert app.TELEGRAM_BOT_TOKEN is not None
+    return telegram.Bot(
+        token=app.TELEGRAM_BOT_TOKEN,
+        request=make_request(app),
+    )
+
+
+def prepare_bot(bot: telegram.Bot, app: AppSettings) -> Optional['asyncio.Task[None]']:
+    """Pre-connect hook, run once per container before the bot handles its first update.
+
+    Starts initializing the bot, which calls getMe and so opens (and keeps) a connection to the Bot API, but doesn't wait
+    for it: the first update's own work (reading the database, loading the bar list) overlaps the handshake instead of
+    queueing behind a getMe that nothing here uses. Handlers never need the bot's identity from getMe, it's in
+    `BOT_USERNAME`. A failure isn't fatal; the handlers will just connect on their own.
+    """
+    if not app.TELEGRAM_PRECONNECT:
+        return None
+    return asyncio.get_running_loop().create_task(_preconnect(bot))
+
+
+async def _preconnect(bot: telegram.Bot) -> None:
+    try:
+        await bot.initialize()
+    except Exception as err:
+        print(f'Unable to pre-connect to the Bot API: {err}')
+        traceback.print_exc()
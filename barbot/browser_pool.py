@@ -0,0 +1,132 @@
+"""
+Browser sessions kept open between map renders.
+
+Starting a session on the selenium server takes seconds, loading a page into one that's already open takes a fraction
+of that. `BrowserPool` keeps up to `size` sessions, hands them out to renders (which run in worker threads, see
+`geo.map_bars_to_png`), and quits a session once it's done `max_renders` renders, failed a render, stopped answering, or
+sat idle for longer than `max_idle_seconds`.
+"""
+import contextlib
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional
+
+
+class BrowserPoolTimeout(Exception):
+    pass
+
+
+class _Session(object):
+    def __init__(self, driver: Any):
+        self.driver = driver
+        self.renders = 0
+        self.last_used = time.monotonic()
+
+
+class BrowserPool(object):
+    def __init__(self, make_driver: Callable[[], Any], size: int, max_renders: int, wait_seconds: float,
+                 max_idle_seconds: Optional[float] = None):
+        self._make_driver = make_driver
+        self.size = max(1, size)
+        self.max_renders = max_renders
+        self.wait_seconds = wait_seconds
+        # None to reuse a session however long it's been idle.
+        self.max_idle_seconds = max_idle_seconds
+        self._idle: List[_Session] = []
+        # Idle sessions, sessions being used and sessions being started.
+        self._open = 0
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[Any]:
+        """A driver to render with. If anything raises while it's checked out, the session is thrown away."""
+        session = self._checkout()
+        try:
+            yield session.driver
+        except:
+            self._discard(session)
+            raise
+        session.renders += 1
+        if session.renders >= self.max_renders:
+            self._discard(session)
+        else:
+            session.last_used = time.monotonic()
+            with self._condition:
+                self._idle.append(session)
+                self._condition.notify()
+
+    def _checkout(self) -> _Session:
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            with self._condition:
+                expired = self._take_expired()
+                while not self._idle and self._open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise BrowserPoolTimeout(f'No browser session free after {self.wait_seconds}s')
+                    self._condition.wait(remaining)
+                if self._idle:
+                    # Most recently used first, it's the least likely to have been timed out by the server.
+                    session = self._idle.pop()
+                else:
+                    session = None
+                    self._open += 1
+            for stale in expired:
+                self._quit(stale)
+            if session is None:
+                return self._start()
+            if self._is_alive(session):
+                return session
+            self._discard(session)
+
+    def _take_expired(self) -> List[_Session]:
+        """Take the sessions that have been idle too long out of the pool. Called with the condition held."""
+        if self.max_idle_seconds is None:
+            return []
+        cutoff = time.monotonic() - self.max_idle_seconds
+        expired = [session for session in self._idle if session.last_used < cutoff]
+        if expired:
+            self._idle = [session for session in self._idle if session.last_used >= cutoff]
+            # Their places are free as of now, they're quit once the condition's released.
+            self._open -= len(expired)
+            self._condition.notify(len(expired))
+        return expired
+
+    def _start(self) -> _Session:
+        try:
+            return _Session(self._make_driver())
+        except:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    @staticmethod
+    def _is_alive(session: _Session) -> bool:
+        try:
+            session.driver.execute_script('return 1')
+            return True
+        except Exception as err:
+            print(f'Replacing a browser session that stopped answering: {err!r}')
+            return False
+
+    @staticmethod
+    def _quit(session: _Session) -> None:
+        try:
+            session.driver.quit()
+        except Exception as err:
+            print(f'Unable to quit a browser session: {err!r}')
+
+    def _discard(self, session: _Session) -> None:
+        self._quit(session)
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Quit the idle sessions. Sessions that are checked out are quit when they come back."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self.max_renders = 0
+        for session in idle:
+            self._discard(session)
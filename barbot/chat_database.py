@@ -0,0 +1,246 @@
+"""
+Keeps each chat's state in its own partition of DYNAMO_STATE_TABLE_NAME, one item per suggestion and scheduled event:
+
+    pk = chat#<chat id>, sk = week                    poll_id, suggestion_count, version
+    pk = chat#<chat id>, sk = suggestion#<venue key>  uuid, name, user_id, user_handle
+    pk = chat#<chat id>, sk = event#<uuid>            venue_name, cron, duration_minutes
+
+Keying suggestions by their normalized venue means a duplicate suggestion fails the put that would have added it.
+
+Stats are kept in a partition of their own, so that reading the week's state never reads them too:
+
+    pk = chat#<chat id>#stats, sk = aggregates                  aggregates, stats_version (see stats.py)
+    pk = chat#<chat id>#stats, sk = archive#<date>#<entry id>   entry
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from .app import AppSettings, MAX_SUGGESTIONS
+from .database import (
+    AddSuggestionResult, Database, ScheduledVenue, Snapshot, Suggestion, get_version, make_stats_transaction,
+    make_stats_update,
+    normalize_venue, stats_archive_id
+)
+
+WEEK = 'week'
+SUGGESTION_PREFIX = 'suggestion#'
+EVENT_PREFIX = 'event#'
+STATS = 'aggregates'
+STATS_ARCHIVE_PREFIX = 'archive#'
+
+# TransactWriteItems takes at most 100 actions.
+MAX_TRANSACTION_ITEMS = 100
+
+
+def _make_suggestion(item: Dict[str, Any]) -> Suggestion:
+    return Suggestion(item['uuid']['S'], item['name']['S'], int(item['user_id']['N']), item['user_handle']['S'])
+
+
+def _make_scheduled_venue(item: Dict[str, Any]) -> ScheduledVenue:
+    return ScheduledVenue(
+        item['sk']['S'][len(EVENT_PREFIX):],
+        item['venue_name']['S'],
+        item['cron']['S'],
+        int(item['duration_minutes']['N'])
+    )
+
+
+class ChatDynamoDatabase(Database):
+    def __init__(self, app: AppSettings, dynamodb: Any):
+        self.app = app
+        self.dynamodb = dynamodb
+        self.table = app.DYNAMO_STATE_TABLE_NAME
+        self.pk = f'chat#{app.MAIN_CHAT_ID}'
+        self.stats_pk = f'{self.pk}#stats'
+        # Same idea as DynamoDatabase: the suggestions are current for as long as the week item's version matches.
+        self.suggestions: Optional[List[Suggestion]] = None
+        self.suggestions_version = 0
+
+    def _key(self, sk: str, pk: Optional[str] = None) -> Dict[str, Any]:
+        return {'pk': {'S': pk or self.pk}, 'sk': {'S': sk}}
+
+    def _query(self, prefix: Optional[str] = None, pk: Optional[str] = None) -> List[Dict[str, Any]]:
+        request: Dict[str, Any] = {
+            'TableName': self.table,
+            'ConsistentRead': True,
+            'KeyConditionExpression': 'pk = :pk',
+            'ExpressionAttributeValues': {':pk': {'S': pk or self.pk}},
+        }
+        if prefix:
+            request['KeyConditionExpression'] += ' AND begins_with(sk, :prefix)'
+            request['ExpressionAttributeValues'][':prefix'] = {'S': prefix}
+        items: List[Dict[str, Any]] = []
+        while True:
+            result = self.dynamodb.query(**request)
+            items.extend(result.get('Items', []))
+            if 'LastEvaluatedKey' not in result:
+                return items
+            request['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+    def _get_week(self, *attributes: str) -> Dict[str, Any]:
+        result = self.dynamodb.get_item(
+            TableName=self.table,
+            Key=self._key(WEEK),
+            ConsistentRead=True,
+            ProjectionExpression=', '.join(f'#a{i}' for i in range(len(attributes))),
+            ExpressionAttributeNames={f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+        )
+        return result.get('Item', {})
+
+    def _update_week(self, update_expression: str, values: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """A TransactWriteItems action for the week item that also bumps its version."""
+        return {'Update': {
+            'TableName': self.table,
+            'Key': self._key(WEEK),
+            'UpdateExpression': f'{update_expression} ADD version :one',
+            'ExpressionAttributeValues': {':one': {'N': '1'}, **(values or {})},
+        }}
+
+    def get_current_poll_id(self) -> int:
+        return int(self._get_week('poll_id').get('poll_id', {}).get('N', 0))
+
+    def set_current_poll_id(self, poll_id: int) -> None:
+        self.dynamodb.update_item(
+            TableName=self.table,
+            Key=self._key(WEEK),
+            UpdateExpression='SET poll_id = :p ADD version :one',
+            ExpressionAttributeValues={':p': {'N': str(poll_id)}, ':one': {'N': '1'}}
+        )
+        self.suggestions = None
+
+    def get_current_suggestions(self, bypass_cache=False) -> List[Suggestion]:
+        if not bypass_cache and self.suggestions is not None:
+            if get_version(self._get_week('version')) == self.suggestions_version:
+                return self.suggestions
+        return self.get_snapshot().suggestions
+
+    def get_suggestion_by_uuid(self, hex_uuid: str) -> Optional[Suggestion]:
+        return next((s for s in self.get_current_suggestions() if s.uuid == hex_uuid), None)
+
+    def get_suggestion_count(self) -> int:
+        return int(self._get_week('suggestion_count').get('suggestion_count', {}).get('N', 0))
+
+    def clear_suggestions(self) -> None:
+        keys = [item['sk']['S'] for item in self._query(SUGGESTION_PREFIX)]
+        # Deletes go in batches, with the count reset along with the last one.
+        batch_size = MAX_TRANSACTION_ITEMS - 1
+        for start in range(0, max(len(keys), 1), batch_size):
+            actions: List[Dict[str, Any]] = [
+                {'Delete': {'TableName': self.table, 'Key': self._key(sk)}} for sk in keys[start:start + batch_size]
+            ]
+            if start + batch_size >= len(keys):
+                actions.append(self._update_week('SET suggestion_count = :zero', {':zero': {'N': '0'}}))
+            self.dynamodb.transact_write_items(TransactItems=actions)
+        self.suggestions = None
+
+    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str) -> AddSuggestionResult:
+        count = self._update_week('ADD suggestion_count :one')
+        count['Update']['ConditionExpression'] = 'attribute_not_exists(suggestion_count) OR suggestion_count < :max'
+        count['Update']['ExpressionAttributeValues'][':max'] = {'N': str(MAX_SUGGESTIONS)}
+        try:
+            self.dynamodb.transact_write_items(TransactItems=[
+                {'Put': {
+                    'TableName': self.table,
+                    'Item': {
+                        **self._key(SUGGESTION_PREFIX + normalize_venue(venue)),
+                        'uuid': {'S': hex_uuid},
+                        'name': {'S': venue},
+                        'user_id': {'N': str(user_id)},
+                        'user_handle': {'S': user_handle},
+                    },
+                    'ConditionExpression': 'attribute_not_exists(sk)',
+                    'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+                }},
+                count,
+            ])
+        except self.dynamodb.exceptions.TransactionCanceledException as err:
+            reasons = err.response.get('CancellationReasons', [])
+            codes = [reason.get('Code') for reason in reasons]
+            if codes[:1] == ['ConditionalCheckFailed']:
+                return AddSuggestionResult(added=False, existing=_make_suggestion(reasons[0]['Item']))
+            if codes[1:2] == ['ConditionalCheckFailed']:
+                return AddSuggestionResult(added=False, full=True)
+            raise
+        self.suggestions = None
+        return AddSuggestionResult(added=True)
+
+    def remove_suggestion(self, hex_uuid: str):
+        suggestion = self.get_suggestion_by_uuid(hex_uuid)
+        if suggestion is None:
+            return
+        self.dynamodb.transact_write_items(TransactItems=[
+            {'Delete': {
+                'TableName': self.table,
+                'Key': self._key(SUGGESTION_PREFIX + normalize_venue(suggestion.venue)),
+                'ConditionExpression': '#uuid = :uuid',
+                'ExpressionAttributeNames': {'#uuid': 'uuid'},
+                'ExpressionAttributeValues': {':uuid': {'S': hex_uuid}},
+            }},
+            self._update_week('ADD suggestion_count :minus_one', {':minus_one': {'N': '-1'}}),
+        ])
+        self.suggestions = None
+
+    def add_scheduled_venue(self, hex_uuid: str, venue_name: str, cron: str, duration_minutes: int) -> None:
+        self.dynamodb.put_item(
+            TableName=self.table,
+            Item={
+                **self._key(EVENT_PREFIX + hex_uuid),
+                'venue_name': {'S': venue_name},
+                'cron': {'S': cron},
+                'duration_minutes': {'N': str(duration_minutes)},
+            }
+        )
+
+    def remove_scheduled_venue(self, hex_uuid: str) -> None:
+        self.dynamodb.delete_item(TableName=self.table, Key=self._key(EVENT_PREFIX + hex_uuid))
+
+    def get_scheduled_venues(self) -> List[ScheduledVenue]:
+        return [_make_scheduled_venue(item) for item in self._query(EVENT_PREFIX)]
+
+    def get_snapshot(self) -> Snapshot:
+        # The whole partition is one query, which also saves the batched read that DynamoDatabase needs.
+        week: Dict[str, Any] = {}
+        suggestions = []
+        scheduled_venues = []
+        for item in self._query():
+            sk = item['sk']['S']
+            if sk == WEEK:
+                week = item
+            elif sk.startswith(SUGGESTION_PREFIX):
+                suggestions.append(_make_suggestion(item))
+            elif sk.startswith(EVENT_PREFIX):
+                scheduled_venues.append(_make_scheduled_venue(item))
+        self.suggestions = suggestions
+        self.suggestions_version = get_version(week)
+        return Snapshot(int(week.get('poll_id', {}).get('N', 0)), suggestions, scheduled_venues)
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        item = self.dynamodb.get_item(
+            TableName=self.table, Key=self._key(STATS, self.stats_pk), ConsistentRead=True
+        ).get('Item')
+        return json.loads(item['aggregates']['S']) if item else None
+
+    def save_stats(self, entry: Dict[str, Any], aggregates: Dict[str, Any], expected_version: int) -> bool:
+        try:
+            self.dynamodb.transact_write_items(TransactItems=make_stats_transaction(
+                self.table,
+                self._key(STATS, self.stats_pk),
+                self._key(STATS_ARCHIVE_PREFIX + stats_archive_id(entry), self.stats_pk),
+                entry, aggregates, expected_version
+            ))
+        except self.dynamodb.exceptions.TransactionCanceledException:
+            return False
+        return True
+
+    def replace_stats(self, aggregates: Dict[str, Any], expected_version: int) -> bool:
+        try:
+            self.dynamodb.update_item(**make_stats_update(
+                self.table, self._key(STATS, self.stats_pk), aggregates, expected_version
+            ))
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def get_stats_archive(self) -> List[Dict[str, Any]]:
+        # Query results come back in sort key order, which is the order the entries were added.
+        return [json.loads(item['entry']['S']) for item in self._query(STATS_ARCHIVE_PREFIX, self.stats_pk)]
@@ -0,0 +1,90 @@
+"""
+Settings for each chat the bot runs bar night in.
+
+The environment describes the default chat (MAIN_CHAT_ID). If DYNAMO_CHATS_TABLE_NAME is set, more chats can be added
+there, one item per chat keyed by `chat_id`, with a `settings` map of environment variable names to values that
+override the environment for that chat (ANNOUNCEMENT_CHAT_ID, MAIN_EVENT_CRON, BAR_SPREADSHEET and so on).
+"""
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from .app import AppSettings
+
+
+class ChatDirectory(object):
+    def __init__(self, env: Mapping[str, str], dynamodb: Any = None, clock: Callable[[], float] = time.monotonic):
+        self.env = env
+        self.default = AppSettings(env)
+        self.dynamodb = dynamodb
+        self.clock = clock
+        # chat id -> (settings, or None if the chat isn't configured, and when to look it up again)
+        self.cached: Dict[int, Tuple[Optional[AppSettings], float]] = {}
+        # Every configured chat, and when to list them again
+        self.listed: Optional[Tuple[List[int], float]] = None
+
+    def chat_ids(self) -> List[int]:
+        """Every chat the bot is set up for, the default chat first."""
+        if self.listed is not None and self.listed[1] > self.clock():
+            return self.listed[0]
+        chat_ids = [self.default.MAIN_CHAT_ID]
+        if self.default.DYNAMO_CHATS_TABLE_NAME and self.dynamodb is not None:
+            try:
+                kwargs: Dict[str, Any] = {
+                    'TableName': self.default.DYNAMO_CHATS_TABLE_NAME,
+                    'ProjectionExpression': 'chat_id',
+                }
+                while True:
+                    result = self.dynamodb.scan(**kwargs)
+                    chat_ids.extend(sorted(
+                        chat_id for chat_id in (int(item['chat_id']['N']) for item in result.get('Items', []))
+                        if chat_id != self.default.MAIN_CHAT_ID
+                    ))
+                    if 'LastEvaluatedKey' not in result:
+                        break
+                    kwargs['ExclusiveStartKey'] = result['LastEvaluatedKey']
+            except Exception:
+                print('Unable to list the configured chats')
+                traceback.print_exc()
+                # Don't cache a partial list.
+                return chat_ids
+        self.listed = (chat_ids, self.clock() + self.default.CHAT_SETTINGS_CACHE_SECONDS)
+        return chat_ids
+
+    def get(self, chat_id: Optional[int] = None) -> Optional[AppSettings]:
+        """Get the settings for a chat (the default chat if None), or None if the bot isn't set up for it."""
+        if chat_id is None:
+            chat_id = self.default.MAIN_CHAT_ID
+        cached = self.cached.get(chat_id)
+        if cached is not None and cached[1] > self.clock():
+            return cached[0]
+
+        try:
+            overrides = self._load_overrides(chat_id)
+        except Exception:
+            if chat_id != self.default.MAIN_CHAT_ID:
+                # Not cached either way. Saying the chat isn't set up would drop its updates until the cache expired.
+                raise
+            print(f'Unable to load the settings for chat {chat_id}, using the environment for now')
+            traceback.print_exc()
+            return AppSettings({**self.env, 'MAIN_CHAT_ID': str(chat_id)})
+        if overrides is None and chat_id != self.default.MAIN_CHAT_ID:
+            settings = None
+        else:
+            settings = AppSettings({**self.env, **(overrides or {}), 'MAIN_CHAT_ID': str(chat_id)})
+        self.cached[chat_id] = (settings, self.clock() + self.default.CHAT_SETTINGS_CACHE_SECONDS)
+        return settings
+
+    def _load_overrides(self, chat_id: int) -> Optional[Dict[str, str]]:
+        """The chat's settings, or None if it has no item. Raises if the table can't be read."""
+        if not self.default.DYNAMO_CHATS_TABLE_NAME or self.dynamodb is None:
+            return None
+        result = self.dynamodb.get_item(
+            TableName=self.default.DYNAMO_CHATS_TABLE_NAME,
+            Key={'chat_id': {'N': str(chat_id)}}
+        )
+        item = result.get('Item')
+        if not item:
+            return None
+        settings = item.get('settings', {}).get('M', {})
+        return {k: next(iter(v.values())) for k, v in settings.items()}
@@ -1,13 +1,25 @@
 import abc
+import asyncio
 import datetime
-from typing import List, Optional, Dict, Any, Tuple
+import json
+import time
+from typing import Callable, List, Optional, Dict, Any, Tuple, TYPE_CHECKING
 
-import boto3
 import telegram
 
 from .app import AppSettings, MAX_SUGGESTIONS
+from .membership import MEMBER_STATUSES, MembershipStore, MemoryMembershipStore
+
+if TYPE_CHECKING:
+    from .db_metrics import DynamoInstrumentation
 
 CACHE_TTL = datetime.timedelta(seconds=3)
+# A stale venue key is removed between attempts.
+ADD_SUGGESTION_ATTEMPTS = 2
+# Week table items holding stats archive entries (see DynamoDatabase.save_stats).
+STATS_ARCHIVE_PREFIX = 'stats_archive#'
+# Reads of a snapshot that dynamo throttled, see read_snapshot.
+SNAPSHOT_READ_ATTEMPTS = 5
 
 
 class Suggestion(object):
@@ -26,8 +38,33 @@ class ScheduledVenue(object):
         self.duration_minutes = duration_minutes
 
 
-last_suggestions_update_time = datetime.datetime(day=1, month=1, year=1)
-cached_suggestions: List[Suggestion] = []
+class Snapshot(object):
+    """Everything the scheduled steps need to know, read all at once."""
+    def __init__(self, poll_id: int, suggestions: List[Suggestion], scheduled_venues: List[ScheduledVenue]):
+        self.poll_id = poll_id
+        self.suggestions = suggestions
+        self.scheduled_venues = scheduled_venues
+
+
+class SnapshotUnprocessed(Exception):
+    """Dynamo left some of a snapshot's items unread, which it does when it's throttling us."""
+
+
+class AddSuggestionResult(object):
+    """What happened to a suggestion. If it wasn't added, either `existing` is the suggestion it duplicates, or `full`."""
+    def __init__(self, added: bool, existing: Optional[Suggestion] = None, full: bool = False):
+        self.added = added
+        self.existing = existing
+        self.full = full
+
+
+def normalize_venue(venue: str) -> str:
+    """Venues are the same suggestion if they only differ by case, spaces, punctuation and so on."""
+    key = ''.join(c.lower() for c in venue if c.isalpha())
+    return key or venue.lower()
+
+def get_version(item: Dict[str, Any]) -> int:
+    return int(item.get('version', {}).get('N', 0))
 
 def make_suggestion(k: str, v: Dict[str, Any]) -> Suggestion:
     m = v['M']
@@ -38,7 +75,62 @@ def make_scheduled_venue(k: str, v: Dict[str, Any]) -> ScheduledVenue:
     return ScheduledVenue(k, m['venue_name']['S'], m['cron']['S'], int(m['duration_minutes']['N']))
 
 
+def make_dynamodb_client(app: AppSettings, instrumentation: Optional['DynamoInstrumentation'] = None) -> Any:
+    import boto3
+    from botocore.config import Config
+    config = Config(
+        connect_timeout=app.DYNAMODB_CONNECT_TIMEOUT,
+        read_timeout=app.DYNAMODB_READ_TIMEOUT,
+        retries={'mode': app.DYNAMODB_RETRY_MODE, 'total_max_attempts': app.DYNAMODB_MAX_ATTEMPTS},  # type: ignore[typeddict-item]
+        max_pool_connections=app.DYNAMODB_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=app.DYNAMODB_TCP_KEEPALIVE,
+    )
+    client = boto3.client('dynamodb', endpoint_url=app.DYNAMODB_ENDPOINT_URL or None, config=config)
+    if instrumentation is not None:
+        instrumentation.register(client)
+    return client
+
+
+def stats_archive_id(entry: Dict[str, Any]) -> str:
+    """Where an entry goes in the archive. Archive items sort in the order their cycles happened."""
+    return f'{entry["date"]}#{entry["id"]}'
+
+
+def make_stats_update(table: Optional[str], stats_key: Dict[str, Any], aggregates: Dict[str, Any],
+                      expected_version: int) -> Dict[str, Any]:
+    """UpdateItem arguments that replace the totals, if they're unchanged."""
+    return {
+        'TableName': table,
+        'Key': stats_key,
+        'UpdateExpression': 'SET aggregates = :aggregates, stats_version = :version',
+        'ConditionExpression': 'attribute_not_exists(stats_version) OR stats_version = :expected',
+        'ExpressionAttributeValues': {
+            ':aggregates': {'S': json.dumps(aggregates, separators=(',', ':'))},
+            ':version': {'N': str(aggregates['version'])},
+            ':expected': {'N': str(expected_version)},
+        },
+    }
+
+
+def make_stats_transaction(table: Optional[str], stats_key: Dict[str, Any], archive_key: Dict[str, Any], entry: Dict[str, Any],
+                           aggregates: Dict[str, Any], expected_version: int) -> List[Dict[str, Any]]:
+    """TransactWriteItems actions that add an archive item and replace the totals, if they're unchanged."""
+    return [
+        {'Update': make_stats_update(table, stats_key, aggregates, expected_version)},
+        # Each entry is its own item, so the archive can grow without any one item reaching DynamoDB's size limit.
+        # Adding the same entry again just writes the same item.
+        {'Put': {
+            'TableName': table,
+            'Item': {**archive_key, 'entry': {'S': json.dumps(entry, separators=(',', ':'))}},
+        }},
+    ]
+
+
 class Database(abc.ABC):
+    def begin_invocation(self) -> None:
+        """Called at the start of each webhook or scheduled invocation, since the database outlives them."""
+        pass
+
     @abc.abstractmethod
     def get_current_poll_id(self) -> int:
         pass
@@ -55,12 +147,16 @@ class Database(abc.ABC):
     def get_suggestion_by_uuid(self, hex_uuid: str) -> Optional[Suggestion]:
         pass
 
+    def get_suggestion_count(self) -> int:
+        return len(self.get_current_suggestions())
+
     @abc.abstractmethod
     def clear_suggestions(self) -> None:
         pass
 
     @abc.abstractmethod
-    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str):
+    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str) -> AddSuggestionResult:
+        """Add a suggestion, unless the venue has already been suggested or there are MAX_SUGGESTIONS already."""
         pass
 
     @abc.abstractmethod
@@ -79,92 +175,190 @@ class Database(abc.ABC):
     def get_scheduled_venues(self) -> List[ScheduledVenue]:
         pass
 
+    def get_snapshot(self) -> Snapshot:
+        return Snapshot(self.get_current_poll_id(), self.get_current_suggestions(), self.get_scheduled_venues())
+
+    @abc.abstractmethod
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        """The running totals kept by stats.py, if there are any yet."""
+        pass
+
+    @abc.abstractmethod
+    def save_stats(self, entry: Dict[str, Any], aggregates: Dict[str, Any], expected_version: int) -> bool:
+        """Add an entry to the stats archive and replace the totals, in one write. Returns False without writing
+        anything if the totals aren't at `expected_version` anymore."""
+        pass
+
+    @abc.abstractmethod
+    def replace_stats(self, aggregates: Dict[str, Any], expected_version: int) -> bool:
+        """Replace the totals without adding to the archive, as long as they're still at `expected_version`."""
+        pass
+
+    @abc.abstractmethod
+    def get_stats_archive(self) -> List[Dict[str, Any]]:
+        pass
+
 
 class DynamoDatabase(Database):
-    def __init__(self, app: AppSettings):
+    def __init__(self, app: AppSettings, dynamodb: Any = None):
         self.app = app
-        if app.DYNAMODB_ENDPOINT_URL:
-            self.dynamodb = boto3.client('dynamodb', endpoint_url=app.DYNAMODB_ENDPOINT_URL)
-        else:
-            self.dynamodb = boto3.client('dynamodb')
-
-    def get_current_poll_id(self) -> int:
-        result = self.dynamodb.get_item(
+        self.dynamodb = dynamodb if dynamodb is not None else make_dynamodb_client(app)
+        # Reads of the week item made during this invocation, keyed by the projected attribute paths (none for the
+        # whole item) and whether the read was consistent.
+        self.week_reads: Dict[Tuple[Tuple[Tuple[str, ...], ...], bool], Dict[str, Any]] = {}
+
+        # Every write to the week item bumps its version, so the cached suggestions are current as long as the version
+        # they were read at still matches.
+        self.suggestions: Optional[List[Suggestion]] = None
+        self.suggestions_version = 0
+        self.suggestions_loaded_at = 0.0
+
+    def begin_invocation(self) -> None:
+        self.week_reads.clear()
+
+    def _get_week(self, *paths: Tuple[str, ...], consistent: bool = False) -> Dict[str, Any]:
+        """Read the current week item, or only the given attribute paths of it.
+
+        Reads are shared until the end of the invocation or the next write. A whole item read also answers later
+        projected reads, as long as it was at least as consistent.
+        """
+        candidates = [(paths, consistent), ((), consistent)]
+        if not consistent:
+            candidates += [(paths, True), ((), True)]
+        for key in candidates:
+            cached = self.week_reads.get(key)
+            if cached is not None:
+                return cached
+
+        request: Dict[str, Any] = {
+            'TableName': self.app.DYNAMO_WEEK_TABLE_NAME,
+            'Key': {'id': {'S': 'current'}},
+        }
+        if consistent:
+            request['ConsistentRead'] = True
+        if paths:
+            # Everything goes through placeholders, since uuids and reserved words aren't valid in expressions.
+            names: Dict[str, str] = {}
+            expressions = []
+            for path in paths:
+                placeholders = []
+                for part in path:
+                    placeholder = f'#p{len(names)}'
+                    names[placeholder] = part
+                    placeholders.append(placeholder)
+                expressions.append('.'.join(placeholders))
+            request['ProjectionExpression'] = ', '.join(expressions)
+            request['ExpressionAttributeNames'] = names
+
+        item = self.dynamodb.get_item(**request).get('Item', {})
+        self.week_reads[(paths, consistent)] = item
+        return item
+
+    def _update_week(self, update_expression: str, **kwargs: Any) -> int:
+        """Make an update to the week item that also bumps its version, returning the new version."""
+        self.week_reads.clear()
+        values = dict(kwargs.pop('ExpressionAttributeValues', {}))
+        values[':one'] = {'N': '1'}
+        result = self.dynamodb.update_item(
             TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
             Key={'id': {'S': 'current'}},
-            ConsistentRead=True
+            UpdateExpression=f'{update_expression} ADD version :one',
+            ExpressionAttributeValues=values,
+            ReturnValues='UPDATED_NEW',
+            **kwargs
         )
-        item = result.get('Item', {})
+        return int(result['Attributes']['version']['N'])
+
+    def _cache_suggestions(self, suggestions: List[Suggestion], version: int) -> None:
+        self.suggestions = suggestions
+        self.suggestions_version = version
+        self.suggestions_loaded_at = time.monotonic()
+
+    def _update_cached_suggestions(self, version: int, update: Callable[[List[Suggestion]], List[Suggestion]]) -> None:
+        """Apply our own successful write to the cache, unless somebody else has written since we last read."""
+        if self.suggestions is not None and version == self.suggestions_version + 1:
+            self._cache_suggestions(update(self.suggestions), version)
+        else:
+            self.suggestions = None
+
+    def _get_cached_suggestions(self) -> Optional[List[Suggestion]]:
+        """The cached suggestions, if they're still current."""
+        if self.suggestions is None:
+            return None
+        if time.monotonic() > self.suggestions_loaded_at + self.app.SUGGESTIONS_CACHE_SECONDS:
+            return None
+        item = self._get_week(('version',), consistent=True)
+        if get_version(item) != self.suggestions_version:
+            return None
+        return self.suggestions
+
+    def get_current_poll_id(self) -> int:
+        item = self._get_week(('poll_id',), consistent=True)
         return int(item.get('poll_id', {}).get('N', 0))
 
 
     def set_current_poll_id(self, poll_id: int) -> None:
-        self.dynamodb.update_item(
-            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
-            Key={'id': {'S': 'current'}},
-            UpdateExpression='SET poll_id = :p',
+        version = self._update_week(
+            'SET poll_id = :p',
             ExpressionAttributeValues={
                 ':p': {'N': str(poll_id)}
             }
         )
+        self._update_cached_suggestions(version, lambda suggestions: suggestions)
 
     def get_current_suggestions(self, bypass_cache=False) -> List[Suggestion]:
-        global cached_suggestions
-        global last_suggestions_update_time
-        now = datetime.datetime.utcnow()
-        if not bypass_cache and now < last_suggestions_update_time + CACHE_TTL:
-            return cached_suggestions
+        if bypass_cache:
+            self.week_reads.clear()
+        else:
+            cached = self._get_cached_suggestions()
+            if cached is not None:
+                return cached
 
-        get_result = self.dynamodb.get_item(
-            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
-            Key={'id': {'S': 'current'}}
-        )
-        item = get_result.get('Item')
+        item = self._get_week()
         if not item:
             return []
-        suggestions_map = item['venues']['M']
-        suggestions = [make_suggestion(k, v) for k, v in suggestions_map.items()]
-        cached_suggestions = suggestions
-        last_suggestions_update_time = now
+        suggestions = [make_suggestion(k, v) for k, v in item['venues']['M'].items()]
+        self._cache_suggestions(suggestions, get_version(item))
         return suggestions
 
 
     def get_suggestion_by_uuid(self, hex_uuid: str) -> Optional[Suggestion]:
-        get_result = self.dynamodb.get_item(
-            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
-            Key={'id': {'S': 'current'}},
-        )
-        venue_data = get_result.get('Item', {}).get('venues', {}).get('M', {}).get(hex_uuid)
+        cached = self._get_cached_suggestions()
+        if cached is not None:
+            return next((suggestion for suggestion in cached if suggestion.uuid == hex_uuid), None)
+
+        item = self._get_week(('venues', hex_uuid))
+        venue_data = item.get('venues', {}).get('M', {}).get(hex_uuid)
         if not venue_data:
             return None
         return make_suggestion(hex_uuid, venue_data)
 
+    def get_suggestion_count(self) -> int:
+        cached = self._get_cached_suggestions()
+        if cached is not None:
+            return len(cached)
+        # Dynamo can't project the size of a map, but this at least leaves out the rest of the item.
+        item = self._get_week(('venues',))
+        return len(item.get('venues', {}).get('M', {}))
+
 
     def clear_suggestions(self) -> None:
-        global cached_suggestions
-        global last_suggestions_update_time
-        self.dynamodb.update_item(
-            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
-            Key={'id': {'S': 'current'}},
-            UpdateExpression="SET venues = :empty",
+        version = self._update_week(
+            "SET venues = :empty, venue_keys = :empty",
             ExpressionAttributeValues={
                 ':empty': {'M': {}}
             }
         )
-        cached_suggestions.clear()
-        last_suggestions_update_time = datetime.datetime.utcnow()
+        self._cache_suggestions([], version)
 
 
-    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str):
-        cached_suggestions.append(Suggestion(hex_uuid, venue, user_id, user_handle))
-
-        self.dynamodb.update_item(
-            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
-            Key={'id': {'S': 'current'}},
-            UpdateExpression='SET venues.#uuid = :value',
-            ConditionExpression='size(venues) < :max_suggestions',
+    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str) -> AddSuggestionResult:
+        # venue_keys maps the normalized name of each venue to its uuid, so a duplicate fails the condition.
+        request: Dict[str, Any] = dict(
+            ConditionExpression='attribute_not_exists(venue_keys.#key) AND size(venues) < :max_suggestions',
             ExpressionAttributeNames={
-                '#uuid': hex_uuid
+                '#uuid': hex_uuid,
+                '#key': normalize_venue(venue)
             },
             ExpressionAttributeValues={
                 ':value': {'M': {
@@ -172,23 +366,106 @@ class DynamoDatabase(Database):
                     'user_id': {'N': str(user_id)},
                     'user_handle': {'S': user_handle}
                 }},
+                ':uuid': {'S': hex_uuid},
                 ':max_suggestions': {'N': str(MAX_SUGGESTIONS)}
-            }
+            },
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
         )
+        for attempt in range(ADD_SUGGESTION_ATTEMPTS):
+            try:
+                version = self._update_week_indexed('SET venues.#uuid = :value, venue_keys.#key = :uuid', request)
+                break
+            except self.dynamodb.exceptions.ConditionalCheckFailedException as err:
+                item = err.response.get('Item', {})
+                rejected = self._rejected_suggestion(venue, item)
+                if rejected is not None:
+                    return rejected
+                self._remove_stale_key(venue, item)
+        else:
+            raise RuntimeError(f'Unable to add a suggestion for {venue!r}, which keeps failing its condition')
+
+        suggestion = Suggestion(hex_uuid, venue, user_id, user_handle)
+        self._update_cached_suggestions(version, lambda suggestions: suggestions + [suggestion])
+        return AddSuggestionResult(added=True)
+
+    def _rejected_suggestion(self, venue: str, item: Dict[str, Any]) -> Optional[AddSuggestionResult]:
+        """Why an add failed its condition, or None if it shouldn't have (the venue's key is stale)."""
+        venues = item.get('venues', {}).get('M', {})
+        # The failed write tells us what the item looks like, so might as well cache it.
+        if item:
+            self._cache_suggestions([make_suggestion(k, v) for k, v in venues.items()], get_version(item))
+
+        existing_uuid = item.get('venue_keys', {}).get('M', {}).get(normalize_venue(venue), {}).get('S')
+        if existing_uuid is not None and existing_uuid in venues:
+            return AddSuggestionResult(added=False, existing=make_suggestion(existing_uuid, venues[existing_uuid]))
+        if len(venues) >= MAX_SUGGESTIONS:
+            return AddSuggestionResult(added=False, full=True)
+        return None
+
+    def _remove_stale_key(self, venue: str, item: Dict[str, Any]) -> None:
+        """Drop a venue key that points at a suggestion that isn't there anymore, so the venue can be added again."""
+        stale_uuid = item.get('venue_keys', {}).get('M', {}).get(normalize_venue(venue), {}).get('S')
+        if stale_uuid is None:
+            return
+        print(f'Removing the key for {venue!r}, which points at missing suggestion {stale_uuid}')
+        try:
+            self._update_week(
+                'REMOVE venue_keys.#key',
+                ConditionExpression='venue_keys.#key = :uuid',
+                ExpressionAttributeNames={'#key': normalize_venue(venue)},
+                ExpressionAttributeValues={':uuid': {'S': stale_uuid}}
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            # Someone else changed it first, which the next attempt will see.
+            pass
 
 
     def remove_suggestion(self, hex_uuid: str):
-        self.dynamodb.update_item(
-            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
-            Key={'id': {'S': 'current'}},
-            UpdateExpression='REMOVE venues.#uuid',
-            ExpressionAttributeNames={
-                '#uuid': hex_uuid
-            }
+        suggestion = self.get_suggestion_by_uuid(hex_uuid)
+        if suggestion is None:
+            update_expression = 'REMOVE venues.#uuid'
+            request: Dict[str, Any] = dict(ExpressionAttributeNames={'#uuid': hex_uuid})
+        else:
+            update_expression = 'REMOVE venues.#uuid, venue_keys.#key'
+            request = dict(
+                ConditionExpression='attribute_not_exists(venue_keys.#key) OR venue_keys.#key = :uuid',
+                ExpressionAttributeNames={'#uuid': hex_uuid, '#key': normalize_venue(suggestion.venue)},
+                ExpressionAttributeValues={':uuid': {'S': hex_uuid}}
+            )
+        try:
+            version = self._update_week_indexed(update_expression, request)
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            # The key belongs to another suggestion for the same venue (weeks from before venue_keys could have
+            # duplicates), so leave it alone and only remove this one.
+            version = self._update_week('REMOVE venues.#uuid', ExpressionAttributeNames={'#uuid': hex_uuid})
+        self._update_cached_suggestions(
+            version, lambda suggestions: [suggestion for suggestion in suggestions if suggestion.uuid != hex_uuid]
         )
-        # Invalidate the cache
-        global last_suggestions_update_time
-        last_suggestions_update_time = datetime.datetime(day=1, month=1, year=1)
+
+    def _update_week_indexed(self, update_expression: str, request: Dict[str, Any]) -> int:
+        """Make an update that touches venue_keys, first adding it if the week item was written before it existed."""
+        try:
+            return self._update_week(update_expression, **request)
+        except self.dynamodb.exceptions.ClientError as err:
+            if err.response.get('Error', {}).get('Code') != 'ValidationException':
+                raise
+        self._index_venues()
+        return self._update_week(update_expression, **request)
+
+    def _index_venues(self) -> None:
+        print('Adding venue_keys to the week item')
+        venues = self._get_week(('venues',), consistent=True).get('venues', {}).get('M', {})
+        keys = {normalize_venue(v['M']['name']['S']): {'S': k} for k, v in venues.items()}
+        try:
+            version = self._update_week(
+                'SET venue_keys = :keys',
+                ConditionExpression='attribute_not_exists(venue_keys)',
+                ExpressionAttributeValues={':keys': {'M': keys}}
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            # Somebody else got to it first.
+            return
+        self._update_cached_suggestions(version, lambda suggestions: suggestions)
 
     def add_scheduled_venue(self, hex_uuid: str, venue_name: str, cron: str, duration_minutes: int) -> None:
         self.dynamodb.update_item(
@@ -230,19 +507,104 @@ class DynamoDatabase(Database):
         scheduled_venues = [make_scheduled_venue(k, v) for k, v in events_map.items()]
         return scheduled_venues
 
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        item = self.dynamodb.get_item(
+            TableName=self.app.DYNAMO_WEEK_TABLE_NAME,
+            Key={'id': {'S': 'stats'}},
+            ConsistentRead=True
+        ).get('Item')
+        return json.loads(item['aggregates']['S']) if item else None
+
+    def save_stats(self, entry: Dict[str, Any], aggregates: Dict[str, Any], expected_version: int) -> bool:
+        try:
+            self.dynamodb.transact_write_items(TransactItems=make_stats_transaction(
+                self.app.DYNAMO_WEEK_TABLE_NAME,
+                {'id': {'S': 'stats'}},
+                {'id': {'S': STATS_ARCHIVE_PREFIX + stats_archive_id(entry)}},
+                entry, aggregates, expected_version
+            ))
+        except self.dynamodb.exceptions.TransactionCanceledException:
+            return False
+        return True
+
+    def replace_stats(self, aggregates: Dict[str, Any], expected_version: int) -> bool:
+        try:
+            self.dynamodb.update_item(**make_stats_update(
+                self.app.DYNAMO_WEEK_TABLE_NAME, {'id': {'S': 'stats'}}, aggregates, expected_version
+            ))
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def get_stats_archive(self) -> List[Dict[str, Any]]:
+        # The week table only has a handful of other items, and the archive is only read to rebuild the totals.
+        request: Dict[str, Any] = {
+            'TableName': self.app.DYNAMO_WEEK_TABLE_NAME,
+            'ConsistentRead': True,
+            'FilterExpression': 'begins_with(id, :prefix)',
+            'ExpressionAttributeValues': {':prefix': {'S': STATS_ARCHIVE_PREFIX}},
+        }
+        items: List[Dict[str, Any]] = []
+        while True:
+            result = self.dynamodb.scan(**request)
+            items.extend(result.get('Items', []))
+            if 'LastEvaluatedKey' not in result:
+                break
+            request['ExclusiveStartKey'] = result['LastEvaluatedKey']
+        items.sort(key=lambda item: item['id']['S'])
+        return [json.loads(item['entry']['S']) for item in items]
+
+    def get_snapshot(self) -> Snapshot:
+        week_table = self.app.DYNAMO_WEEK_TABLE_NAME
+        events_table = self.app.DYNAMO_EVENTS_TABLE_NAME
+        if not week_table or not events_table or events_table == week_table:
+            return super().get_snapshot()
+
+        key = {'Keys': [{'id': {'S': 'current'}}], 'ConsistentRead': True}
+        request_items: Dict[str, Any] = {week_table: key, events_table: key}
+        items: Dict[str, Dict[str, Any]] = {}
+        result = self.dynamodb.batch_get_item(RequestItems=request_items)
+        for table, table_items in result.get('Responses', {}).items():
+            for item in table_items:
+                items[table] = item
+        unprocessed = result.get('UnprocessedKeys')
+        if unprocessed:
+            # Retried by read_snapshot, which can back off without holding up the event loop.
+            raise SnapshotUnprocessed(f'Dynamo left {list(unprocessed)} unread')
+
+        week = items.get(week_table, {})
+        suggestions = [make_suggestion(k, v) for k, v in week.get('venues', {}).get('M', {}).items()]
+        if week:
+            self.week_reads[((), True)] = week
+            self._cache_suggestions(suggestions, get_version(week))
+        events = items.get(events_table, {}).get('events', {}).get('M', {})
+        return Snapshot(
+            poll_id=int(week.get('poll_id', {}).get('N', 0)),
+            suggestions=suggestions,
+            scheduled_venues=[make_scheduled_venue(k, v) for k, v in events.items()]
+        )
+
+
+async def read_snapshot(db: Database) -> Snapshot:
+    """`db.get_snapshot()`, backing off and reading it again while dynamo is throttling us."""
+    for attempt in range(SNAPSHOT_READ_ATTEMPTS - 1):
+        try:
+            return db.get_snapshot()
+        except SnapshotUnprocessed as err:
+            print(f'{err}, reading the snapshot again')
+            await asyncio.sleep(0.05 * 2 ** attempt)
+    return db.get_snapshot()
 
-cached_membership: Dict[int, Tuple[str, datetime.datetime]] = {}
 
+# Used when the caller doesn't have a shared store.
+_members = MemoryMembershipStore(CACHE_TTL.total_seconds())
 
-async def get_user_status_in_main_chat(bot: telegram.Bot, app: AppSettings, user_id: int) -> str:
-    now = datetime.datetime.utcnow()
 
-    cached_result = cached_membership.get(user_id)
-    if cached_result is not None:
-        status, last_lookup = cached_result
-        if last_lookup + CACHE_TTL > now:
-            # cached result is still valid.
-            return status
+async def get_user_status_in_main_chat(bot: telegram.Bot, app: AppSettings, user_id: int, members: Optional[MembershipStore] = None) -> str:
+    members = members or _members
+    status = members.get(app.MAIN_CHAT_ID, user_id)
+    if status is not None:
+        return status
 
     result = await bot.get_chat_member(
         chat_id=app.MAIN_CHAT_ID,
@@ -251,16 +613,15 @@ async def get_user_status_in_main_chat(bot: telegram.Bot, app: AppSettings, user
 
     print(f'User status of user id {user_id} is {result.status}')
 
-    cached_membership[user_id] = (result.status, now)
+    members.put(app.MAIN_CHAT_ID, user_id, result.status)
     return result.status
 
 
-async def is_user_part_of_main_chat(bot: telegram.Bot, app: AppSettings, user_id: int) -> bool:
-    status = await get_user_status_in_main_chat(bot, app, user_id)
-    return status in (telegram.ChatMember.OWNER, telegram.ChatMember.ADMINISTRATOR,
-                      telegram.ChatMember.MEMBER, telegram.ChatMember.RESTRICTED)
+async def is_user_part_of_main_chat(bot: telegram.Bot, app: AppSettings, user_id: int, members: Optional[MembershipStore] = None) -> bool:
+    status = await get_user_status_in_main_chat(bot, app, user_id, members)
+    return status in MEMBER_STATUSES
 
 
-async def is_user_admin_of_main_chat(bot: telegram.Bot, app: AppSettings, user_id: int) -> bool:
-    status = await get_user_status_in_main_chat(bot, app, user_id)
+async def is_user_admin_of_main_chat(bot: telegram.Bot, app: AppSettings, user_id: int, members: Optional[MembershipStore] = None) -> bool:
+    status = await get_user_status_in_main_chat(bot, app, user_id, members)
     return status in (telegram.ChatMember.OWNER, telegram.ChatMember.ADMINISTRATOR)
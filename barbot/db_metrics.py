@@ -0,0 +1,155 @@
+"""
+Timing for the database: how long each `Database` method takes, and what each DynamoDB call under it cost.
+
+`DynamoInstrumentation` hooks into a boto3 client's events, so every call made with it (by any backend, the update
+ledger or the membership store) is recorded under `dynamodb.<Operation>` with its retries and consumed capacity.
+`InstrumentedDatabase` wraps a `Database` and records each method under `db.<method>`, including the retries and
+capacity of the DynamoDB calls it made.
+"""
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from .database import AddSuggestionResult, Database, ScheduledVenue, Snapshot, Suggestion
+from .metrics import Metrics
+
+T = TypeVar('T')
+
+
+def get_capacity_units(parsed: Dict[str, Any]) -> float:
+    # A single table operation returns a dict, batches and transactions a list with one per table.
+    consumed = parsed.get('ConsumedCapacity')
+    if not consumed:
+        return 0.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return float(sum(c.get('CapacityUnits', 0.0) for c in consumed))
+
+
+class DynamoInstrumentation(object):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        # The Database method currently running, which DynamoDB calls are also attributed to.
+        self.operation: Optional[str] = None
+        self.operation_retries = 0
+        self.operation_capacity_units = 0.0
+
+    def register(self, client: Any) -> None:
+        events = client.meta.events
+        events.register('provide-client-params.dynamodb', self._provide_params)
+        events.register('before-call.dynamodb', self._before_call)
+        events.register('after-call.dynamodb', self._after_call)
+        events.register('after-call-error.dynamodb', self._after_call_error)
+
+    def _provide_params(self, params: Dict[str, Any], model: Any, **kwargs: Any) -> None:
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def _before_call(self, model: Any, context: Dict[str, Any], **kwargs: Any) -> None:
+        context['barbot_operation'] = model.name
+        context['barbot_started'] = time.monotonic()
+
+    def _after_call(self, http_response: Any, parsed: Dict[str, Any], model: Any, context: Dict[str, Any],
+                    **kwargs: Any) -> None:
+        retries = int(parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+        capacity_units = get_capacity_units(parsed)
+        self.metrics.record(
+            f'dynamodb.{model.name}',
+            time.monotonic() - context.get('barbot_started', time.monotonic()),
+            retries,
+            error=http_response.status_code >= 300,
+            capacity_units=capacity_units
+        )
+        self.operation_retries += retries
+        self.operation_capacity_units += capacity_units
+
+    def _after_call_error(self, exception: Exception, context: Dict[str, Any], **kwargs: Any) -> None:
+        # The request never got an HTTP response (a timeout, say), so there's no model or metadata to go on.
+        seconds = time.monotonic() - context.get('barbot_started', time.monotonic())
+        self.metrics.record(f'dynamodb.{context.get("barbot_operation", "unknown")}', seconds, error=True)
+
+    def start(self, operation: str) -> None:
+        self.operation = operation
+        self.operation_retries = 0
+        self.operation_capacity_units = 0.0
+
+    def finish(self, seconds: float, error: bool) -> None:
+        if self.operation is not None:
+            self.metrics.record(self.operation, seconds, self.operation_retries, error, self.operation_capacity_units)
+        self.operation = None
+
+
+class InstrumentedDatabase(Database):
+    def __init__(self, db: Database, metrics: Metrics, instrumentation: Optional[DynamoInstrumentation] = None):
+        self.db = db
+        self.metrics = metrics
+        self.instrumentation = instrumentation if instrumentation is not None else DynamoInstrumentation(metrics)
+
+    def __getattr__(self, name: str) -> Any:
+        # Anything that isn't part of Database (SqliteDatabase.close, say) goes straight through.
+        return getattr(self.db, name)
+
+    def _call(self, name: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # Database methods are synchronous, so only one can be running at a time.
+        self.instrumentation.start(f'db.{name}')
+        started = time.monotonic()
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            self.instrumentation.finish(time.monotonic() - started, error)
+
+    def log_stats(self) -> None:
+        self.metrics.log('Database')
+
+    def begin_invocation(self) -> None:
+        self.db.begin_invocation()
+
+    def get_current_poll_id(self) -> int:
+        return self._call('get_current_poll_id', self.db.get_current_poll_id)
+
+    def set_current_poll_id(self, poll_id: int) -> None:
+        self._call('set_current_poll_id', self.db.set_current_poll_id, poll_id)
+
+    def get_current_suggestions(self, bypass_cache=False) -> List[Suggestion]:
+        return self._call('get_current_suggestions', self.db.get_current_suggestions, bypass_cache)
+
+    def get_suggestion_by_uuid(self, hex_uuid: str) -> Optional[Suggestion]:
+        return self._call('get_suggestion_by_uuid', self.db.get_suggestion_by_uuid, hex_uuid)
+
+    def get_suggestion_count(self) -> int:
+        return self._call('get_suggestion_count', self.db.get_suggestion_count)
+
+    def clear_suggestions(self) -> None:
+        self._call('clear_suggestions', self.db.clear_suggestions)
+
+    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str) -> AddSuggestionResult:
+        return self._call('add_suggestion', self.db.add_suggestion, hex_uuid, venue, user_id, user_handle)
+
+    def remove_suggestion(self, hex_uuid: str):
+        self._call('remove_suggestion', self.db.remove_suggestion, hex_uuid)
+
+    def add_scheduled_venue(self, hex_uuid: str, venue_name: str, cron: str, duration_minutes: int) -> None:
+        self._call('add_scheduled_venue', self.db.add_scheduled_venue, hex_uuid, venue_name, cron, duration_minutes)
+
+    def remove_scheduled_venue(self, hex_uuid: str) -> None:
+        self._call('remove_scheduled_venue', self.db.remove_scheduled_venue, hex_uuid)
+
+    def get_scheduled_venues(self) -> List[ScheduledVenue]:
+        return self._call('get_scheduled_venues', self.db.get_scheduled_venues)
+
+    def get_snapshot(self) -> Snapshot:
+        return self._call('get_snapshot', self.db.get_snapshot)
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        return self._call('get_stats', self.db.get_stats)
+
+    def save_stats(self, entry: Dict[str, Any], aggregates: Dict[str, Any], expected_version: int) -> bool:
+        return self._call('save_stats', self.db.save_stats, entry, aggregates, expected_version)
+
+    def replace_stats(self, aggregates: Dict[str, Any], expected_version: int) -> bool:
+        return self._call('replace_stats', self.db.replace_stats, aggregates, expected_version)
+
+    def get_stats_archive(self) -> List[Dict[str, Any]]:
+        return self._call('get_stats_archive', self.db.get_stats_archive)
@@ -0,0 +1,107 @@
+"""
+Telegram re-delivers an update if the webhook is slow to respond (a cold start, or rendering a map), which used to mean
+duplicate replies and reactions. The ledger remembers which update_ids have already been claimed, so duplicates can be
+dropped before doing any work.
+"""
+import abc
+import collections
+import time
+import traceback
+from typing import Any, Callable, Optional
+
+from .app import AppSettings
+
+
+class UpdateLedger(abc.ABC):
+    @abc.abstractmethod
+    def claim(self, update_id: int) -> bool:
+        """Returns True if the update hasn't been seen before, and should be handled."""
+        pass
+
+    @abc.abstractmethod
+    def release(self, update_id: int) -> None:
+        """Forget an update that couldn't be handled, so that a re-delivery of it is handled."""
+        pass
+
+
+class MemoryUpdateLedger(UpdateLedger):
+    """Remembers recent updates in this process only. Used as a front cache, and on its own for tests."""
+    def __init__(self, ttl_seconds: float, max_size: int, clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.clock = clock
+        self.expiry_times: collections.OrderedDict[int, float] = collections.OrderedDict()
+
+    def contains(self, update_id: int) -> bool:
+        expires_at = self.expiry_times.get(update_id)
+        return expires_at is not None and expires_at > self.clock()
+
+    def add(self, update_id: int) -> None:
+        self.expiry_times[update_id] = self.clock() + self.ttl_seconds
+        self.expiry_times.move_to_end(update_id)
+        while len(self.expiry_times) > self.max_size:
+            self.expiry_times.popitem(last=False)
+
+    def claim(self, update_id: int) -> bool:
+        if self.contains(update_id):
+            return False
+        self.add(update_id)
+        return True
+
+    def release(self, update_id: int) -> None:
+        self.expiry_times.pop(update_id, None)
+
+
+class DynamoUpdateLedger(UpdateLedger):
+    """Claims updates with a conditional write, so a re-delivery that lands on another container is also dropped.
+
+    The table should have DynamoDB's TTL enabled on `expires_at` to clean up old entries.
+    """
+    def __init__(self, app: AppSettings, dynamodb: Any, front_cache: MemoryUpdateLedger):
+        self.app = app
+        self.dynamodb = dynamodb
+        self.front_cache = front_cache
+
+    def claim(self, update_id: int) -> bool:
+        if self.front_cache.contains(update_id):
+            return False
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.app.DYNAMO_UPDATES_TABLE_NAME,
+                Item={
+                    'id': {'S': str(update_id)},
+                    'expires_at': {'N': str(now + self.app.UPDATE_LEDGER_TTL_SECONDS)},
+                },
+                # TTL deletes expired items lazily, so they might still be around.
+                ConditionExpression='attribute_not_exists(id) OR expires_at < :now',
+                ExpressionAttributeValues={
+                    ':now': {'N': str(now)}
+                }
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            self.front_cache.add(update_id)
+            return False
+        except Exception:
+            # Handling an update twice is better than not handling it at all.
+            print(f'Unable to record update {update_id}, handling it anyway')
+            traceback.print_exc()
+        self.front_cache.add(update_id)
+        return True
+
+    def release(self, update_id: int) -> None:
+        self.front_cache.release(update_id)
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.app.DYNAMO_UPDATES_TABLE_NAME,
+                Key={'id': {'S': str(update_id)}}
+            )
+        except Exception:
+            traceback.print_exc()
+
+
+def make_update_ledger(app: AppSettings, dynamodb: Optional[Any]) -> UpdateLedger:
+    front_cache = MemoryUpdateLedger(app.UPDATE_LEDGER_TTL_SECONDS, app.UPDATE_LEDGER_CACHE_SIZE)
+    if app.DYNAMO_UPDATES_TABLE_NAME and dynamodb is not None:
+        return DynamoUpdateLedger(app, dynamodb, front_cache)
+    return front_cache
@@ -1,17 +1,72 @@
 import asyncio
 import base64
 import concurrent.futures
-import folium
-from selenium import webdriver
+import threading
 import time
-from typing import List, Tuple, TypeAlias, Dict, cast
+from typing import Any, List, Optional, Tuple, TypeAlias, Dict, cast
 
 from . import bars
 from .app import AppSettings
+from . import map_cache
+from .browser_pool import BrowserPool
+from .metrics import Metrics
 
 LatLon: TypeAlias = Tuple[float, float]
 
 MAP_PADDING = 0.005  # measured in lat/lon
+# Part of every cached map's key. Change it whenever a change here makes maps look different.
+RENDERER_VERSION = 1
+
+# Put in the page before the map is created, so it sees everything the map does. The map's first move after it's
+# created is the FitBounds, and it's ready once that's done, its tiles have loaded, and its marker icons (a sprite
+# image and a font) have loaded too.
+READY_SCRIPT = """
+<script>
+(function () {
+    var render = window.barbotRender = {map: null, boundsFitted: false, iconImages: {}};
+    L.Map.addInitHook(function () {
+        render.map = this;
+        this.once("moveend", function () { render.boundsFitted = true; });
+    });
+    render.isReady = function () {
+        if (!render.map || !render.boundsFitted || document.fonts.status !== "loaded") {
+            return false;
+        }
+        var tilesLoading = false;
+        render.map.eachLayer(function (layer) {
+            if (layer instanceof L.GridLayer && layer.isLoading()) {
+                tilesLoading = true;
+            }
+        });
+        if (tilesLoading) {
+            return false;
+        }
+        var icons = document.querySelectorAll(".leaflet-marker-icon");
+        for (var i = 0; i < icons.length; i++) {
+            var url = /url\\(["']?(.*?)["']?\\)/.exec(getComputedStyle(icons[i]).backgroundImage);
+            if (!url) {
+                continue;
+            }
+            var image = render.iconImages[url[1]];
+            if (!image) {
+                image = render.iconImages[url[1]] = new Image();
+                image.src = url[1];
+            }
+            if (!image.complete) {
+                return false;
+            }
+        }
+        return true;
+    };
+})();
+</script>
+"""
+IS_READY = "return !!(window.barbotRender && window.barbotRender.isReady());"
+READY_POLL_SECONDS = 0.05
+
+# How long renders take to become ready (errors are renders that timed out), for as long as the process lives.
+render_metrics = Metrics()
+_render_metrics_lock = threading.Lock()
 
 
 def _get_bounds(coordinates: List[LatLon], padding: float) -> Tuple[LatLon, LatLon]:
@@ -28,46 +83,144 @@ def _get_center(coordinates: List[LatLon]) -> LatLon:
     return lat, lon
 
 
-def _render_html(html: str, app: AppSettings) -> bytes:
-    html_base64 = base64.b64encode(html.encode("utf-8")).decode()
+def _make_driver(app: AppSettings) -> Any:
+    # selenium is only needed when we actually render a map, so don't make every cold start pay for it.
+    from selenium import webdriver
+
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
     driver = webdriver.Remote(command_executor=app.SELENIUM_SERVER_URL, options=options)
     try:
-        driver.get("data:text/html;base64," + html_base64)
         driver.fullscreen_window()
-        time.sleep(2)  # let the map adjust to initial render
-        div = driver.find_element("class name", "folium-map")
-        png = div.screenshot_as_png
     except:
-        raise
-    finally:
         driver.quit()
-    return png
+        raise
+    return driver
 
 
-def _map_bars_to_png(
-    bars: List[bars.Bar], dimensions: Tuple[int, int], app: AppSettings
-) -> Tuple[Dict[str, bars.Bar], bytes]:
-    if not bars:
-        return {}, bytes()
+# One pool per selenium server, for as long as the process lives.
+_pools: Dict[str, BrowserPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_browser_pool(app: AppSettings) -> BrowserPool:
+    with _pools_lock:
+        pool = _pools.get(app.SELENIUM_SERVER_URL)
+        if pool is None:
+            pool = _pools[app.SELENIUM_SERVER_URL] = BrowserPool(
+                lambda: _make_driver(app),
+                app.SELENIUM_POOL_SIZE,
+                app.SELENIUM_SESSION_MAX_RENDERS,
+                app.SELENIUM_POOL_WAIT_SECONDS,
+                app.SELENIUM_SESSION_MAX_IDLE_SECONDS,
+            )
+        return pool
+
+
+_map_cache: Optional[map_cache.MapCache] = None
+_map_cache_lock = threading.Lock()
+
+
+def get_map_cache(app: AppSettings) -> map_cache.MapCache:
+    global _map_cache
+    with _map_cache_lock:
+        if _map_cache is None:
+            disk = None
+            if app.MAP_CACHE_DIR:
+                disk = map_cache.DirectoryBlobStore(app.MAP_CACHE_DIR, app.MAP_CACHE_DISK_ENTRIES)
+            _map_cache = map_cache.MapCache(app.MAP_CACHE_MEMORY_ENTRIES, disk, map_cache.make_blob_store(app))
+        return _map_cache
+
+
+def log_stats() -> None:
+    render_metrics.log('Maps')
+    if _map_cache is not None:
+        _map_cache.metrics.log('Map cache')
+
+
+def close_browser_pools() -> None:
+    """
+    Quit the pooled browser sessions. Only the polling runtime calls this, on its way out. A lambda is frozen rather
+    than stopped, so its sessions are left for the pool's idle limit, or the selenium server's own timeout, to end.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _wait_until_ready(driver: Any, timeout: float) -> bool:
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=READY_POLL_SECONDS).until(
+            lambda d: d.execute_script(IS_READY)
+        )
+        return True
+    except TimeoutException:
+        return False
+
+
+def _render_html(html: str, app: AppSettings) -> Tuple[bytes, bool]:
+    """The screenshot, and whether the map had finished loading when it was taken."""
+    html_base64 = base64.b64encode(html.encode("utf-8")).decode()
+    with get_browser_pool(app).session() as driver:
+        started = time.monotonic()
+        driver.get("data:text/html;base64," + html_base64)
+        ready = _wait_until_ready(driver, app.MAP_RENDER_TIMEOUT_SECONDS)
+        seconds = time.monotonic() - started
+        with _render_metrics_lock:
+            render_metrics.record("map.ready", seconds, error=not ready)
+        if ready:
+            print(f"Map ready in {seconds * 1000:.0f} ms")
+        else:
+            # Better a map with some grey tiles than no map at all.
+            print(f"Map still not ready after {seconds * 1000:.0f} ms, taking the screenshot anyway")
+        div = driver.find_element("class name", "folium-map")
+        return div.screenshot_as_png, ready
+
+
+def _render_bars(bars: List[bars.Bar], dimensions: Tuple[int, int], app: AppSettings) -> Tuple[bytes, bool]:
+    # folium pulls in numpy, jinja2 and branca, which is most of our import time. Load it on first render.
+    import folium
+
     coordinates = [(b.latitude, b.longitude) for b in bars]
     folium_map = folium.Map(
         location=_get_center(coordinates), width=dimensions[0], height=dimensions[1]
     )
-    # please please please let us never have more than 26 bars
-    letter_map = {}
+    folium_map.get_root().html.add_child(folium.Element(READY_SCRIPT))
     for index, coordinate in enumerate(coordinates):
-        letter = chr(ord("a") + index)
-        letter_map[letter.upper()] = bars[index]
         folium.Marker(
             location=coordinate,
-            icon=folium.Icon(icon=letter, prefix="fa"),
+            icon=folium.Icon(icon=chr(ord("a") + index), prefix="fa"),
         ).add_to(folium_map)
     folium.FitBounds(_get_bounds(coordinates, MAP_PADDING), padding=(2,2)).add_to(folium_map)
     html = folium_map.get_root().render()
-    return letter_map, _render_html(cast(str, html), app)
+    return _render_html(cast(str, html), app)
+
+
+def _map_bars_to_png(
+    bars: List[bars.Bar], dimensions: Tuple[int, int], app: AppSettings
+) -> Tuple[Dict[str, bars.Bar], bytes]:
+    if not bars:
+        return {}, bytes()
+    # please please please let us never have more than 26 bars
+    letter_map = {chr(ord("A") + index): bar for index, bar in enumerate(bars)}
+    # Everything that changes how the map looks. Names and addresses aren't on it.
+    key = map_cache.cache_key(
+        RENDERER_VERSION, dimensions, [(letter, bar.latitude, bar.longitude) for letter, bar in letter_map.items()]
+    )
+    cache = get_map_cache(app)
+    png = cache.get(key)
+    if png is None:
+        png, ready = _render_bars(bars, dimensions, app)
+        # A map that timed out probably has grey tiles, so it's shown this once but rendered again next time.
+        if ready:
+            cache.put(key, png)
+    return letter_map, png
 
 
 async def map_bars_to_png(
@@ -0,0 +1,162 @@
+"""
+Rendered maps, kept by a hash of everything that goes into them, so the same suggestions aren't rendered twice.
+
+A lookup tries each tier in turn: a small in-memory LRU, a directory on local disk (which outlives a warm lambda's
+memory only as long as the container does), and then a `BlobStore` shared between processes. Whatever a lower tier
+finds is copied into the tiers above it.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from .app import AppSettings
+from .metrics import Metrics
+
+
+def cache_key(*parts: Any) -> str:
+    """A key for whatever's passed in, which has to be JSON serializable."""
+    return hashlib.sha256(json.dumps(parts, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class BlobStore(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        pass
+
+
+class DirectoryBlobStore(BlobStore):
+    """A file per key. Stands in for a real blob store, and is the disk tier."""
+    def __init__(self, directory: str, max_entries: Optional[int] = None):
+        self.directory = directory
+        # The least recently used files are removed past this many. None to keep everything.
+        self.max_entries = max_entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self.max_entries is not None:
+            # Pruning goes by mtime, so a read counts as a use.
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        # Written next to the file and renamed over it, so a reader never sees half a map.
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        if self.max_entries is not None:
+            self._prune(self.max_entries)
+
+    def _prune(self, max_entries: int) -> None:
+        entries: List[Tuple[float, str]] = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.png'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def make_blob_store(app: AppSettings) -> Optional[BlobStore]:
+    if not app.MAP_BLOB_STORE:
+        return None
+    if app.MAP_BLOB_STORE == 'local':
+        if not app.MAP_BLOB_STORE_DIR:
+            raise ValueError('MAP_BLOB_STORE is local, but MAP_BLOB_STORE_DIR is not set')
+        return DirectoryBlobStore(app.MAP_BLOB_STORE_DIR)
+    raise ValueError(f'Unknown MAP_BLOB_STORE {app.MAP_BLOB_STORE!r}')
+
+
+class MapCache(object):
+    def __init__(self, memory_entries: int, disk: Optional[BlobStore], blob_store: Optional[BlobStore],
+                 metrics: Optional[Metrics] = None):
+        self.memory_entries = memory_entries
+        self.disk = disk
+        self.blob_store = blob_store
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        # Renders run in worker threads.
+        self._lock = threading.Lock()
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if self.memory_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _record(self, name: str, started: float) -> None:
+        with self._lock:
+            self.metrics.record(name, time.monotonic() - started)
+
+    def get(self, key: str) -> Optional[bytes]:
+        started = time.monotonic()
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            self._record('map_cache.memory', started)
+            return data
+        for tier, store, above in (('disk', self.disk, []), ('blob', self.blob_store, [self.disk])):
+            if store is None:
+                continue
+            try:
+                data = store.get(key)
+            except Exception as err:
+                print(f'Unable to read a map from the {tier} cache: {err!r}')
+                continue
+            if data is None:
+                continue
+            self._record(f'map_cache.{tier}', started)
+            for upper in above:
+                self._put(upper, key, data)
+            self._remember(key, data)
+            return data
+        self._record('map_cache.miss', started)
+        return None
+
+    def put(self, key: str, data: bytes) -> None:
+        self._remember(key, data)
+        self._put(self.disk, key, data)
+        self._put(self.blob_store, key, data)
+
+    @staticmethod
+    def _put(store: Optional[BlobStore], key: str, data: bytes) -> None:
+        if store is None:
+            return
+        try:
+            store.put(key, data)
+        except Exception as err:
+            print(f'Unable to save a map to the cache: {err!r}')
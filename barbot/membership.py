@@ -0,0 +1,108 @@
+"""
+Who is in which chat, so that checking whether someone may use the bot doesn't need a getChatMember call every time.
+
+Telegram tells us about membership changes with chat_member updates (the bot has to be an admin of the chat, and ask
+for them in allowed_updates), which keep the store current. getChatMember is only used for users we haven't heard about.
+"""
+import abc
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import telegram
+
+from .app import AppSettings
+
+# Statuses that count as being in the chat.
+MEMBER_STATUSES = (telegram.ChatMember.OWNER, telegram.ChatMember.ADMINISTRATOR, telegram.ChatMember.MEMBER,
+                   telegram.ChatMember.RESTRICTED)
+
+
+class MembershipStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, chat_id: int, user_id: int) -> Optional[str]:
+        """The user's status in the chat, or None if we don't know it (anymore)."""
+        pass
+
+    @abc.abstractmethod
+    def put(self, chat_id: int, user_id: int, status: str, updated_at: Optional[float] = None) -> None:
+        """Record a status, unless we already know of one from after `updated_at` (a unix timestamp, default now)."""
+        pass
+
+
+class MemoryMembershipStore(MembershipStore):
+    def __init__(self, ttl_seconds: float, clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        # (chat id, user id) -> (status, updated at, expires at)
+        self.statuses: Dict[Tuple[int, int], Tuple[str, float, float]] = {}
+
+    def get(self, chat_id: int, user_id: int) -> Optional[str]:
+        entry = self.statuses.get((chat_id, user_id))
+        if entry is None or entry[2] <= self.clock():
+            return None
+        return entry[0]
+
+    def put(self, chat_id: int, user_id: int, status: str, updated_at: Optional[float] = None) -> None:
+        now = self.clock()
+        updated_at = now if updated_at is None else updated_at
+        entry = self.statuses.get((chat_id, user_id))
+        if entry is not None and entry[1] > updated_at:
+            return
+        self.statuses[(chat_id, user_id)] = (status, updated_at, now + self.ttl_seconds)
+
+
+class DynamoMembershipStore(MembershipStore):
+    """Shared by every container. The table should have DynamoDB's TTL enabled on `expires_at`."""
+    def __init__(self, app: AppSettings, dynamodb: Any, front_cache: MemoryMembershipStore):
+        self.app = app
+        self.dynamodb = dynamodb
+        self.front_cache = front_cache
+
+    def get(self, chat_id: int, user_id: int) -> Optional[str]:
+        status = self.front_cache.get(chat_id, user_id)
+        if status is not None:
+            return status
+        try:
+            result = self.dynamodb.get_item(
+                TableName=self.app.DYNAMO_MEMBERS_TABLE_NAME,
+                Key={'id': {'S': f'{chat_id}:{user_id}'}}
+            )
+        except Exception:
+            traceback.print_exc()
+            return None
+        item = result.get('Item')
+        # TTL deletes expired items lazily, so they might still be around.
+        if not item or int(item['expires_at']['N']) <= time.time():
+            return None
+        status = item['status']['S']
+        self.front_cache.put(chat_id, user_id, status, float(item['updated_at']['N']))
+        return status
+
+    def put(self, chat_id: int, user_id: int, status: str, updated_at: Optional[float] = None) -> None:
+        now = time.time()
+        updated_at = now if updated_at is None else updated_at
+        self.front_cache.put(chat_id, user_id, status, updated_at)
+        try:
+            self.dynamodb.put_item(
+                TableName=self.app.DYNAMO_MEMBERS_TABLE_NAME,
+                Item={
+                    'id': {'S': f'{chat_id}:{user_id}'},
+                    'status': {'S': status},
+                    'updated_at': {'N': str(updated_at)},
+                    'expires_at': {'N': str(int(now + self.app.MEMBERSHIP_TTL_SECONDS))},
+                },
+                # Updates can arrive out of order, so don't let an older one win.
+                ConditionExpression='attribute_not_exists(id) OR updated_at <= :updated_at',
+                ExpressionAttributeValues={':updated_at': {'N': str(updated_at)}}
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            pass
+        except Exception:
+            traceback.print_exc()
+
+
+def make_membership_store(app: AppSettings, dynamodb: Optional[Any]) -> MembershipStore:
+    if app.DYNAMO_MEMBERS_TABLE_NAME and dynamodb is not None:
+        return DynamoMembershipStore(app, dynamodb, MemoryMembershipStore(app.MEMBERSHIP_CACHE_SECONDS))
+    return MemoryMembershipStore(app.MEMBERSHIP_CACHE_SECONDS)
@@ -0,0 +1,66 @@
+"""
+In-process counters for how long things take. They live as long as the container does, and are printed to the logs.
+"""
+import json
+from typing import Dict
+
+
+class OperationStats(object):
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.capacity_units = 0.0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float, retries: int = 0, error: bool = False, capacity_units: float = 0.0) -> None:
+        self.count += 1
+        self.retries += retries
+        self.capacity_units += capacity_units
+        if error:
+            self.errors += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        result = {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'mean_ms': round(self.mean_seconds * 1000, 1),
+            'max_ms': round(self.max_seconds * 1000, 1),
+        }
+        # Only DynamoDB reports capacity.
+        if self.capacity_units:
+            result['capacity_units'] = round(self.capacity_units, 1)
+        return result
+
+
+class Metrics(object):
+    def __init__(self) -> None:
+        self.operations: Dict[str, OperationStats] = {}
+
+    def get(self, name: str) -> OperationStats:
+        stats = self.operations.get(name)
+        if stats is None:
+            stats = self.operations[name] = OperationStats()
+        return stats
+
+    def record(self, name: str, seconds: float, retries: int = 0, error: bool = False,
+               capacity_units: float = 0.0) -> None:
+        self.get(name).record(seconds, retries, error, capacity_units)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {name: stats.to_dict() for name, stats in sorted(self.operations.items())}
+
+    def log(self, title: str) -> None:
+        if self.operations:
+            print(f'{title}: {json.dumps(self.summary())}')
+
+    def reset(self) -> None:
+        self.operations.clear()
@@ -0,0 +1,118 @@
+"""
+Sends Bot API calls on behalf of the handlers while staying under Telegram's flood limits.
+
+Telegram allows roughly 30 messages a second overall and about one a second per chat (less for groups), and answers
+anything faster with a 429 and a `retry_after`. https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+
+Calls to the same chat are sent one after another in the order they were queued, since the order of messages in a chat
+matters. Calls to different chats don't wait for each other.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+import telegram
+
+from .app import AppSettings
+from .metrics import Metrics
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before it may be used."""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Going negative reserves a token that hasn't been refilled yet, so callers queue up fairly.
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Outbox(object):
+    def __init__(self, bot: telegram.Bot, app: AppSettings, metrics: Optional[Metrics] = None):
+        self.bot = bot
+        self.app = app
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.global_bucket = TokenBucket(app.OUTBOX_GLOBAL_RATE, app.OUTBOX_GLOBAL_RATE)
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        # The most recent call queued for each chat, which the next call to that chat waits for.
+        self.last_call: Dict[Any, asyncio.Task[Any]] = {}
+        self.pending: Set[asyncio.Task[Any]] = set()
+        self.max_depth = 0
+
+    def send(self, method: str, **kwargs: Any) -> 'asyncio.Task[Any]':
+        """Queue a call to `bot.<method>(**kwargs)`. Await the returned task for its result."""
+        chat_id = kwargs.get('chat_id')
+        previous = self.last_call.get(chat_id) if chat_id is not None else None
+        task = asyncio.ensure_future(self._send(method, kwargs, previous))
+        if chat_id is not None:
+            self.last_call[chat_id] = task
+        self.pending.add(task)
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+        self.max_depth = max(self.max_depth, len(self.pending))
+        return task
+
+    async def call(self, method: str, **kwargs: Any) -> Any:
+        return await self.send(method, **kwargs)
+
+    async def flush(self) -> None:
+        """Wait for everything that's been queued so far. Failures are logged, since nobody else is waiting for them."""
+        results = await asyncio.gather(*self.pending, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f'Queued Bot API call failed: {result!r}')
+
+    def log_stats(self) -> None:
+        self.metrics.log(f'Outbox (max queue depth {self.max_depth})')
+
+    def _forget(self, chat_id: Any, task: 'asyncio.Task[Any]') -> None:
+        self.pending.discard(task)
+        if chat_id is not None and self.last_call.get(chat_id) is task:
+            del self.last_call[chat_id]
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.app.OUTBOX_CHAT_RATE, self.app.OUTBOX_CHAT_BURST)
+        return bucket
+
+    async def _send(self, method: str, kwargs: Dict[str, Any], previous: 'Optional[asyncio.Task[Any]]') -> Any:
+        queued_at = time.monotonic()
+        retries = 0
+        try:
+            if previous is not None:
+                # Only the order matters here, a failure of the previous call is reported to whoever made it.
+                await asyncio.gather(previous, return_exceptions=True)
+            while True:
+                chat_id = kwargs.get('chat_id')
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+                try:
+                    result = await getattr(self.bot, method)(**kwargs)
+                except telegram.error.RetryAfter as err:
+                    if retries >= self.app.OUTBOX_MAX_RETRIES:
+                        raise
+                    retries += 1
+                    print(f'{method} was rate limited, retrying after {err.retry_after}s')
+                    await asyncio.sleep(err.retry_after)
+                    continue
+                self.metrics.record(method, time.monotonic() - queued_at, retries)
+                return result
+        except Exception:
+            self.metrics.record(method, time.monotonic() - queued_at, retries, error=True)
+            raise
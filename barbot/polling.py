@@ -0,0 +1,253 @@
+"""
+Self hosted alternative to the webhook lambda: pulls updates from Telegram with getUpdates and feeds them through the
+same handlers the webhook uses.
+
+    python -m barbot.polling
+
+Updates are handled concurrently by a fixed number of workers. All updates for a chat go to the same worker, so they are
+handled in the order Telegram sent them. Each worker has a bounded queue; when it fills up, we stop fetching updates
+until the worker catches up.
+
+Telegram takes the offset we poll with as confirmation of every update before it, so the offset only moves past an
+update once it has been handled (see UpdateDispatcher.handled_offset). Until then Telegram keeps sending it back, and
+the poller skips it. If the process dies, whatever was still queued is delivered again to the next one. An update that
+was partway through being handled has already been claimed in the update ledger (see dedupe.py), so it's dropped on
+redelivery if the ledger is in DynamoDB, and handled again if it was only in memory.
+"""
+import asyncio
+import signal
+import traceback
+import warnings
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import telegram
+from telegram.warnings import PTBUserWarning
+
+from .app import ALLOWED_UPDATES, AppSettings, asyncio_loop
+from .services import get_services
+
+# We call getUpdates and the methods returned by the handlers through Bot.do_api_request, since we want the raw JSON
+# rather than telegram objects. python-telegram-bot nags about that for every method it knows about.
+warnings.filterwarnings('ignore', message="Please use 'Bot.", category=PTBUserWarning)
+
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+# How long to wait before polling again when another poller is taking our updates.
+CONFLICT_RETRY_SECONDS = 5
+# How long to wait before polling again when all Telegram sent back is updates we're still handling, unless one of them
+# is finished sooner.
+BACKLOG_POLL_SECONDS = 1
+
+
+def get_ordering_key(update: Dict[str, Any]) -> str:
+    """Updates with the same key must be handled in order. Usually this is the chat the update belongs to."""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'message_reaction',
+                  'chat_member', 'my_chat_member'):
+        chat = update.get(field, {}).get('chat')
+        if chat:
+            return f'chat:{chat["id"]}'
+    callback_message = update.get('callback_query', {}).get('message')
+    if callback_message:
+        return f'chat:{callback_message["chat"]["id"]}'
+    for field in ('inline_query', 'chosen_inline_result', 'callback_query', 'poll_answer'):
+        user = update.get(field, {}).get('from') or update.get(field, {}).get('user')
+        if user:
+            return f'user:{user["id"]}'
+    return f'update:{update.get("update_id")}'
+
+
+class UpdateDispatcher(object):
+    def __init__(self, handler: UpdateHandler, worker_count: int, queue_size: int):
+        self.handler = handler
+        self.queues: List[asyncio.Queue[Optional[Dict[str, Any]]]] = [
+            asyncio.Queue(maxsize=queue_size) for _ in range(worker_count)
+        ]
+        self.workers: List[asyncio.Task[None]] = []
+        # Updates that are queued or being handled, and the newest update ever queued.
+        self.in_flight: Set[int] = set()
+        self.newest: Optional[int] = None
+        self.progress = asyncio.Event()
+
+    def start(self) -> None:
+        self.workers = [asyncio.create_task(self._work(queue)) for queue in self.queues]
+
+    async def put(self, update: Dict[str, Any]) -> None:
+        """Queue an update for its worker. Waits if that worker is too far behind."""
+        key = get_ordering_key(update)
+        # Python's str hash is randomized per process, which is fine, but crc32 makes the routing easier to reason about.
+        queue = self.queues[zlib.crc32(key.encode('utf-8')) % len(self.queues)]
+        update_id = update['update_id']
+        self.in_flight.add(update_id)
+        self.newest = update_id if self.newest is None else max(self.newest, update_id)
+        await queue.put(update)
+
+    def queued(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def handled_offset(self) -> Optional[int]:
+        """The getUpdates offset that confirms every update that's been handled, and none that haven't."""
+        if self.in_flight:
+            return min(self.in_flight)
+        return self.newest + 1 if self.newest is not None else None
+
+    async def wait_for_progress(self, timeout: float) -> None:
+        """Wait until another update has been handled, or for `timeout` seconds."""
+        self.progress.clear()
+        try:
+            await asyncio.wait_for(self.progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self) -> None:
+        """Handle everything that's already queued, then stop the workers."""
+        for queue in self.queues:
+            await queue.put(None)
+        await asyncio.gather(*self.workers)
+        self.workers = []
+
+    async def _work(self, queue: 'asyncio.Queue[Optional[Dict[str, Any]]]') -> None:
+        while True:
+            update = await queue.get()
+            try:
+                if update is None:
+                    return
+                await self.handler(update)
+            except Exception:
+                print(f'Failed to handle update {update.get("update_id") if update else None}')
+                traceback.print_exc()
+            finally:
+                if update is not None:
+                    # Handled as far as Telegram's concerned, even if it failed. Retrying won't make it work.
+                    self.in_flight.discard(update['update_id'])
+                    self.progress.set()
+                queue.task_done()
+
+
+async def call_method(bot: telegram.Bot, result: Optional[Dict[str, Any]]) -> None:
+    """Make the Bot API call that a handler wanted to return in the webhook response."""
+    if not result or 'method' not in result:
+        return
+    params = dict(result)
+    method = params.pop('method')
+    await bot.do_api_request(method, api_kwargs=params)
+
+
+class Poller(object):
+    def __init__(self, bot: telegram.Bot, dispatcher: UpdateDispatcher, timeout: int, limit: int = 100):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.timeout = timeout
+        self.limit = limit
+        self.running = False
+        self.fetching: Optional[asyncio.Future[List[Dict[str, Any]]]] = None
+
+    @property
+    def offset(self) -> Optional[int]:
+        return self.dispatcher.handled_offset()
+
+    async def fetch(self) -> List[Dict[str, Any]]:
+        api_kwargs: Dict[str, Any] = {'timeout': self.timeout, 'limit': self.limit, 'allowed_updates': ALLOWED_UPDATES}
+        if self.offset is not None:
+            api_kwargs['offset'] = self.offset
+        return await self.bot.do_api_request(
+            'getUpdates',
+            api_kwargs=api_kwargs,
+            read_timeout=self.timeout + 10,
+        )
+
+    async def run(self) -> None:
+        self.running = True
+        while self.running:
+            offset = self.offset
+            self.fetching = asyncio.ensure_future(self.fetch())
+            try:
+                updates = await self.fetching
+            except asyncio.CancelledError:
+                # stop() interrupted the long poll
+                break
+            except telegram.error.RetryAfter as err:
+                print(f'getUpdates was rate limited, retrying after {err.retry_after}')
+                await asyncio.sleep(err.retry_after)
+                continue
+            except telegram.error.Conflict as err:
+                # Another poller is taking our updates, probably one that's about to be stopped by a deploy.
+                print(f'getUpdates conflicts with another poller, retrying in {CONFLICT_RETRY_SECONDS}s: {err}')
+                await asyncio.sleep(CONFLICT_RETRY_SECONDS)
+                continue
+            except (telegram.error.NetworkError, telegram.error.TimedOut) as err:
+                print(f'getUpdates failed: {err}')
+                await asyncio.sleep(1)
+                continue
+            finally:
+                self.fetching = None
+
+            newest = self.dispatcher.newest
+            new_updates = [update for update in updates if newest is None or update['update_id'] > newest]
+            if updates and not new_updates:
+                # Everything we were sent is still being handled. Telegram would just send it straight back, so give
+                # the handlers a moment first.
+                if self.offset == offset:
+                    await self.dispatcher.wait_for_progress(BACKLOG_POLL_SECONDS)
+                continue
+            for update in new_updates:
+                # Blocks while the worker for this update's chat is backed up, which in turn stops us fetching more.
+                await self.dispatcher.put(update)
+
+    def stop(self) -> None:
+        self.running = False
+        if self.fetching is not None:
+            self.fetching.cancel()
+
+
+async def finish_polling(bot: telegram.Bot, poller: Poller, dispatcher: UpdateDispatcher) -> None:
+    """Handle what's already been fetched, however polling stopped."""
+    print(f'Stopping, {dispatcher.queued()} updates left to handle')
+    await dispatcher.stop()
+    # Tell telegram which updates we've handled, so they aren't delivered again next time.
+    if poller.offset is not None:
+        try:
+            await bot.do_api_request('getUpdates', api_kwargs={'offset': poller.offset, 'timeout': 0})
+        except telegram.error.TelegramError as err:
+            print(f'Unable to confirm the updates handled up to {poller.offset}: {err}')
+
+
+async def run_polling(app: AppSettings) -> None:
+    from . import geo
+    from .webhook import handle_webhook_async
+
+    services = get_services()
+    await services.prepare()
+    bot = services.bot
+
+    # getUpdates doesn't work while a webhook is set.
+    await bot.delete_webhook()
+
+    async def handle(update: Dict[str, Any]) -> None:
+        await call_method(bot, await handle_webhook_async(update))
+
+    dispatcher = UpdateDispatcher(handle, app.POLLING_WORKERS, app.POLLING_QUEUE_SIZE)
+    dispatcher.start()
+    poller = Poller(bot, dispatcher, app.POLLING_TIMEOUT_SECONDS)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, poller.stop)
+
+    print(f'Polling for updates with {app.POLLING_WORKERS} workers')
+    try:
+        # Any other error from getUpdates (an invalid token, say) won't go away by retrying, so it ends polling.
+        await poller.run()
+    finally:
+        await finish_polling(bot, poller, dispatcher)
+        services.log_stats()
+        # Don't leave browser sessions open on the selenium server until it times them out.
+        geo.close_browser_pools()
+
+
+def main() -> None:
+    asyncio_loop.run_until_complete(run_polling(get_services().app))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,16 +5,17 @@ import traceback
 import croniter
 import dateutil.tz
 import re
-from typing import Optional, List, Tuple
-from mypy_boto3_scheduler import EventBridgeSchedulerClient
-
-import boto3
+from typing import Optional, List, Tuple, TYPE_CHECKING
 
 from barbot.app import AppSettings
 from barbot.database import ScheduledVenue, Database
 
+if TYPE_CHECKING:
+    from mypy_boto3_scheduler import EventBridgeSchedulerClient
+
 
-def make_scheduler() -> EventBridgeSchedulerClient:
+def make_scheduler() -> 'EventBridgeSchedulerClient':
+    import boto3
     return boto3.client('scheduler')
 
 
@@ -25,7 +26,7 @@ def get_now(tz: datetime.tzinfo) -> datetime.datetime:
     """This function can be mocked in tests."""
     return datetime.datetime.now(tz)
 
-def get_schedule_cron(scheduler: EventBridgeSchedulerClient, app: AppSettings, schedule_name: str) -> Tuple[str, datetime.tzinfo]:
+def get_schedule_cron(scheduler: 'EventBridgeSchedulerClient', app: AppSettings, schedule_name: str) -> Tuple[str, datetime.tzinfo]:
     result = scheduler.get_schedule(
         GroupName=app.SCHEDULE_GROUP_NAME,
         Name=schedule_name
@@ -38,7 +39,7 @@ def get_schedule_cron(scheduler: EventBridgeSchedulerClient, app: AppSettings, s
     return expression, tz
 
 
-def get_schedule_time(scheduler: EventBridgeSchedulerClient, app: AppSettings, schedule_name: str) -> Optional[str]:
+def get_schedule_time(scheduler: 'EventBridgeSchedulerClient', app: AppSettings, schedule_name: str) -> Optional[str]:
     expression, tz = get_schedule_cron(scheduler, app, schedule_name)
     base = get_now(tz)
     next_time = get_next_cron(expression, base)
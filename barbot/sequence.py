@@ -1,25 +1,35 @@
 """
 Lambda functions intended to be called from Step Functions go here
 """
-import os
+import datetime
 import random
 import traceback
-from typing import Dict, Any, List, Callable, Awaitable, Optional
+from typing import Dict, Any, List, Callable, Awaitable, Optional, TYPE_CHECKING
 
+import dateutil.tz
 import telegram
-from mypy_boto3_scheduler import EventBridgeSchedulerClient
 
-from . import bars, database, util, schedule_util
+from . import bars, stats, util, schedule_util
 from .app import AppSettings, asyncio_loop, BARNIGHT_HASHTAG
-from .database import Database
+from .database import Database, read_snapshot
+from .outbox import Outbox
+from .services import get_services
+
+if TYPE_CHECKING:
+    from mypy_boto3_scheduler import EventBridgeSchedulerClient
 
 
 class SequenceServices(object):
-    def __init__(self, db: Database, bot: telegram.Bot, scheduler: EventBridgeSchedulerClient, app: AppSettings):
+    def __init__(self, db: Database, bot: telegram.Bot, scheduler: 'EventBridgeSchedulerClient', app: AppSettings,
+                 bar_list: Optional[bars.Bars] = None, outbox: Optional[Outbox] = None):
         self.db = db
         self.bot = bot
         self.scheduler = scheduler
         self.app = app
+        if bar_list is None:
+            bar_list = bars.Bars(app.BAR_SPREADSHEET, snapshot_dir=app.BAR_SNAPSHOT_DIR)
+        self.bars = bar_list
+        self.outbox = outbox if outbox is not None else Outbox(bot, app)
 
 
 # This is the entry point called from the sequence lambda function.
@@ -27,21 +37,31 @@ def handle_function_call(event: Dict[str, Any], context: Dict[str, Any]) -> Dict
     event_type = event['barnight_event_type']
     func = event_funcs[event_type]
 
-    app_settings = AppSettings(os.environ)
-    db = database.DynamoDatabase(app_settings)
-    assert app_settings.TELEGRAM_BOT_TOKEN is not None
-    bot = telegram.Bot(
-        token=app_settings.TELEGRAM_BOT_TOKEN
-    )
-    scheduler = schedule_util.make_scheduler()
-    services = SequenceServices(db, bot, scheduler, app_settings)
-    return asyncio_loop.run_until_complete(func(event, services))
+    shared = get_services()
+    asyncio_loop.run_until_complete(shared.prepare())
+    # Each chat's schedules pass its chat_id. Without one, it's the default chat.
+    chat = shared.chat(event.get('chat_id'))
+    if chat is None:
+        print(f'Ignoring {event_type} for chat {event.get("chat_id")}, which the bot is not set up for')
+        return {}
+    db = shared.instrument(chat.db)
+    db.begin_invocation()
+    services = SequenceServices(db, shared.bot, shared.scheduler, chat.app, chat.bars, shared.outbox)
+    try:
+        return asyncio_loop.run_until_complete(func(event, services))
+    finally:
+        shared.log_stats()
+
+
+def get_today(app: AppSettings) -> datetime.date:
+    return schedule_util.get_now(dateutil.tz.gettz(app.MAIN_EVENT_TIMEZONE)).date()
 
 
 async def handle_ask_for_suggestions(event: Dict[str, Any], services: SequenceServices) -> Dict[str, Any]:
     app_settings = services.app
+    snapshot = await read_snapshot(services.db)
 
-    scheduled_event = schedule_util.get_active_scheduled_event(services.db, app_settings)
+    scheduled_event = schedule_util.get_active_scheduled_event_inner(snapshot.scheduled_venues, app_settings)
     if scheduled_event:
         # This cycle is a scheduled event!
         def get_message(bar_name_markdown: str) -> str:
@@ -55,24 +75,28 @@ async def handle_ask_for_suggestions(event: Dict[str, Any], services: SequenceSe
     if poll_time:
         text += f' Poll will be created on {poll_time}.'
 
-    await services.bot.send_message(chat_id=app_settings.MAIN_CHAT_ID, text=text)
+    await services.outbox.call('send_message', chat_id=app_settings.MAIN_CHAT_ID, text=text)
     return {}
 
 
 async def handle_create_poll(event: Dict[str, Any], services: SequenceServices) -> Dict[str, Any]:
     db = services.db
-    bot = services.bot
+    outbox = services.outbox
     app_settings = services.app
+    snapshot = await read_snapshot(db)
 
-    if schedule_util.get_active_scheduled_event(db, app_settings):
+    if schedule_util.get_active_scheduled_event_inner(snapshot.scheduled_venues, app_settings):
         # Skip due to scheduled event
         return {}
 
     db.set_current_poll_id(0)
-    suggestions = db.get_current_suggestions(bypass_cache=True)
+    suggestions = snapshot.suggestions
+    if suggestions:
+        stats.record(db, stats.suggestions_entry(get_today(app_settings), suggestions))
 
     if len(suggestions) == 0:
-        send_message_result = await bot.send_message(
+        send_message_result = await outbox.call(
+            'send_message',
             chat_id=app_settings.MAIN_CHAT_ID,
             text='Oops! No one suggested anything for barnight. I\'m gonna sit this one out...',
         )
@@ -80,14 +104,16 @@ async def handle_create_poll(event: Dict[str, Any], services: SequenceServices)
         def get_main_chat_message(bar_name_markdown: str) -> str:
             return f'There was only one suggestion, and it was for {bar_name_markdown}\\.'
         await send_winning_result(suggestions[0].venue, services, get_main_chat_message, reply_to_message_id=None)
+        stats.record(db, stats.result_entry(get_today(app_settings), suggestions[0].venue, {}))
     else:
         try:
-            png, png_text = await util.get_map_suggestions_message_data(bars.Bars(app_settings.BAR_SPREADSHEET), suggestions, app_settings)
+            png, png_text = await util.get_map_suggestions_message_data(services.bars, suggestions, app_settings)
             if png:
-                await bot.send_photo(
-                    app_settings.MAIN_CHAT_ID,
-                    png,
-                    png_text,
+                await outbox.call(
+                    'send_photo',
+                    chat_id=app_settings.MAIN_CHAT_ID,
+                    photo=png,
+                    caption=png_text,
                     parse_mode='MarkdownV2',
                 )
             else:
@@ -95,7 +121,8 @@ async def handle_create_poll(event: Dict[str, Any], services: SequenceServices)
         except Exception as err:
             print(f'Could not send the map before the poll: {err}')
         try:
-            send_poll_result = await bot.send_poll(
+            send_poll_result = await outbox.call(
+                'send_poll',
                 chat_id=app_settings.MAIN_CHAT_ID,
                 question='Where are we going for barnight? (multiple choice)',
                 options=[x.venue for x in suggestions],
@@ -105,19 +132,20 @@ async def handle_create_poll(event: Dict[str, Any], services: SequenceServices)
             )
         except:
             traceback.print_exc()
-            error_message_result = await bot.send_message(
-                app_settings.MAIN_CHAT_ID,
-                'Oh no! I was unable to create a poll for barnight! Please continue the process manually. '
+            error_message_result = await outbox.call(
+                'send_message',
+                chat_id=app_settings.MAIN_CHAT_ID,
+                text='Oh no! I was unable to create a poll for barnight! Please continue the process manually. '
                 'Here is the list of suggested venues:\n\n'
-                + util.get_list_suggestions_message_text(db.get_current_suggestions(bypass_cache=True))
+                + util.get_list_suggestions_message_text(suggestions)
             )
             db.clear_suggestions()
-            await bot.pin_chat_message(chat_id=app_settings.MAIN_CHAT_ID, message_id=error_message_result.message_id)
+            await outbox.call('pin_chat_message', chat_id=app_settings.MAIN_CHAT_ID, message_id=error_message_result.message_id)
             return {}
 
         poll_id = send_poll_result.id
         db.set_current_poll_id(poll_id)
-        await bot.pin_chat_message(chat_id=app_settings.MAIN_CHAT_ID, message_id=poll_id)
+        await outbox.call('pin_chat_message', chat_id=app_settings.MAIN_CHAT_ID, message_id=poll_id)
 
     db.clear_suggestions()
     return {}
@@ -125,12 +153,13 @@ async def handle_create_poll(event: Dict[str, Any], services: SequenceServices)
 
 async def handle_poll_reminder(event: Dict[str, Any], services: SequenceServices) -> Dict[str, Any]:
     app_settings = services.app
+    snapshot = await read_snapshot(services.db)
 
-    if schedule_util.get_active_scheduled_event(services.db, app_settings):
+    if schedule_util.get_active_scheduled_event_inner(snapshot.scheduled_venues, app_settings):
         # Skipped when scheduled event is active
         return {}
 
-    poll_id = services.db.get_current_poll_id()
+    poll_id = snapshot.poll_id
     if not poll_id:
         return {}
 
@@ -139,7 +168,8 @@ async def handle_poll_reminder(event: Dict[str, Any], services: SequenceServices
     if close_time:
         text += f' The poll will close on {close_time}.'
 
-    await services.bot.send_message(
+    await services.outbox.call(
+        'send_message',
         chat_id=app_settings.MAIN_CHAT_ID,
         text=text,
         reply_to_message_id=poll_id
@@ -149,31 +179,34 @@ async def handle_poll_reminder(event: Dict[str, Any], services: SequenceServices
 
 async def handle_choose_winner(event: Dict[str, Any], services: SequenceServices) -> Dict[str, Any]:
     db = services.db
-    bot = services.bot
+    outbox = services.outbox
     app_settings = services.app
+    snapshot = await read_snapshot(db)
 
-    if schedule_util.get_active_scheduled_event(db, app_settings):
+    if schedule_util.get_active_scheduled_event_inner(snapshot.scheduled_venues, app_settings):
         return {}
 
-    poll_id = db.get_current_poll_id()
+    poll_id = snapshot.poll_id
 
     if not poll_id:
         return {}
 
     try:
-        poll = await bot.stop_poll(
+        poll = await outbox.call(
+            'stop_poll',
             chat_id=app_settings.MAIN_CHAT_ID,
             message_id=poll_id
         )
     except:
         traceback.print_exc()
-        error_message_result = await bot.send_message(
-            app_settings.MAIN_CHAT_ID,
-            'Oh no! I was unable to close the poll for barnight! '
+        error_message_result = await outbox.call(
+            'send_message',
+            chat_id=app_settings.MAIN_CHAT_ID,
+            text='Oh no! I was unable to close the poll for barnight! '
             'Please close the poll (if it wasn\'t closed already) and declare a winner for me.'
         )
         db.set_current_poll_id(0)
-        await bot.pin_chat_message(chat_id=app_settings.MAIN_CHAT_ID, message_id=error_message_result.message_id)
+        await outbox.call('pin_chat_message', chat_id=app_settings.MAIN_CHAT_ID, message_id=error_message_result.message_id)
         return {}
 
     top_options: List[telegram.PollOption] = []
@@ -198,6 +231,8 @@ async def handle_choose_winner(event: Dict[str, Any], services: SequenceServices
         return message
 
     await send_winning_result(bar_name, services, get_main_chat_message, poll_id)
+    votes = {option.text: option.voter_count for option in poll.options}
+    stats.record(db, stats.result_entry(get_today(app_settings), bar_name, votes, poll_id))
 
     db.set_current_poll_id(0)
     return {}
@@ -210,7 +245,7 @@ async def send_winning_result(
     reply_to_message_id: Optional[int],
 ) -> None:
     app_settings = services.app
-    bot = services.bot
+    outbox = services.outbox
 
     # Remove redundant punctuation
     bar_name_no_punctuation = bar_name
@@ -218,7 +253,7 @@ async def send_winning_result(
         bar_name_no_punctuation = bar_name[:-1]
 
     bar_name_markdown = f'*{util.escape_markdown_v2(bar_name_no_punctuation)}*'
-    bar = bars.Bars(services.app.BAR_SPREADSHEET).match_bar(bar_name)
+    bar = (await services.bars.ensure_loaded()).match_bar(bar_name)
     if bar:
         link = f'https://www.google.com/maps/dir/?api=1&destination={bar.latitude},{bar.longitude}'
         bar_name_markdown = f'[{bar_name_markdown}]({link})'
@@ -230,7 +265,8 @@ async def send_winning_result(
     else:
         message = main_chat_message_func(bar_name_markdown)
 
-    message_result = await bot.send_message(
+    message_result = await outbox.call(
+        'send_message',
         chat_id=chat_id,
         text=message,
         parse_mode='MarkdownV2',
@@ -240,7 +276,7 @@ async def send_winning_result(
 
     # Only pin if main chat
     if chat_id == app_settings.MAIN_CHAT_ID:
-        await bot.pin_chat_message(chat_id=chat_id, message_id=message_result.id)
+        await outbox.call('pin_chat_message', chat_id=chat_id, message_id=message_result.id)
 
 
 
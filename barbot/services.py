@@ -0,0 +1,205 @@
+"""
+Clients shared between invocations of a warm lambda container.
+
+Building the bot, the boto3 clients and the bar list is comparatively expensive (TLS sessions, credential resolution,
+the bar spreadsheet cache), so they're created lazily on first use and then reused for as long as the container lives.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Mapping, Optional, TYPE_CHECKING
+
+import telegram
+
+from . import bot_transport, database, geo, schedule_util
+from .dedupe import UpdateLedger, make_update_ledger
+from .membership import MEMBER_STATUSES, MembershipStore, make_membership_store
+from .app import AppSettings
+from .bars import Bars
+from .chats import ChatDirectory
+from .database import Database
+from .db_metrics import DynamoInstrumentation, InstrumentedDatabase
+from .metrics import Metrics
+from .outbox import Outbox
+
+if TYPE_CHECKING:
+    from mypy_boto3_scheduler import EventBridgeSchedulerClient
+
+
+class ChatServices(object):
+    """The settings, state and bar list of one chat."""
+    def __init__(self, app: AppSettings, db: Database, bars: Bars):
+        self.app = app
+        self.db = db
+        self.bars = bars
+
+
+class Services(object):
+    def __init__(self, env: Mapping[str, str]):
+        self._env = env
+        self._app: Optional[AppSettings] = None
+        self._bot: Optional[telegram.Bot] = None
+        self._db: Optional[Database] = None
+        self._bars: Optional[Bars] = None
+        self._scheduler: Optional['EventBridgeSchedulerClient'] = None
+        self._outbox: Optional[Outbox] = None
+        self._ledger: Optional[UpdateLedger] = None
+        self._dynamodb: Any = None
+        self._chats: Optional[ChatDirectory] = None
+        self._chat_services: Dict[int, ChatServices] = {}
+        self._members: Optional[MembershipStore] = None
+        self._prepared = False
+        self._preconnect: Optional['asyncio.Task[None]'] = None
+        # Every DynamoDB call and Database method, for as long as the container lives. See db_metrics.py
+        self.db_metrics = Metrics()
+        self.dynamo_instrumentation = DynamoInstrumentation(self.db_metrics)
+
+    async def prepare(self) -> None:
+        """Warm up connections at the start of the first invocation. Cheap to call on every invocation."""
+        if self._prepared:
+            return
+        self._prepared = True
+        # Start loading the bar list now, so it's likely there by the time anything needs it.
+        self.bars.get_catalog()
+        # Kept so the task isn't garbage collected before it's done.
+        self._preconnect = bot_transport.prepare_bot(self.bot, self.app)
+
+    @property
+    def app(self) -> AppSettings:
+        if self._app is None:
+            self._app = AppSettings(self._env)
+        return self._app
+
+    @property
+    def bot(self) -> telegram.Bot:
+        if self._bot is None:
+            self._bot = bot_transport.make_bot(self.app)
+        return self._bot
+
+    @property
+    def outbox(self) -> Outbox:
+        # Shared so that the flood limits hold across invocations (and concurrent updates when polling).
+        if self._outbox is None:
+            self._outbox = Outbox(self.bot, self.app)
+        return self._outbox
+
+    @property
+    def dynamodb(self) -> Any:
+        if self._dynamodb is None:
+            self._dynamodb = database.make_dynamodb_client(self.app, self.dynamo_instrumentation)
+        return self._dynamodb
+
+    def instrument(self, db: Database) -> Database:
+        """Wrap a chat's Database so its methods are timed in db_metrics."""
+        return InstrumentedDatabase(db, self.db_metrics, self.dynamo_instrumentation)
+
+    def log_stats(self) -> None:
+        if self._outbox is not None:
+            self._outbox.log_stats()
+        self.db_metrics.log('Database')
+        geo.log_stats()
+
+    @property
+    def db(self) -> Database:
+        """The state of the default chat (MAIN_CHAT_ID)."""
+        if self._db is None:
+            if self.app.DATABASE_BACKEND == 'sqlite':
+                from .sqlite_database import SqliteDatabase
+                self._db = SqliteDatabase(self.app.SQLITE_PATH)
+            elif self.app.DATABASE_BACKEND == 'dynamo':
+                self._db = database.DynamoDatabase(self.app, self.dynamodb)
+            elif self.app.DATABASE_BACKEND == 'dynamo_chats':
+                from .chat_database import ChatDynamoDatabase
+                self._db = ChatDynamoDatabase(self.app, self.dynamodb)
+            else:
+                raise ValueError(f'Unknown DATABASE_BACKEND {self.app.DATABASE_BACKEND!r}')
+        return self._db
+
+    @property
+    def chats(self) -> ChatDirectory:
+        if self._chats is None:
+            self._chats = ChatDirectory(self._env, self.dynamodb if self.app.DYNAMO_CHATS_TABLE_NAME else None)
+        return self._chats
+
+    def chat(self, chat_id: Optional[int] = None) -> Optional[ChatServices]:
+        """Get what's needed to handle an update from a chat (the default chat if None), or None if it's not set up."""
+        app = self.chats.get(chat_id)
+        if app is None:
+            return None
+        cached = self._chat_services.get(app.MAIN_CHAT_ID)
+        # The directory hands out new settings when it reloads them, so everything built from them is rebuilt too.
+        if cached is not None and cached.app is app:
+            return cached
+
+        db: Database
+        if app.MAIN_CHAT_ID == self.app.MAIN_CHAT_ID:
+            db = self.db
+        elif self.app.DATABASE_BACKEND == 'dynamo_chats':
+            from .chat_database import ChatDynamoDatabase
+            db = ChatDynamoDatabase(app, self.dynamodb)
+        else:
+            print(f'Chat {app.MAIN_CHAT_ID} is configured, but DATABASE_BACKEND {self.app.DATABASE_BACKEND} can only '
+                  f'keep state for MAIN_CHAT_ID')
+            return None
+        if app.BAR_SPREADSHEET == self.app.BAR_SPREADSHEET:
+            bars = self.bars
+        else:
+            bars = Bars(app.BAR_SPREADSHEET, snapshot_dir=app.BAR_SNAPSHOT_DIR)
+        chat = self._chat_services[app.MAIN_CHAT_ID] = ChatServices(app, db, bars)
+        return chat
+
+    def chat_for_user(self, user_id: int) -> Optional[ChatServices]:
+        """
+        The chat a private message or inline query from a user is about, since Telegram doesn't say.
+
+        That's the default chat, unless we know the user is in exactly one other chat and not in the default chat.
+        Only what the membership store already knows is used, so this never calls Telegram.
+        """
+        default_id = self.app.MAIN_CHAT_ID
+        others = [chat_id for chat_id in self.chats.chat_ids() if chat_id != default_id]
+        if others and self.members.get(default_id, user_id) not in MEMBER_STATUSES:
+            member_of = [chat_id for chat_id in others if self.members.get(chat_id, user_id) in MEMBER_STATUSES]
+            if len(member_of) == 1:
+                return self.chat(member_of[0])
+        return self.chat()
+
+    @property
+    def ledger(self) -> UpdateLedger:
+        if self._ledger is None:
+            dynamodb = self.dynamodb if self.app.DYNAMO_UPDATES_TABLE_NAME else None
+            self._ledger = make_update_ledger(self.app, dynamodb)
+        return self._ledger
+
+    @property
+    def members(self) -> MembershipStore:
+        if self._members is None:
+            self._members = make_membership_store(self.app, self.dynamodb if self.app.DYNAMO_MEMBERS_TABLE_NAME else None)
+        return self._members
+
+    @property
+    def bars(self) -> Bars:
+        if self._bars is None:
+            self._bars = Bars(self.app.BAR_SPREADSHEET, snapshot_dir=self.app.BAR_SNAPSHOT_DIR)
+        return self._bars
+
+    @property
+    def scheduler(self) -> 'EventBridgeSchedulerClient':
+        if self._scheduler is None:
+            self._scheduler = schedule_util.make_scheduler()
+        return self._scheduler
+
+
+_services: Optional[Services] = None
+
+
+def get_services() -> Services:
+    """Get the services for this process, creating them if this is a cold start."""
+    global _services
+    if _services is None:
+        _services = Services(os.environ)
+    return _services
+
+
+def reset_services(services: Optional[Services] = None) -> None:
+    """Throw away the shared services (or replace them with the given ones). Mostly useful for tests."""
+    global _services
+    _services = services
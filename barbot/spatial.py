@@ -0,0 +1,93 @@
+"""
+Finding the bars closest to a point, for /near.
+
+Bars are bucketed into a grid of CELL_DEGREES cells. A search looks at the cells in rings around the point, and stops as
+soon as nothing in the rings it hasn't looked at yet could be closer than what it's found. Distances are great circle
+(haversine) distances, worked out with numpy for a whole batch of bars at once.
+
+numpy is heavy to import, so this module is only imported once someone actually asks (see `BarCatalog.spatial_index`).
+"""
+import math
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+import numpy as np
+
+from .bars import Bar
+
+if TYPE_CHECKING:
+    from .bars import BarCatalog
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_METERS * math.pi / 180
+# About a kilometer north to south, which is walking distance.
+CELL_DEGREES = 0.01
+# Past this many cells, it's quicker to measure the distance to every bar.
+MAX_CELLS_SEARCHED = 1024
+
+
+def haversine_meters(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distances from a point to arrays of points. Everything is in radians."""
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex(object):
+    def __init__(self, catalog: "BarCatalog"):
+        self.catalog = catalog
+        columns = catalog.columns
+        # The catalog's coordinates are already packed doubles, so numpy can read them without a copy.
+        latitudes = np.frombuffer(columns.latitudes, dtype=np.float64)
+        longitudes = np.frombuffer(columns.longitudes, dtype=np.float64)
+        self.lats = np.radians(latitudes)
+        self.lons = np.radians(longitudes)
+        # (row, column) -> bar numbers in the catalog
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        rows = np.floor(latitudes / CELL_DEGREES).astype(np.int64).tolist()
+        cols = np.floor(longitudes / CELL_DEGREES).astype(np.int64).tolist()
+        for i, cell in enumerate(zip(rows, cols)):
+            self.cells.setdefault(cell, []).append(i)
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / CELL_DEGREES), math.floor(lon / CELL_DEGREES)
+
+    def _ring(self, row: int, col: int, radius: int) -> List[int]:
+        if radius == 0:
+            return self.cells.get((row, col), [])
+        found: List[int] = []
+        for r in range(row - radius, row + radius + 1):
+            # The top and bottom rows of the ring are whole, the rows between only have their two ends.
+            step = 1 if abs(r - row) == radius else 2 * radius
+            for c in range(col - radius, col + radius + 1, step):
+                found.extend(self.cells.get((r, c), []))
+        return found
+
+    def _closest(self, lat: float, lon: float, candidates: np.ndarray, k: int) -> List[Tuple[Bar, float]]:
+        distances = haversine_meters(math.radians(lat), math.radians(lon), self.lats[candidates], self.lons[candidates])
+        order = np.argsort(distances, kind='stable')[:k]
+        return [(self.catalog.row(int(candidates[i])), float(distances[i])) for i in order]
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[Bar, float]]:
+        """The k closest bars to a point, closest first, with their distances in meters."""
+        if not len(self.catalog) or k <= 0:
+            return []
+        row, col = self._cell(lat, lon)
+        # How much a cell shrinks east to west, at the furthest a nearby ring could reach from the equator.
+        lon_scale = max(math.cos(math.radians(min(89.0, abs(lat) + 1.0))), 0.01)
+
+        candidates: List[int] = []
+        radius = 0
+        while (2 * radius + 1) ** 2 <= MAX_CELLS_SEARCHED:
+            candidates.extend(self._ring(row, col, radius))
+            if len(candidates) == len(self.catalog):
+                break
+            if len(candidates) >= k:
+                closest = self._closest(lat, lon, np.array(candidates), k)
+                # Anything outside the rings searched so far is at least this far away.
+                unsearched = radius * CELL_DEGREES * METERS_PER_DEGREE * lon_scale
+                if closest[-1][1] <= unsearched:
+                    return closest
+            radius += 1
+        else:
+            candidates = list(range(len(self.catalog)))
+        return self._closest(lat, lon, np.array(candidates), k)
@@ -0,0 +1,173 @@
+"""
+Keeps the bot's state in a local SQLite file, for running as a single process without DynamoDB (see `run_polling`).
+"""
+import json
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+from .app import MAX_SUGGESTIONS
+from .database import AddSuggestionResult, Database, ScheduledVenue, Snapshot, Suggestion, normalize_venue
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS week (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    poll_id INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO week (id, poll_id) VALUES (1, 0);
+
+CREATE TABLE IF NOT EXISTS suggestions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    uuid TEXT NOT NULL UNIQUE,
+    venue TEXT NOT NULL,
+    venue_key TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    user_handle TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    aggregates TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stats_archive (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS scheduled_venues (
+    uuid TEXT PRIMARY KEY,
+    venue_name TEXT NOT NULL,
+    cron TEXT NOT NULL,
+    duration_minutes INTEGER NOT NULL
+);
+'''
+
+
+class SqliteDatabase(Database):
+    def __init__(self, path: str):
+        # Autocommit, so that each statement is its own transaction unless we BEGIN one.
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        # Readers don't block the writer (or each other) in WAL mode, and fsyncing at checkpoints is plenty.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_current_poll_id(self) -> int:
+        row = self.connection.execute('SELECT poll_id FROM week WHERE id = 1').fetchone()
+        return int(row[0]) if row else 0
+
+    def set_current_poll_id(self, poll_id: int) -> None:
+        self.connection.execute('UPDATE week SET poll_id = ? WHERE id = 1', (poll_id,))
+
+    def get_current_suggestions(self, bypass_cache=False) -> List[Suggestion]:
+        rows = self.connection.execute('SELECT uuid, venue, user_id, user_handle FROM suggestions ORDER BY seq')
+        return [Suggestion(*row) for row in rows]
+
+    def get_suggestion_by_uuid(self, hex_uuid: str) -> Optional[Suggestion]:
+        row = self.connection.execute(
+            'SELECT uuid, venue, user_id, user_handle FROM suggestions WHERE uuid = ?', (hex_uuid,)
+        ).fetchone()
+        return Suggestion(*row) if row else None
+
+    def get_suggestion_count(self) -> int:
+        return int(self.connection.execute('SELECT COUNT(*) FROM suggestions').fetchone()[0])
+
+    def clear_suggestions(self) -> None:
+        self.connection.execute('DELETE FROM suggestions')
+
+    def add_suggestion(self, hex_uuid: str, venue: str, user_id: int, user_handle: str) -> AddSuggestionResult:
+        venue_key = normalize_venue(venue)
+        # IMMEDIATE takes the write lock up front, so nothing can sneak in between the checks and the insert.
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                'SELECT uuid, venue, user_id, user_handle FROM suggestions WHERE venue_key = ?', (venue_key,)
+            ).fetchone()
+            if row:
+                result = AddSuggestionResult(added=False, existing=Suggestion(*row))
+            elif self.get_suggestion_count() >= MAX_SUGGESTIONS:
+                result = AddSuggestionResult(added=False, full=True)
+            else:
+                self.connection.execute(
+                    'INSERT INTO suggestions (uuid, venue, venue_key, user_id, user_handle) VALUES (?, ?, ?, ?, ?)',
+                    (hex_uuid, venue, venue_key, user_id, user_handle)
+                )
+                result = AddSuggestionResult(added=True)
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return result
+
+    def remove_suggestion(self, hex_uuid: str):
+        self.connection.execute('DELETE FROM suggestions WHERE uuid = ?', (hex_uuid,))
+
+    def add_scheduled_venue(self, hex_uuid: str, venue_name: str, cron: str, duration_minutes: int) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO scheduled_venues (uuid, venue_name, cron, duration_minutes) VALUES (?, ?, ?, ?)',
+            (hex_uuid, venue_name, cron, duration_minutes)
+        )
+
+    def remove_scheduled_venue(self, hex_uuid: str) -> None:
+        self.connection.execute('DELETE FROM scheduled_venues WHERE uuid = ?', (hex_uuid,))
+
+    def get_scheduled_venues(self) -> List[ScheduledVenue]:
+        rows = self.connection.execute('SELECT uuid, venue_name, cron, duration_minutes FROM scheduled_venues')
+        return [ScheduledVenue(*row) for row in rows]
+
+    def get_snapshot(self) -> Snapshot:
+        # Read everything in one transaction, so it's all from the same point in time.
+        self.connection.execute('BEGIN')
+        try:
+            return super().get_snapshot()
+        finally:
+            self.connection.execute('COMMIT')
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute('SELECT aggregates FROM stats WHERE id = 1').fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_stats(self, entry: Dict[str, Any], aggregates: Dict[str, Any], expected_version: int) -> bool:
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute('SELECT version FROM stats WHERE id = 1').fetchone()
+            if (row[0] if row else 0) != expected_version:
+                self.connection.execute('ROLLBACK')
+                return False
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stats (id, version, aggregates) VALUES (1, ?, ?)',
+                (aggregates['version'], json.dumps(aggregates, separators=(',', ':')))
+            )
+            self.connection.execute(
+                'INSERT INTO stats_archive (entry) VALUES (?)', (json.dumps(entry, separators=(',', ':')),)
+            )
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return True
+
+    def replace_stats(self, aggregates: Dict[str, Any], expected_version: int) -> bool:
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute('SELECT version FROM stats WHERE id = 1').fetchone()
+            if (row[0] if row else 0) != expected_version:
+                self.connection.execute('ROLLBACK')
+                return False
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stats (id, version, aggregates) VALUES (1, ?, ?)',
+                (aggregates['version'], json.dumps(aggregates, separators=(',', ':')))
+            )
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return True
+
+    def get_stats_archive(self) -> List[Dict[str, Any]]:
+        rows = self.connection.execute('SELECT entry FROM stats_archive ORDER BY seq')
+        return [json.loads(row[0]) for row in rows]
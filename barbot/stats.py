@@ -0,0 +1,151 @@
+"""
+Statistics that outlive each week's suggestions and poll.
+
+Each cycle adds two entries to an archive: who suggested what when the poll is created, and the votes and winner when
+it's closed. Each entry is also folded into running totals as it's added, so /stats only has to read the totals. If
+the totals are ever lost or wrong, `./rebuild-stats.py` rebuilds them from the archive (see `rebuild_totals()`).
+
+We only learn how many people voted for each option when a poll closes, not who they were, so the streaks are of weeks
+in a row that someone suggested a venue.
+"""
+import copy
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .database import Database, Suggestion
+
+# How many entry ids to remember, so that an entry added twice (a retried invocation) is only counted once.
+APPLIED_HISTORY = 20
+SAVE_ATTEMPTS = 3
+
+
+def new_aggregates() -> Dict[str, Any]:
+    return {
+        'version': 0,
+        'applied': [],
+        'polls': 0,
+        'wins': {},
+        'votes': {},
+        'suggestions': {},
+        'handles': {},
+        'streaks': {},
+        'best_streaks': {},
+    }
+
+
+def suggestions_entry(date: datetime.date, suggestions: List[Suggestion]) -> Dict[str, Any]:
+    return {
+        'id': f'suggestions:{date.isoformat()}',
+        'type': 'suggestions',
+        'date': date.isoformat(),
+        'suggestions': [[s.venue, s.user_id, s.user_handle] for s in suggestions],
+    }
+
+
+def result_entry(date: datetime.date, winner: str, votes: Dict[str, int], poll_id: int = 0) -> Dict[str, Any]:
+    return {
+        'id': f'result:{poll_id or date.isoformat()}',
+        'type': 'result',
+        'date': date.isoformat(),
+        'winner': winner,
+        'votes': votes,
+    }
+
+
+def _increment(counts: Dict[str, int], key: Any, amount: int = 1) -> None:
+    counts[str(key)] = counts.get(str(key), 0) + amount
+
+
+def fold(aggregates: Dict[str, Any], entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Add an archive entry to the totals, returning new totals."""
+    aggregates = copy.deepcopy(aggregates)
+    if entry['id'] in aggregates['applied']:
+        return aggregates
+    aggregates['applied'] = (aggregates['applied'] + [entry['id']])[-APPLIED_HISTORY:]
+
+    if entry['type'] == 'suggestions':
+        suggesters = set()
+        for venue, user_id, user_handle in entry['suggestions']:
+            _increment(aggregates['suggestions'], user_id)
+            aggregates['handles'][str(user_id)] = user_handle
+            suggesters.add(str(user_id))
+        # Anyone who didn't suggest anything this time loses their streak.
+        aggregates['streaks'] = {
+            user_id: aggregates['streaks'].get(user_id, 0) + 1 for user_id in suggesters
+        }
+        for user_id, streak in aggregates['streaks'].items():
+            aggregates['best_streaks'][user_id] = max(streak, aggregates['best_streaks'].get(user_id, 0))
+
+    elif entry['type'] == 'result':
+        aggregates['polls'] += 1
+        _increment(aggregates['wins'], entry['winner'])
+        for venue, count in entry['votes'].items():
+            _increment(aggregates['votes'], venue, count)
+
+    return aggregates
+
+
+def rebuild(entries: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    aggregates = new_aggregates()
+    for entry in entries:
+        aggregates = fold(aggregates, entry)
+    return aggregates
+
+
+def rebuild_totals(db: Database) -> Dict[str, Any]:
+    """Replace the totals with ones rebuilt from the whole archive, and return them."""
+    for attempt in range(SAVE_ATTEMPTS):
+        # Read before the archive, so that an entry recorded in between makes the replace fail rather than get lost.
+        current = db.get_stats()
+        expected_version = current['version'] if current else 0
+        aggregates = rebuild(db.get_stats_archive())
+        aggregates['version'] = expected_version + 1
+        if db.replace_stats(aggregates, expected_version):
+            return aggregates
+    raise RuntimeError(f'Gave up rebuilding the stats after {SAVE_ATTEMPTS} attempts')
+
+
+def record(db: Database, entry: Dict[str, Any]) -> None:
+    """Archive an entry and fold it into the totals. Failures are logged, stats aren't worth failing a step over."""
+    try:
+        for attempt in range(SAVE_ATTEMPTS):
+            aggregates = db.get_stats() or new_aggregates()
+            if entry['id'] in aggregates['applied']:
+                return
+            updated = fold(aggregates, entry)
+            updated['version'] = aggregates['version'] + 1
+            if db.save_stats(entry, updated, aggregates['version']):
+                return
+        print(f'Gave up recording {entry["id"]} in stats after {SAVE_ATTEMPTS} attempts')
+    except Exception as err:
+        print(f'Unable to record {entry["id"]} in stats: {err!r}')
+
+
+def _top(counts: Dict[str, int], n: int = 5) -> List[Tuple[str, int]]:
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def format_stats(aggregates: Optional[Dict[str, Any]], user_id: int) -> str:
+    if not aggregates or not (aggregates['polls'] or aggregates['suggestions']):
+        return 'No bar nights have been recorded yet.'
+
+    lines = [f'Bar nights decided: {aggregates["polls"]}']
+
+    wins = _top(aggregates['wins'])
+    if wins:
+        lines.append('\nMost wins:')
+        lines.extend(f'{venue}: {count}' for venue, count in wins)
+
+    suggesters = _top(aggregates['suggestions'])
+    if suggesters:
+        lines.append('\nMost suggestions:')
+        handles = aggregates['handles']
+        lines.extend(f'@{handles.get(suggester, "unknown")}: {count}' for suggester, count in suggesters)
+
+    key = str(user_id)
+    lines.append(
+        f'\nYou have suggested {aggregates["suggestions"].get(key, 0)} venues. '
+        f'Current streak: {aggregates["streaks"].get(key, 0)} weeks, '
+        f'best: {aggregates["best_streaks"].get(key, 0)} weeks.'
+    )
+    return '\n'.join(lines)
@@ -0,0 +1,100 @@
+"""
+A tiny stand-in for api.telegram.org, good enough to point a `telegram.Bot` at in tests.
+"""
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List, Tuple
+
+TOKEN = '123:fake'
+
+
+class FakeBotApi(object):
+    def __init__(self) -> None:
+        self.updates: List[Dict[str, Any]] = []
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body) if body else {}
+                else:
+                    params = {k: _parse_value(v[0]) for k, v in urllib.parse.parse_qs(body).items()}
+                method = self.path.rsplit('/', 1)[-1]
+                result = fake.handle(method, params)
+                response = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(response)))
+                    self.end_headers()
+                    self.wfile.write(response)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up on a long poll
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/bot'
+
+    def start(self) -> 'FakeBotApi':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_update(self, update: Dict[str, Any]) -> None:
+        with self.lock:
+            self.updates.append(update)
+
+    def calls_to(self, method: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [params for name, params in self.calls if name == method]
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        with self.lock:
+            self.calls.append((method, params))
+        if method == 'getMe':
+            return {'id': 123, 'is_bot': True, 'first_name': 'Barbot', 'username': 'barbot'}
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'sendMessage':
+            return {
+                'message_id': len(self.calls),
+                'date': int(time.time()),
+                'chat': {'id': params['chat_id'], 'type': 'private'},
+                'text': params.get('text'),
+            }
+        return True
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset', 0))
+        deadline = time.monotonic() + min(float(params.get('timeout', 0)), 0.2)
+        while True:
+            with self.lock:
+                # Like the real thing, asking for an offset confirms every update before it.
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                pending = self.updates[:int(params.get('limit', 100))]
+            if pending or time.monotonic() >= deadline:
+                return pending
+            time.sleep(0.01)
+
+
+def _parse_value(value: str) -> Any:
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
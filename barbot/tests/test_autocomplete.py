@@ -0,0 +1,45 @@
+import unittest
+
+from barbot.autocomplete import NameIndex
+from barbot.bars import Bar, BarCatalog
+
+
+def make_bar(name: str, *aliases: str) -> Bar:
+    return Bar(name, '', 0, 0, '', set(aliases))
+
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = NameIndex([
+            ("Smuggler's Cove", ["Smuggler's Cove", 'smugglers']),
+            ('SF Eagle', ['SF Eagle', 'the eagle']),
+            ('Zeitgeist', ['Zeitgeist']),
+            ('Zam Zam', ['Zam Zam']),
+        ])
+
+    def test_prefix(self):
+        self.assertEqual(['Zam Zam', 'Zeitgeist'], self.index.search('z'))
+        self.assertEqual(['Zam Zam'], self.index.search('za'))
+
+    def test_prefix_ranked_first(self):
+        self.assertEqual('Zeitgeist', self.index.search('zeit')[0])
+
+    def test_typos(self):
+        self.assertEqual("Smuggler's Cove", self.index.search('smuglers cove')[0])
+        self.assertEqual('Zeitgeist', self.index.search('zietgeist')[0])
+
+    def test_aliases(self):
+        self.assertEqual(['SF Eagle'], self.index.search('the eagel'))
+
+    def test_no_match(self):
+        self.assertEqual([], self.index.search('trick dog'))
+        self.assertEqual([], self.index.search('!!'))
+
+    def test_limit(self):
+        self.assertEqual(1, len(self.index.search('z', limit=1)))
+
+    def test_catalog_index_built_once(self):
+        catalog = BarCatalog([make_bar('Trick Dog', 'the dog')])
+
+        self.assertIs(catalog.search_index, catalog.search_index)
+        self.assertEqual(['Trick Dog'], catalog.search_index.search('the dgo'))
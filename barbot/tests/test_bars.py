@@ -1,6 +1,17 @@
+import os
+import tempfile
+import time
 import unittest
 
-from barbot.bars import _normalize_name, _normalize_spreadsheet_url, _parse_bars
+import httpx
+
+from barbot import bar_snapshot
+
+from barbot.bars import CACHE_LIFETIME_SECONDS, FIRST_LOAD_RETRY_SECONDS, Bar, BarCatalog, BarParser, Bars, _normalize_name, _normalize_spreadsheet_url, _parse_bars
+
+HEADER = "name,address,latitude,longitude,plus_code,aliases\n"
+TRICK_DOG = 'Trick Dog,"3010 20th St, San Francisco, CA 94110",37.75921458,-122.4111932,"QH5Q+MG Mission District",\n'
+ZEITGEIST = 'Zeitgeist,"199 Valencia St, San Francisco, CA 94103",37.77002787,-122.4221187,"QHCH+25 SoMa",zeitgeist bar\n'
 
 
 class TestBars(unittest.TestCase):
@@ -97,3 +108,175 @@ Upcider,"1160 Polk St 2nd floor, San Francisco, CA 94109",37.78753092,-122.41981
 Zeitgeist,"199 Valencia St, San Francisco, CA 94103",37.77002787,-122.4221187,"QHCH+25 SoMa, San Francisco, CA",'''
         bars = _parse_bars(data)
         self.assertEqual(17, len(bars))
+
+    def test_parser_handles_any_chunking(self):
+        text = HEADER + 'Bad,nowhere,north,west,,\n' + TRICK_DOG + 'Pagan Idol,"375 Bush St\nSan Francisco",37.79,-122.40,,pagan idle|pagin idol'
+        for size in (1, 7, len(text)):
+            parser = BarParser()
+            for start in range(0, len(text), size):
+                parser.feed(text[start:start + size])
+            columns = parser.finish()
+
+            self.assertEqual(["Trick Dog", "Pagan Idol"], columns.names)
+            self.assertEqual("375 Bush St\nSan Francisco", columns.addresses[1])
+            self.assertEqual(["pagan idle", "pagin idol"], columns.get_aliases(1))
+            self.assertEqual([], columns.get_aliases(0))
+            self.assertEqual(Bar("Pagan Idol", "375 Bush St\nSan Francisco", 37.79, -122.40, "", {"pagan idle", "pagin idol"}),
+                             columns.row(1))
+            self.assertEqual(bar_snapshot.content_hash(text), parser.hash.hexdigest())
+
+    def test_catalog_matches_names_and_aliases(self):
+        cove = Bar("Smuggler's Cove", "", 0, 0, "", {"smugglers", "the cove"})
+        eagle = Bar("SF Eagle", "", 0, 0, "", {"eagle"})
+        catalog = BarCatalog([cove, eagle])
+
+        self.assertIs(cove, catalog.match_bar("smugglers cove"))
+        self.assertIs(cove, catalog.match_bar("The Cove"))
+        self.assertIs(eagle, catalog.match_bar("EAGLE"))
+        self.assertIsNone(catalog.match_bar("trick dog"))
+        self.assertIsNone(catalog.match_bar("!!"))
+
+    def test_catalog_alias_collisions(self):
+        eagle = Bar("SF Eagle", "", 0, 0, "", {"eagle", "the bird"})
+        bird = Bar("The Bird", "", 0, 0, "", set())
+        eagle_bar = Bar("Eagle Bar", "", 0, 0, "", {"eagle"})
+        catalog = BarCatalog([eagle, bird, eagle_bar])
+
+        # A name always wins over another bar's alias, otherwise the first bar to use an alias keeps it.
+        self.assertIs(bird, catalog.match_bar("the bird"))
+        self.assertIs(eagle, catalog.match_bar("eagle"))
+        self.assertIs(eagle_bar, catalog.match_bar("eagle bar"))
+
+
+class TestBarsRefresh(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.requests = []
+        self.responses = []
+        self.bars = Bars("https://docs.google.com/spreadsheets/d/abc", clock=lambda: self.now)
+        self.bars._client = httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def asyncTearDown(self):
+        await self.bars._client.aclose()
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def test_first_load_waited_for(self):
+        self.responses.append(httpx.Response(200, text=HEADER + TRICK_DOG))
+
+        catalog = await self.bars.ensure_loaded()
+
+        self.assertEqual(["Trick Dog"], [bar.name for bar in catalog.bars])
+        self.assertEqual("https://docs.google.com/spreadsheets/d/abc/export?format=csv", str(self.requests[0].url))
+        self.assertIs(catalog, self.bars.get_catalog())
+        self.assertEqual(1, len(self.requests))
+
+    async def test_stale_list_served_while_refreshing(self):
+        self.responses.append(httpx.Response(200, text=HEADER + TRICK_DOG, headers={"ETag": '"v1"'}))
+        self.responses.append(httpx.Response(200, text=HEADER + TRICK_DOG + ZEITGEIST, headers={"ETag": '"v2"'}))
+        old = await self.bars.ensure_loaded()
+
+        self.now += CACHE_LIFETIME_SECONDS
+        self.assertIs(old, self.bars.get_catalog())
+        await self.bars._refresh
+
+        self.assertEqual('"v1"', self.requests[1].headers["If-None-Match"])
+        self.assertEqual("Zeitgeist", self.bars.match_bar("zeitgeist bar").name)
+
+    async def test_not_modified_keeps_list(self):
+        self.responses.append(httpx.Response(200, text=HEADER + TRICK_DOG, headers={"Last-Modified": "yesterday"}))
+        self.responses.append(httpx.Response(304))
+        old = await self.bars.ensure_loaded()
+
+        self.now += CACHE_LIFETIME_SECONDS
+        await self.bars.refresh()
+
+        self.assertEqual("yesterday", self.requests[1].headers["If-Modified-Since"])
+        self.assertIs(old, self.bars.get_catalog())
+
+    async def test_failed_refresh_keeps_list(self):
+        self.responses.append(httpx.Response(200, text=HEADER + TRICK_DOG))
+        self.responses.append(httpx.ConnectTimeout("too slow"))
+        old = await self.bars.ensure_loaded()
+
+        self.now += CACHE_LIFETIME_SECONDS
+        await self.bars.refresh()
+
+        self.assertIs(old, self.bars.get_catalog())
+
+    async def test_failed_first_load_not_retried_right_away(self):
+        self.responses.append(httpx.Response(500))
+
+        self.assertEqual([], (await self.bars.ensure_loaded()).bars)
+        self.assertEqual([], (await self.bars.ensure_loaded()).bars)
+        self.assertEqual(1, len(self.requests))
+
+    async def test_failed_first_load_retried_soon(self):
+        self.responses.append(httpx.Response(500))
+        self.responses.append(httpx.Response(200, text=HEADER + TRICK_DOG))
+        self.assertEqual([], (await self.bars.ensure_loaded()).bars)
+
+        self.now += FIRST_LOAD_RETRY_SECONDS
+
+        self.assertEqual(["Trick Dog"], [bar.name for bar in (await self.bars.ensure_loaded()).bars])
+        self.assertEqual(2, len(self.requests))
+
+
+class TestBarSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.requests = 0
+
+    def make_bars(self, text: str = HEADER + TRICK_DOG + ZEITGEIST) -> Bars:
+        def handle(request: httpx.Request) -> httpx.Response:
+            self.requests += 1
+            return httpx.Response(200, text=text, headers={"ETag": '"v1"'})
+        bars = Bars("https://docs.google.com/spreadsheets/d/abc", snapshot_dir=self.directory.name)
+        bars._client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        self.addAsyncCleanup(bars._client.aclose)
+        return bars
+
+    async def test_new_process_starts_from_snapshot(self):
+        await self.make_bars().ensure_loaded()
+
+        bars = self.make_bars()
+        catalog = bars.get_catalog()
+
+        self.assertEqual(1, self.requests)
+        self.assertEqual(["Trick Dog", "Zeitgeist"], [bar.name for bar in catalog.bars])
+        self.assertEqual({"zeitgeist bar"}, catalog.match_bar("ZEITGEIST BAR").aliases)
+        self.assertIs(catalog.bars[1], catalog.match_bar("zeitgeist"))
+        self.assertEqual('"v1"', bars._etag)
+
+    async def test_stale_snapshot_revalidated(self):
+        first = self.make_bars()
+        await first.ensure_loaded()
+        catalog = first.get_catalog()
+        old = bar_snapshot.SnapshotData(
+            first._content_hash, time.time() - 3600, '"v0"', None, catalog.columns.to_snapshot(), catalog.index
+        )
+        bar_snapshot.save(first._snapshot_path, old)
+
+        bars = self.make_bars()
+        bars.get_catalog()
+        await bars._refresh
+
+        self.assertEqual(2, self.requests)
+        self.assertEqual('"v1"', bars._etag)
+
+    async def test_unreadable_snapshot_ignored(self):
+        bars = self.make_bars()
+        with open(bars._snapshot_path, "wb") as f:
+            f.write(b"not a snapshot")
+
+        catalog = await bars.ensure_loaded()
+
+        self.assertEqual(2, len(catalog.bars))
+        self.assertIsNotNone(bar_snapshot.load(bars._snapshot_path))
+        self.assertEqual([], [name for name in os.listdir(self.directory.name) if name.endswith(".tmp")])
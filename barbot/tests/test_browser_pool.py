@@ -0,0 +1,141 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from barbot.browser_pool import BrowserPool, BrowserPoolTimeout
+
+
+class TestBrowserPool(unittest.TestCase):
+    def setUp(self):
+        self.drivers = []
+
+    def make_driver(self):
+        driver = MagicMock()
+        self.drivers.append(driver)
+        return driver
+
+    def make_pool(self, size=2, max_renders=3, wait_seconds=5.0, max_idle_seconds=None):
+        return BrowserPool(self.make_driver, size, max_renders, wait_seconds, max_idle_seconds)
+
+    def test_session_reused(self):
+        pool = self.make_pool()
+        with pool.session() as first:
+            pass
+        with pool.session() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(1, len(self.drivers))
+        first.quit.assert_not_called()
+
+    def test_session_replaced_after_max_renders(self):
+        pool = self.make_pool(max_renders=2)
+        for _ in range(5):
+            with pool.session():
+                pass
+
+        self.assertEqual(3, len(self.drivers))
+        self.drivers[0].quit.assert_called_once()
+        self.drivers[1].quit.assert_called_once()
+        self.drivers[2].quit.assert_not_called()
+
+    def test_session_replaced_after_error(self):
+        pool = self.make_pool()
+        with self.assertRaises(ValueError):
+            with pool.session():
+                raise ValueError('render failed')
+        with pool.session() as driver:
+            pass
+
+        self.drivers[0].quit.assert_called_once()
+        self.assertIs(self.drivers[1], driver)
+
+    def test_dead_session_replaced(self):
+        pool = self.make_pool()
+        with pool.session() as dead:
+            pass
+        dead.execute_script.side_effect = ConnectionError('session timed out')
+
+        with pool.session() as driver:
+            pass
+
+        self.assertIsNot(dead, driver)
+        dead.quit.assert_called_once()
+
+    def test_idle_session_expires(self):
+        pool = self.make_pool(size=1, max_idle_seconds=60)
+        with pool.session() as idle:
+            pass
+        pool._idle[0].last_used -= 61
+
+        with pool.session() as driver:
+            pass
+
+        idle.quit.assert_called_once()
+        idle.execute_script.assert_not_called()
+        self.assertIs(self.drivers[1], driver)
+        self.assertEqual(1, pool._open)
+
+    def test_recently_used_session_kept(self):
+        pool = self.make_pool(max_idle_seconds=60)
+        with pool.session() as first:
+            pass
+        pool._idle[0].last_used -= 59
+
+        with pool.session() as second:
+            pass
+
+        self.assertIs(first, second)
+        first.quit.assert_not_called()
+
+    def test_failed_start_frees_its_place(self):
+        pool = self.make_pool(size=1)
+        pool._make_driver = MagicMock(side_effect=ConnectionError('no selenium'))
+        with self.assertRaises(ConnectionError):
+            with pool.session():
+                pass
+
+        pool._make_driver = self.make_driver
+        with pool.session() as driver:
+            self.assertIs(self.drivers[0], driver)
+
+    def test_waits_for_a_free_session(self):
+        pool = self.make_pool(size=1)
+        checked_out = threading.Event()
+        release = threading.Event()
+        drivers = []
+
+        def render():
+            with pool.session() as driver:
+                drivers.append(driver)
+                checked_out.set()
+                release.wait(5)
+
+        first = threading.Thread(target=render)
+        first.start()
+        checked_out.wait(5)
+        second = threading.Thread(target=render)
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(1, len(self.drivers))
+        self.assertEqual([self.drivers[0]] * 2, drivers)
+
+    def test_wait_times_out(self):
+        pool = self.make_pool(size=1, wait_seconds=0.01)
+        with pool.session():
+            with self.assertRaises(BrowserPoolTimeout):
+                with pool.session():
+                    pass
+
+    def test_close(self):
+        pool = self.make_pool()
+        with pool.session() as in_use:
+            with pool.session():
+                pass
+            pool.close()
+            self.drivers[1].quit.assert_called_once()
+            in_use.quit.assert_not_called()
+        in_use.quit.assert_called_once()
@@ -0,0 +1,204 @@
+import unittest
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from barbot import services
+from barbot.chat_database import ChatDynamoDatabase
+from barbot.chats import ChatDirectory
+from barbot.membership import MemoryMembershipStore
+from barbot.app import AppSettings
+
+ENV = {
+    'MAIN_CHAT_ID': '1',
+    'DYNAMO_CHATS_TABLE_NAME': 'chats',
+    'DYNAMO_STATE_TABLE_NAME': 'state',
+    'MAIN_EVENT_CRON': '0 19 ? * WED *',
+}
+
+
+class TestChatDirectory(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.dynamodb = MagicMock()
+        self.dynamodb.get_item.return_value = {}
+        self.directory = ChatDirectory(ENV, self.dynamodb, clock=lambda: self.now)
+
+    def test_default_chat_from_environment(self):
+        app = self.directory.get()
+        self.assertEqual(1, app.MAIN_CHAT_ID)
+        self.assertEqual('0 19 ? * WED *', app.MAIN_EVENT_CRON)
+
+    def test_unknown_chat(self):
+        self.assertIsNone(self.directory.get(2))
+
+    def test_settings_override_environment(self):
+        self.dynamodb.get_item.return_value = {'Item': {
+            'chat_id': {'N': '2'},
+            'settings': {'M': {'MAIN_EVENT_CRON': {'S': '0 18 ? * THU *'}}},
+        }}
+
+        app = self.directory.get(2)
+
+        self.assertEqual(2, app.MAIN_CHAT_ID)
+        self.assertEqual('0 18 ? * THU *', app.MAIN_EVENT_CRON)
+
+    def test_settings_cached(self):
+        first = self.directory.get(1)
+        self.assertIs(first, self.directory.get(1))
+        self.assertEqual(1, self.dynamodb.get_item.call_count)
+
+        self.now += AppSettings(ENV).CHAT_SETTINGS_CACHE_SECONDS + 1
+        self.assertIsNot(first, self.directory.get(1))
+
+    def test_failed_read_not_cached(self):
+        self.dynamodb.get_item.side_effect = [
+            ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'GetItem'),
+            {'Item': {'chat_id': {'N': '2'}, 'settings': {'M': {'MAIN_EVENT_CRON': {'S': '0 18 ? * THU *'}}}}},
+        ]
+
+        with self.assertRaises(ClientError):
+            self.directory.get(2)
+        app = self.directory.get(2)
+
+        self.assertEqual('0 18 ? * THU *', app.MAIN_EVENT_CRON)
+
+    def test_default_chat_falls_back_to_environment(self):
+        self.dynamodb.get_item.side_effect = [
+            ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'GetItem'),
+            {'Item': {'chat_id': {'N': '1'}, 'settings': {'M': {'MAIN_EVENT_CRON': {'S': '0 18 ? * THU *'}}}}},
+        ]
+
+        self.assertEqual('0 19 ? * WED *', self.directory.get().MAIN_EVENT_CRON)
+        self.assertEqual('0 18 ? * THU *', self.directory.get().MAIN_EVENT_CRON)
+
+    def test_chat_ids_listed_and_cached(self):
+        self.dynamodb.scan.side_effect = [
+            {'Items': [{'chat_id': {'N': '3'}}, {'chat_id': {'N': '1'}}], 'LastEvaluatedKey': {'chat_id': {'N': '1'}}},
+            {'Items': [{'chat_id': {'N': '2'}}]},
+        ]
+
+        self.assertEqual([1, 3, 2], self.directory.chat_ids())
+        self.assertEqual([1, 3, 2], self.directory.chat_ids())
+        self.assertEqual(2, self.dynamodb.scan.call_count)
+        self.assertEqual({'chat_id': {'N': '1'}}, self.dynamodb.scan.call_args.kwargs['ExclusiveStartKey'])
+
+    def test_chat_ids_without_table(self):
+        self.assertEqual([1], ChatDirectory({'MAIN_CHAT_ID': '1'}).chat_ids())
+
+
+class TestChatRouting(unittest.TestCase):
+    def test_each_chat_gets_its_own_state(self):
+        shared = services.Services({**ENV, 'DATABASE_BACKEND': 'dynamo_chats'})
+        shared._dynamodb = MagicMock()
+        shared._dynamodb.get_item.return_value = {'Item': {'chat_id': {'N': '2'}}}
+
+        default = shared.chat()
+        other = shared.chat(2)
+
+        self.assertIs(default, shared.chat(None))
+        self.assertIsInstance(other.db, ChatDynamoDatabase)
+        self.assertEqual('chat#2', other.db.pk)
+        self.assertEqual('chat#1', default.db.pk)
+
+    def test_private_updates_go_to_the_users_chat(self):
+        shared = services.Services({**ENV, 'DATABASE_BACKEND': 'dynamo_chats'})
+        shared._dynamodb = MagicMock()
+        shared._dynamodb.get_item.return_value = {'Item': {'chat_id': {'N': '2'}}}
+        shared._dynamodb.scan.return_value = {'Items': [{'chat_id': {'N': '2'}}, {'chat_id': {'N': '3'}}]}
+        shared._members = MemoryMembershipStore(60)
+        shared.members.put(2, 10, 'member')
+        shared.members.put(2, 11, 'member')
+        shared.members.put(1, 11, 'member')
+        shared.members.put(2, 12, 'member')
+        shared.members.put(3, 12, 'administrator')
+        shared.members.put(3, 13, 'left')
+
+        # Only in chat 2, in the default chat too, in two other chats, and not in any.
+        self.assertEqual('chat#2', shared.chat_for_user(10).db.pk)
+        self.assertEqual('chat#1', shared.chat_for_user(11).db.pk)
+        self.assertEqual('chat#1', shared.chat_for_user(12).db.pk)
+        self.assertEqual('chat#1', shared.chat_for_user(13).db.pk)
+
+    def test_single_chat_backends_only_serve_main_chat(self):
+        shared = services.Services({**ENV, 'DATABASE_BACKEND': 'sqlite', 'SQLITE_PATH': ':memory:'})
+        shared._dynamodb = MagicMock()
+        shared._dynamodb.get_item.return_value = {'Item': {'chat_id': {'N': '2'}}}
+
+        self.assertIsNotNone(shared.chat())
+        self.assertIsNone(shared.chat(2))
+
+
+def transaction_canceled(*reasons: dict) -> ClientError:
+    error = ClientError({'Error': {'Code': 'TransactionCanceledException'}}, 'TransactWriteItems')
+    error.response['CancellationReasons'] = list(reasons)  # type: ignore[arg-type]
+    return error
+
+
+class TestChatDynamoDatabase(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = MagicMock()
+        self.dynamodb.exceptions.TransactionCanceledException = ClientError
+        self.db = ChatDynamoDatabase(AppSettings({**ENV, 'MAIN_CHAT_ID': '5'}), self.dynamodb)
+
+    def test_add_suggestion_keyed_by_venue(self):
+        self.assertTrue(self.db.add_suggestion('abc', "Smuggler's Cove", 1, 'someone').added)
+
+        put, count = self.dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual({'pk': {'S': 'chat#5'}, 'sk': {'S': 'suggestion#smugglerscove'}},
+                         {k: put['Put']['Item'][k] for k in ('pk', 'sk')})
+        self.assertIn('suggestion_count < :max', count['Update']['ConditionExpression'])
+
+    def test_duplicate(self):
+        self.dynamodb.transact_write_items.side_effect = transaction_canceled(
+            {'Code': 'ConditionalCheckFailed', 'Item': {
+                'uuid': {'S': 'abc'}, 'name': {'S': 'Smugglers Cove'}, 'user_id': {'N': '1'}, 'user_handle': {'S': 'first'}
+            }},
+            {'Code': 'None'},
+        )
+
+        result = self.db.add_suggestion('def', 'smugglers cove', 2, 'second')
+
+        self.assertEqual('first', result.existing.user_handle)
+
+    def test_full(self):
+        self.dynamodb.transact_write_items.side_effect = transaction_canceled(
+            {'Code': 'None'}, {'Code': 'ConditionalCheckFailed'}
+        )
+        self.assertTrue(self.db.add_suggestion('def', 'Another Bar', 2, 'second').full)
+
+    def test_stats_kept_apart_from_the_week(self):
+        entry = {'id': 'result:7', 'type': 'result', 'date': '2024-01-03', 'winner': 'Bar', 'votes': {}}
+        self.assertTrue(self.db.save_stats(entry, {'version': 1}, 0))
+
+        totals, archive = self.dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual({'pk': {'S': 'chat#5#stats'}, 'sk': {'S': 'aggregates'}}, totals['Update']['Key'])
+        self.assertEqual({'pk': {'S': 'chat#5#stats'}, 'sk': {'S': 'archive#2024-01-03#result:7'}},
+                         {k: archive['Put']['Item'][k] for k in ('pk', 'sk')})
+
+        self.dynamodb.query.return_value = {'Items': [{'entry': archive['Put']['Item']['entry']}]}
+        self.assertEqual([entry], self.db.get_stats_archive())
+        request = self.dynamodb.query.call_args.kwargs
+        self.assertEqual({':pk': {'S': 'chat#5#stats'}, ':prefix': {'S': 'archive#'}},
+                         request['ExpressionAttributeValues'])
+
+    def test_snapshot_is_one_query(self):
+        self.dynamodb.query.return_value = {'Items': [
+            {'pk': {'S': 'chat#5'}, 'sk': {'S': 'week'}, 'poll_id': {'N': '9'}, 'version': {'N': '2'}},
+            {'pk': {'S': 'chat#5'}, 'sk': {'S': 'event#e'}, 'venue_name': {'S': 'El Rio'}, 'cron': {'S': '0 19 ? * WED#4 *'},
+             'duration_minutes': {'N': '240'}},
+            {'pk': {'S': 'chat#5'}, 'sk': {'S': 'suggestion#bar'}, 'uuid': {'S': 'abc'}, 'name': {'S': 'Bar'},
+             'user_id': {'N': '1'}, 'user_handle': {'S': 'someone'}},
+        ]}
+
+        snapshot = self.db.get_snapshot()
+
+        self.assertEqual(9, snapshot.poll_id)
+        self.assertEqual(['Bar'], [s.venue for s in snapshot.suggestions])
+        self.assertEqual(['e'], [e.uuid for e in snapshot.scheduled_venues])
+        self.assertEqual(1, self.dynamodb.query.call_count)
+
+        # Cached until the version changes.
+        self.dynamodb.get_item.return_value = {'Item': {'version': {'N': '2'}}}
+        self.assertEqual(['Bar'], [s.venue for s in self.db.get_current_suggestions()])
+        self.assertEqual(1, self.dynamodb.query.call_count)
@@ -0,0 +1,313 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from barbot import database
+from barbot.app import AppSettings, MAX_SUGGESTIONS
+
+
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, item: dict):
+        super().__init__({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        self.response['Item'] = item  # type: ignore[typeddict-unknown-key]
+
+
+def make_dynamodb() -> MagicMock:
+    dynamodb = MagicMock()
+    dynamodb.exceptions.ClientError = ClientError
+    dynamodb.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+    return dynamodb
+
+
+def make_venue(name: str) -> dict:
+    return {'M': {'name': {'S': name}, 'user_id': {'N': '1'}, 'user_handle': {'S': 'someone'}}}
+
+
+class TestDynamoDatabaseReads(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = make_dynamodb()
+        self.db = database.DynamoDatabase(AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week'}), self.dynamodb)
+
+    def test_suggestion_by_uuid_projects_one_venue(self):
+        self.dynamodb.get_item.return_value = {'Item': {'venues': {'M': {'abc': make_venue('Bar')}}}}
+
+        suggestion = self.db.get_suggestion_by_uuid('abc')
+
+        self.assertEqual('Bar', suggestion.venue)
+        request = self.dynamodb.get_item.call_args.kwargs
+        self.assertEqual('#p0.#p1', request['ProjectionExpression'])
+        self.assertEqual({'#p0': 'venues', '#p1': 'abc'}, request['ExpressionAttributeNames'])
+
+    def test_poll_id_read_is_consistent_and_projected(self):
+        self.dynamodb.get_item.return_value = {'Item': {'poll_id': {'N': '5'}}}
+
+        self.assertEqual(5, self.db.get_current_poll_id())
+
+        request = self.dynamodb.get_item.call_args.kwargs
+        self.assertTrue(request['ConsistentRead'])
+        self.assertEqual('#p0', request['ProjectionExpression'])
+
+    def test_reads_shared_until_write_or_next_invocation(self):
+        self.dynamodb.get_item.return_value = {'Item': {'poll_id': {'N': '5'}}}
+
+        self.db.get_current_poll_id()
+        self.db.get_current_poll_id()
+        self.assertEqual(1, self.dynamodb.get_item.call_count)
+
+        self.db.set_current_poll_id(6)
+        self.db.get_current_poll_id()
+        self.assertEqual(2, self.dynamodb.get_item.call_count)
+
+        self.db.begin_invocation()
+        self.db.get_current_poll_id()
+        self.assertEqual(3, self.dynamodb.get_item.call_count)
+
+    def test_suggestion_lookups_use_cached_suggestions(self):
+        self.dynamodb.get_item.return_value = {'Item': {'venues': {'M': {'abc': make_venue('Bar')}}}}
+
+        self.db.get_current_suggestions()
+        self.assertEqual('Bar', self.db.get_suggestion_by_uuid('abc').venue)
+        self.assertEqual(1, self.db.get_suggestion_count())
+        # The whole item read isn't consistent, so the version gets checked once.
+        self.assertEqual(2, self.dynamodb.get_item.call_count)
+
+
+class TestDynamoDatabaseSuggestionCache(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = make_dynamodb()
+        self.dynamodb.get_item.return_value = {
+            'Item': {'venues': {'M': {'abc': make_venue('Bar')}}, 'version': {'N': '3'}}
+        }
+        self.db = database.DynamoDatabase(AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week'}), self.dynamodb)
+        self.db.get_current_suggestions()
+        self.db.begin_invocation()
+
+    def set_current_version(self, version: int) -> None:
+        self.dynamodb.get_item.return_value = {'Item': {'version': {'N': str(version)}}}
+
+    def test_revalidated_with_version_read(self):
+        self.set_current_version(3)
+
+        self.assertEqual(['Bar'], [s.venue for s in self.db.get_current_suggestions()])
+        request = self.dynamodb.get_item.call_args.kwargs
+        self.assertEqual({'#p0': 'version'}, request['ExpressionAttributeNames'])
+
+    def test_reloaded_when_version_changed(self):
+        self.dynamodb.get_item.side_effect = [
+            {'Item': {'version': {'N': '4'}}},
+            {'Item': {'venues': {'M': {}}, 'version': {'N': '4'}}},
+        ]
+
+        self.assertEqual([], self.db.get_current_suggestions())
+        self.assertNotIn('ProjectionExpression', self.dynamodb.get_item.call_args.kwargs)
+
+    def test_own_write_applied_to_cache(self):
+        self.dynamodb.update_item.return_value = {'Attributes': {'version': {'N': '4'}}}
+        self.db.add_suggestion('def', 'Other Bar', 1, 'someone')
+        self.set_current_version(4)
+
+        self.assertEqual(['Bar', 'Other Bar'], [s.venue for s in self.db.get_current_suggestions()])
+        self.assertIn('ADD version :one', self.dynamodb.update_item.call_args.kwargs['UpdateExpression'])
+
+    def test_failed_write_leaves_cache_alone(self):
+        self.dynamodb.update_item.side_effect = ValueError()
+        with self.assertRaises(ValueError):
+            self.db.add_suggestion('def', 'Other Bar', 1, 'someone')
+        self.set_current_version(3)
+
+        self.assertEqual(['Bar'], [s.venue for s in self.db.get_current_suggestions()])
+
+    def test_cache_dropped_when_someone_else_wrote(self):
+        self.dynamodb.update_item.return_value = {'Attributes': {'version': {'N': '5'}}}
+        self.db.remove_suggestion('abc')
+
+        self.assertIsNone(self.db.suggestions)
+
+
+class TestDynamoDatabaseAddSuggestion(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = make_dynamodb()
+        self.db = database.DynamoDatabase(AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week'}), self.dynamodb)
+
+    def test_added_in_one_write(self):
+        self.dynamodb.update_item.return_value = {'Attributes': {'version': {'N': '1'}}}
+
+        result = self.db.add_suggestion('abc', "Smuggler's Cove", 1, 'someone')
+
+        self.assertTrue(result.added)
+        self.dynamodb.get_item.assert_not_called()
+        request = self.dynamodb.update_item.call_args.kwargs
+        self.assertEqual('smugglerscove', request['ExpressionAttributeNames']['#key'])
+        self.assertIn('attribute_not_exists(venue_keys.#key)', request['ConditionExpression'])
+
+    def test_duplicate_reports_existing_suggestion(self):
+        self.dynamodb.update_item.side_effect = ConditionalCheckFailedException({
+            'venues': {'M': {'abc': make_venue('Smugglers Cove')}},
+            'venue_keys': {'M': {'smugglerscove': {'S': 'abc'}}},
+        })
+
+        result = self.db.add_suggestion('def', "smuggler's cove", 2, 'someone_else')
+
+        self.assertFalse(result.added)
+        self.assertFalse(result.full)
+        self.assertEqual('abc', result.existing.uuid)
+
+    def test_full(self):
+        self.dynamodb.update_item.side_effect = ConditionalCheckFailedException({
+            'venues': {'M': {str(i): make_venue(f'Bar {i}') for i in range(MAX_SUGGESTIONS)}},
+            'venue_keys': {'M': {}},
+        })
+
+        result = self.db.add_suggestion('def', 'Another Bar', 2, 'someone_else')
+
+        self.assertFalse(result.added)
+        self.assertTrue(result.full)
+        self.assertIsNone(result.existing)
+
+    def test_stale_key_removed_and_retried(self):
+        self.dynamodb.update_item.side_effect = [
+            ConditionalCheckFailedException({
+                'venues': {'M': {'abc': make_venue('Other Bar')}},
+                'venue_keys': {'M': {'bar': {'S': 'gone'}}},
+            }),
+            {'Attributes': {'version': {'N': '2'}}},
+            {'Attributes': {'version': {'N': '3'}}},
+        ]
+
+        result = self.db.add_suggestion('def', 'Bar', 2, 'someone_else')
+
+        self.assertTrue(result.added)
+        removal = self.dynamodb.update_item.call_args_list[1].kwargs
+        self.assertEqual('REMOVE venue_keys.#key ADD version :one', removal['UpdateExpression'])
+        self.assertEqual({'S': 'gone'}, removal['ExpressionAttributeValues'][':uuid'])
+
+    def test_not_reported_full_when_it_is_not(self):
+        self.dynamodb.update_item.side_effect = ConditionalCheckFailedException({
+            'venues': {'M': {'abc': make_venue('Other Bar')}},
+            'venue_keys': {'M': {}},
+        })
+
+        with self.assertRaises(RuntimeError):
+            self.db.add_suggestion('def', 'Bar', 2, 'someone_else')
+        self.assertEqual(database.ADD_SUGGESTION_ATTEMPTS, self.dynamodb.update_item.call_count)
+
+    def test_week_item_without_keys_gets_indexed(self):
+        self.dynamodb.get_item.return_value = {'Item': {'venues': {'M': {'abc': make_venue('Bar')}}}}
+        self.dynamodb.update_item.side_effect = [
+            ClientError({'Error': {'Code': 'ValidationException'}}, 'UpdateItem'),
+            {'Attributes': {'version': {'N': '1'}}},
+            {'Attributes': {'version': {'N': '2'}}},
+        ]
+
+        self.assertTrue(self.db.add_suggestion('def', 'Other Bar', 1, 'someone').added)
+        index_request = self.dynamodb.update_item.call_args_list[1].kwargs
+        self.assertEqual({'M': {'bar': {'S': 'abc'}}}, index_request['ExpressionAttributeValues'][':keys'])
+
+
+class TestDynamoDatabaseRemoveSuggestion(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = make_dynamodb()
+        self.db = database.DynamoDatabase(AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week'}), self.dynamodb)
+
+    def test_key_removed_with_suggestion(self):
+        self.dynamodb.get_item.return_value = {'Item': {'venues': {'M': {'abc': make_venue('Bar')}}}}
+        self.dynamodb.update_item.return_value = {'Attributes': {'version': {'N': '2'}}}
+
+        self.db.remove_suggestion('abc')
+
+        request = self.dynamodb.update_item.call_args.kwargs
+        self.assertIn('venue_keys.#key', request['UpdateExpression'])
+        self.assertEqual({'#uuid': 'abc', '#key': 'bar'}, request['ExpressionAttributeNames'])
+
+    def test_legacy_duplicates_can_both_be_removed(self):
+        # Both suggested before venue_keys existed, when the key was given to the other one.
+        venues = {'abc': make_venue('Bar'), 'def': make_venue('bar')}
+        self.dynamodb.get_item.return_value = {'Item': {'venues': {'M': venues}}}
+        self.dynamodb.update_item.side_effect = [
+            ConditionalCheckFailedException({'venues': {'M': venues}, 'venue_keys': {'M': {'bar': {'S': 'def'}}}}),
+            {'Attributes': {'version': {'N': '3'}}},
+        ]
+
+        self.db.remove_suggestion('abc')
+
+        retry = self.dynamodb.update_item.call_args.kwargs
+        self.assertEqual('REMOVE venues.#uuid ADD version :one', retry['UpdateExpression'])
+        self.assertEqual({'#uuid': 'abc'}, retry['ExpressionAttributeNames'])
+        self.assertNotIn('ConditionExpression', retry)
+
+
+class TestDynamoDatabaseSnapshot(unittest.IsolatedAsyncioTestCase):
+    async def test_week_and_events_read_together(self):
+        dynamodb = make_dynamodb()
+        week = {'id': {'S': 'current'}, 'poll_id': {'N': '7'}, 'venues': {'M': {'abc': make_venue('Bar')}}}
+        events = {'id': {'S': 'current'}, 'events': {'M': {'def': {'M': {
+            'venue_name': {'S': 'El Rio'}, 'cron': {'S': '0 19 ? * WED#4 *'}, 'duration_minutes': {'N': '240'}
+        }}}}}
+        dynamodb.batch_get_item.side_effect = [
+            {'Responses': {'week': [week]}, 'UnprocessedKeys': {'events': {'Keys': [{'id': {'S': 'current'}}]}}},
+            {'Responses': {'week': [week], 'events': [events]}},
+        ]
+        db = database.DynamoDatabase(
+            AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week', 'DYNAMO_EVENTS_TABLE_NAME': 'events'}), dynamodb
+        )
+
+        with patch('asyncio.sleep') as sleep:
+            snapshot = await database.read_snapshot(db)
+
+        sleep.assert_awaited_once()
+
+        self.assertEqual(7, snapshot.poll_id)
+        self.assertEqual(['Bar'], [s.venue for s in snapshot.suggestions])
+        self.assertEqual(['El Rio'], [e.venue_name for e in snapshot.scheduled_venues])
+        self.assertTrue(dynamodb.batch_get_item.call_args_list[0].kwargs['RequestItems']['week']['ConsistentRead'])
+        # The rest of the invocation doesn't need to read the week item again.
+        self.assertEqual(7, db.get_current_poll_id())
+        dynamodb.get_item.assert_not_called()
+
+    async def test_gives_up_while_throttled(self):
+        dynamodb = make_dynamodb()
+        dynamodb.batch_get_item.return_value = {
+            'Responses': {}, 'UnprocessedKeys': {'week': {'Keys': [{'id': {'S': 'current'}}]}},
+        }
+        db = database.DynamoDatabase(
+            AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week', 'DYNAMO_EVENTS_TABLE_NAME': 'events'}), dynamodb
+        )
+
+        with patch('asyncio.sleep') as sleep:
+            with self.assertRaises(database.SnapshotUnprocessed):
+                await database.read_snapshot(db)
+
+        self.assertEqual(database.SNAPSHOT_READ_ATTEMPTS, dynamodb.batch_get_item.call_count)
+        self.assertEqual(database.SNAPSHOT_READ_ATTEMPTS - 1, sleep.await_count)
+
+
+class TestDynamoDatabaseStats(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = make_dynamodb()
+        self.db = database.DynamoDatabase(AppSettings({'DYNAMO_WEEK_TABLE_NAME': 'week'}), self.dynamodb)
+
+    def test_each_entry_is_its_own_item(self):
+        entry = {'id': 'result:7', 'type': 'result', 'date': '2024-01-03', 'winner': 'Bar', 'votes': {}}
+        self.assertTrue(self.db.save_stats(entry, {'version': 1}, 0))
+
+        totals, archive = self.dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual({'id': {'S': 'stats'}}, totals['Update']['Key'])
+        self.assertEqual('stats_archive#2024-01-03#result:7', archive['Put']['Item']['id']['S'])
+
+    def test_archive_read_in_order(self):
+        self.dynamodb.scan.side_effect = [
+            {'Items': [{'id': {'S': 'stats_archive#2024-01-10#b'}, 'entry': {'S': '{"id": "b"}'}}],
+             'LastEvaluatedKey': {'id': {'S': 'x'}}},
+            {'Items': [{'id': {'S': 'stats_archive#2024-01-03#a'}, 'entry': {'S': '{"id": "a"}'}}]},
+        ]
+
+        self.assertEqual(['a', 'b'], [entry['id'] for entry in self.db.get_stats_archive()])
+
+    def test_replace_is_conditional(self):
+        self.assertTrue(self.db.replace_stats({'version': 4}, 3))
+
+        kwargs = self.dynamodb.update_item.call_args.kwargs
+        self.assertEqual({'id': {'S': 'stats'}}, kwargs['Key'])
+        self.assertEqual({'N': '3'}, kwargs['ExpressionAttributeValues'][':expected'])
+        self.dynamodb.transact_write_items.assert_not_called()
@@ -0,0 +1,95 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from botocore.stub import Stubber
+
+from barbot.app import AppSettings
+from barbot.database import make_dynamodb_client
+from barbot.db_metrics import DynamoInstrumentation, InstrumentedDatabase
+from barbot.metrics import Metrics
+from barbot.sqlite_database import SqliteDatabase
+
+AWS_ENV = {'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'}
+
+
+class TestDynamoInstrumentation(unittest.TestCase):
+    def setUp(self):
+        environ = patch.dict(os.environ, AWS_ENV)
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.metrics = Metrics()
+        self.instrumentation = DynamoInstrumentation(self.metrics)
+        self.client = make_dynamodb_client(AppSettings({}), self.instrumentation)
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_client_profile(self):
+        client = make_dynamodb_client(AppSettings({'DYNAMODB_RETRY_MODE': 'standard', 'DYNAMODB_MAX_ATTEMPTS': '5'}))
+
+        config = client.meta.config
+        self.assertEqual(1, config.connect_timeout)
+        self.assertEqual(2, config.read_timeout)
+        self.assertEqual({'mode': 'standard', 'total_max_attempts': 5}, config.retries)
+        self.assertTrue(config.tcp_keepalive)
+
+    def test_asks_for_consumed_capacity(self):
+        self.stubber.add_response(
+            'get_item',
+            {'Item': {}, 'ConsumedCapacity': {'TableName': 'week', 'CapacityUnits': 0.5}},
+            {'TableName': 'week', 'Key': {'id': {'S': 'current'}}, 'ReturnConsumedCapacity': 'TOTAL'}
+        )
+
+        self.client.get_item(TableName='week', Key={'id': {'S': 'current'}})
+
+        stats = self.metrics.get('dynamodb.GetItem')
+        self.assertEqual(1, stats.count)
+        self.assertEqual(0.5, stats.capacity_units)
+
+    def test_calls_attributed_to_database_method(self):
+        self.stubber.add_response(
+            'transact_write_items',
+            {'ConsumedCapacity': [{'TableName': 'week', 'CapacityUnits': 2.0}, {'TableName': 'events', 'CapacityUnits': 2.0}],
+             'ResponseMetadata': {'RetryAttempts': 1}}
+        )
+        self.stubber.add_client_error('delete_item', 'ProvisionedThroughputExceededException')
+
+        self.instrumentation.start('db.add_suggestion')
+        self.client.transact_write_items(TransactItems=[
+            {'Delete': {'TableName': 'week', 'Key': {'id': {'S': 'current'}}}},
+        ])
+        self.instrumentation.finish(0.1, False)
+        with self.assertRaises(self.client.exceptions.ProvisionedThroughputExceededException):
+            self.client.delete_item(TableName='week', Key={'id': {'S': 'current'}})
+
+        stats = self.metrics.get('db.add_suggestion')
+        self.assertEqual(1, stats.retries)
+        self.assertEqual(4.0, stats.capacity_units)
+        self.assertEqual(1, self.metrics.get('dynamodb.DeleteItem').errors)
+        self.assertNotIn('db.delete_item', self.metrics.operations)
+
+
+class TestInstrumentedDatabase(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.db = InstrumentedDatabase(SqliteDatabase(':memory:'), self.metrics)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_methods_timed(self):
+        self.db.add_suggestion('a', 'First Bar', 1, 'one')
+        self.assertEqual(['First Bar'], [s.venue for s in self.db.get_current_suggestions()])
+
+        self.assertEqual(1, self.metrics.get('db.add_suggestion').count)
+        self.assertEqual(1, self.metrics.get('db.get_current_suggestions').count)
+
+    def test_errors_counted(self):
+        with patch.object(self.db.db, 'get_current_poll_id', side_effect=Exception('oops')):
+            with self.assertRaises(Exception):
+                self.db.get_current_poll_id()
+
+        self.assertEqual(1, self.metrics.get('db.get_current_poll_id').errors)
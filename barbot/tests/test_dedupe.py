@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import MagicMock
+
+from barbot import dedupe, services, webhook
+from barbot.app import AppSettings
+
+
+class TestMemoryUpdateLedger(unittest.TestCase):
+    def test_second_claim_rejected(self):
+        ledger = dedupe.MemoryUpdateLedger(ttl_seconds=60, max_size=10)
+        self.assertTrue(ledger.claim(1))
+        self.assertFalse(ledger.claim(1))
+        self.assertTrue(ledger.claim(2))
+
+    def test_released_update_can_be_claimed_again(self):
+        ledger = dedupe.MemoryUpdateLedger(ttl_seconds=60, max_size=10)
+        ledger.claim(1)
+        ledger.release(1)
+        self.assertTrue(ledger.claim(1))
+
+    def test_claims_expire(self):
+        now = 1000.0
+        ledger = dedupe.MemoryUpdateLedger(ttl_seconds=60, max_size=10, clock=lambda: now)
+        ledger.claim(1)
+        now += 61
+        self.assertTrue(ledger.claim(1))
+
+    def test_oldest_claims_evicted(self):
+        ledger = dedupe.MemoryUpdateLedger(ttl_seconds=60, max_size=2)
+        for update_id in range(3):
+            ledger.claim(update_id)
+        self.assertTrue(ledger.claim(0))
+        self.assertFalse(ledger.claim(2))
+
+
+class TestDynamoUpdateLedger(unittest.TestCase):
+    def make_ledger(self, dynamodb: MagicMock) -> dedupe.UpdateLedger:
+        app = AppSettings({'DYNAMO_UPDATES_TABLE_NAME': 'updates'})
+        return dedupe.make_update_ledger(app, dynamodb)
+
+    def test_conditional_check_failure_is_duplicate(self):
+        dynamodb = MagicMock()
+        dynamodb.exceptions.ConditionalCheckFailedException = KeyError
+        dynamodb.put_item.side_effect = KeyError()
+        ledger = self.make_ledger(dynamodb)
+
+        self.assertFalse(ledger.claim(5))
+        # Remembered locally, so Dynamo isn't asked again.
+        self.assertFalse(ledger.claim(5))
+        self.assertEqual(1, dynamodb.put_item.call_count)
+
+    def test_other_errors_fail_open(self):
+        dynamodb = MagicMock()
+        dynamodb.exceptions.ConditionalCheckFailedException = KeyError
+        dynamodb.put_item.side_effect = ValueError()
+        ledger = self.make_ledger(dynamodb)
+
+        self.assertTrue(ledger.claim(5))
+
+
+class TestWebhookDedupe(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self):
+        services.reset_services()
+
+    async def test_redelivered_update_skipped(self):
+        shared = services.Services({'TELEGRAM_BOT_TOKEN': '123:abc', 'TELEGRAM_PRECONNECT': 'false'})
+        services.reset_services(shared)
+        shared.ledger.claim(10)
+
+        # Would fail to parse if it got that far.
+        self.assertIsNone(await webhook.handle_webhook_async({'update_id': 10, 'message': 'garbage'}))
+
+    async def test_failed_update_released(self):
+        shared = services.Services({'TELEGRAM_BOT_TOKEN': '123:abc', 'TELEGRAM_PRECONNECT': 'false'})
+        services.reset_services(shared)
+
+        with self.assertRaises(Exception):
+            await webhook.handle_webhook_async({'update_id': 11, 'message': 'garbage'})
+        self.assertTrue(shared.ledger.claim(11))
@@ -0,0 +1,90 @@
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from barbot import geo, map_cache
+from barbot.app import AppSettings
+from barbot.bars import Bar
+
+
+class TestRenderReadiness(unittest.TestCase):
+    def setUp(self):
+        geo.render_metrics.reset()
+        self.addCleanup(geo.render_metrics.reset)
+        self.driver = MagicMock()
+        self.driver.find_element.return_value.screenshot_as_png = b'png'
+        pool = MagicMock()
+        pool.session.return_value.__enter__.return_value = self.driver
+        patcher = patch.object(geo, 'get_browser_pool', return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_screenshot_once_ready(self):
+        self.driver.execute_script.side_effect = [False, False, True]
+        app = AppSettings({'MAP_RENDER_TIMEOUT_SECONDS': '5'})
+
+        self.assertEqual((b'png', True), geo._render_html('<html></html>', app))
+
+        self.assertEqual(3, self.driver.execute_script.call_count)
+        stats = geo.render_metrics.get('map.ready')
+        self.assertEqual((1, 0), (stats.count, stats.errors))
+
+    def test_screenshot_after_timeout(self):
+        self.driver.execute_script.return_value = False
+        app = AppSettings({'MAP_RENDER_TIMEOUT_SECONDS': '0.1'})
+
+        self.assertEqual((b'png', False), geo._render_html('<html></html>', app))
+
+        stats = geo.render_metrics.get('map.ready')
+        self.assertEqual((1, 1), (stats.count, stats.errors))
+
+    def test_ready_script_runs_before_map(self):
+        with patch.object(geo, '_render_html', return_value=(b'png', True)) as render:
+            geo._render_bars([Bar('Trick Dog', '', 37.759, -122.411, '', set())], (720, 720), AppSettings({}))
+
+        html = render.call_args[0][0]
+        self.assertLess(html.index('L.Map.addInitHook'), html.index('L.map('))
+        self.assertLess(html.index('L.map('), html.index('.fitBounds('))
+
+
+class TestMapCaching(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = map_cache.MapCache(4, map_cache.DirectoryBlobStore(directory.name), None)
+        patcher = patch.object(geo, '_map_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(geo, '_render_bars', side_effect=lambda bars, dimensions, app: (bars[0].name.encode(), True))
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = AppSettings({})
+        self.trick_dog = Bar('Trick Dog', '3010 20th St', 37.759, -122.411, '', set())
+        self.zeitgeist = Bar('Zeitgeist', '199 Valencia St', 37.770, -122.422, '', set())
+
+    def test_same_map_rendered_once(self):
+        first = geo._map_bars_to_png([self.trick_dog, self.zeitgeist], (720, 720), self.app)
+        # Renamed, but in the same place, so the map is the same.
+        renamed = self.trick_dog._replace(name='Trick Dog Bar')
+        second = geo._map_bars_to_png([renamed, self.zeitgeist], (720, 720), self.app)
+
+        self.assertEqual(1, self.render.call_count)
+        self.assertEqual(first[1], second[1])
+        self.assertEqual({'A': renamed, 'B': self.zeitgeist}, second[0])
+
+    def test_different_maps_rendered(self):
+        geo._map_bars_to_png([self.trick_dog, self.zeitgeist], (720, 720), self.app)
+        geo._map_bars_to_png([self.zeitgeist, self.trick_dog], (720, 720), self.app)
+        geo._map_bars_to_png([self.trick_dog, self.zeitgeist], (360, 360), self.app)
+
+        self.assertEqual(3, self.render.call_count)
+
+    def test_map_that_timed_out_not_cached(self):
+        self.render.side_effect = lambda bars, dimensions, app: (b'grey tiles', False)
+        first = geo._map_bars_to_png([self.trick_dog], (720, 720), self.app)
+        self.render.side_effect = lambda bars, dimensions, app: (b'map', True)
+        second = geo._map_bars_to_png([self.trick_dog], (720, 720), self.app)
+        third = geo._map_bars_to_png([self.trick_dog], (720, 720), self.app)
+
+        self.assertEqual(2, self.render.call_count)
+        self.assertEqual([b'grey tiles', b'map', b'map'], [first[1], second[1], third[1]])
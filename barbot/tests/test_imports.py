@@ -0,0 +1,17 @@
+import subprocess
+import sys
+import unittest
+
+
+class TestWebhookImports(unittest.TestCase):
+    def test_webhook_does_not_import_map_rendering(self):
+        # Run in a fresh interpreter, since other tests may have already imported these.
+        p = subprocess.run(
+            [sys.executable, '-c', 'import sys, barbot.webhook; print(" ".join(sys.modules))'],
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        loaded = set(name.split('.')[0] for name in p.stdout.split())
+        for module in ('folium', 'branca', 'numpy', 'selenium'):
+            self.assertNotIn(module, loaded)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from barbot.app import AppSettings
+from barbot.map_cache import DirectoryBlobStore, MapCache, cache_key, make_blob_store
+
+
+class TestMapCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.disk = DirectoryBlobStore(os.path.join(directory.name, 'disk'), max_entries=3)
+        self.blobs = DirectoryBlobStore(os.path.join(directory.name, 'blobs'))
+
+    def test_memory_is_bounded(self):
+        cache = MapCache(2, None, None)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        cache.get('a')
+        cache.put('c', b'3')
+
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(b'3', cache.get('c'))
+
+    def test_lower_tiers_fill_upper_ones(self):
+        self.blobs.put('a', b'1')
+        cache = MapCache(2, self.disk, self.blobs)
+
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertEqual(b'1', self.disk.get('a'))
+        self.assertEqual(1, cache.metrics.get('map_cache.blob').count)
+
+        # A new process starts from the disk.
+        cache = MapCache(2, self.disk, self.blobs)
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertEqual(1, cache.metrics.get('map_cache.disk').count)
+        self.assertEqual(1, cache.metrics.get('map_cache.memory').count)
+
+    def test_put_writes_every_tier(self):
+        MapCache(2, self.disk, self.blobs).put('a', b'1')
+
+        self.assertEqual(b'1', self.disk.get('a'))
+        self.assertEqual(b'1', self.blobs.get('a'))
+
+    def test_broken_tier_skipped(self):
+        broken = MagicMock()
+        broken.get.side_effect = OSError('unreachable')
+        broken.put.side_effect = OSError('unreachable')
+        cache = MapCache(0, self.disk, broken)
+
+        cache.put('a', b'1')
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.metrics.get('map_cache.miss').count)
+
+    def test_disk_is_pruned(self):
+        for i, key in enumerate('abc'):
+            self.disk.put(key, b'png')
+            path = self.disk._path(key)
+            os.utime(path, (i, i))
+        # Reading a file keeps it, even though it was written first.
+        self.disk.get('a')
+        self.disk.put('d', b'png')
+
+        self.assertEqual([b'png', None, b'png', b'png'], [self.disk.get(key) for key in 'abcd'])
+
+    def test_cache_key(self):
+        self.assertEqual(cache_key(1, (720, 720)), cache_key(1, [720, 720]))
+        self.assertNotEqual(cache_key(1, (720, 720)), cache_key(2, (720, 720)))
+
+    def test_make_blob_store(self):
+        self.assertIsNone(make_blob_store(AppSettings({})))
+        store = make_blob_store(AppSettings({'MAP_BLOB_STORE': 'local', 'MAP_BLOB_STORE_DIR': '/maps'}))
+        self.assertIsInstance(store, DirectoryBlobStore)
+        with self.assertRaises(ValueError):
+            make_blob_store(AppSettings({'MAP_BLOB_STORE': 's4'}))
+        with self.assertRaises(ValueError):
+            make_blob_store(AppSettings({'MAP_BLOB_STORE': 'local'}))
@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import telegram
+
+from barbot import database, services, webhook
+from barbot.app import AppSettings
+from barbot.membership import DynamoMembershipStore, MemoryMembershipStore
+
+
+class TestMemoryMembershipStore(unittest.TestCase):
+    def test_expires(self):
+        now = 100.0
+        store = MemoryMembershipStore(ttl_seconds=10, clock=lambda: now)
+        store.put(1, 2, 'member')
+        self.assertEqual('member', store.get(1, 2))
+        now += 11
+        self.assertIsNone(store.get(1, 2))
+
+    def test_older_update_ignored(self):
+        store = MemoryMembershipStore(ttl_seconds=10)
+        store.put(1, 2, 'left', updated_at=200)
+        store.put(1, 2, 'member', updated_at=100)
+        self.assertEqual('left', store.get(1, 2))
+
+
+class TestDynamoMembershipStore(unittest.TestCase):
+    def test_read_through_front_cache(self):
+        dynamodb = MagicMock()
+        dynamodb.get_item.return_value = {'Item': {
+            'status': {'S': 'administrator'}, 'updated_at': {'N': '1'}, 'expires_at': {'N': '99999999999'}
+        }}
+        store = DynamoMembershipStore(
+            AppSettings({'DYNAMO_MEMBERS_TABLE_NAME': 'members'}), dynamodb, MemoryMembershipStore(60)
+        )
+
+        self.assertEqual('administrator', store.get(1, 2))
+        self.assertEqual('administrator', store.get(1, 2))
+        self.assertEqual(1, dynamodb.get_item.call_count)
+        self.assertEqual({'id': {'S': '1:2'}}, dynamodb.get_item.call_args.kwargs['Key'])
+
+
+class TestMembershipUpdates(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self):
+        services.reset_services()
+
+    async def test_chat_member_update_recorded(self):
+        shared = services.Services({
+            'TELEGRAM_BOT_TOKEN': '123:abc', 'TELEGRAM_PRECONNECT': 'false', 'MAIN_CHAT_ID': '-5',
+            'DATABASE_BACKEND': 'sqlite', 'SQLITE_PATH': ':memory:',
+        })
+        services.reset_services(shared)
+        user = {'id': 7, 'is_bot': False, 'first_name': 'A'}
+
+        await webhook.handle_webhook_async({
+            'update_id': 1,
+            'chat_member': {
+                'chat': {'id': -5, 'type': 'supergroup'},
+                'from': user,
+                'date': 1700000000,
+                'old_chat_member': {'status': 'left', 'user': user},
+                'new_chat_member': {'status': 'member', 'user': user},
+            }
+        })
+
+        bot = MagicMock()
+        bot.get_chat_member = AsyncMock()
+        self.assertTrue(await database.is_user_part_of_main_chat(bot, shared.app, 7, shared.members))
+        bot.get_chat_member.assert_not_called()
+
+    async def test_falls_back_to_get_chat_member(self):
+        store = MemoryMembershipStore(60)
+        bot = MagicMock()
+        bot.get_chat_member = AsyncMock(return_value=MagicMock(status=telegram.ChatMember.ADMINISTRATOR))
+        app = AppSettings({'MAIN_CHAT_ID': '-5'})
+
+        self.assertTrue(await database.is_user_admin_of_main_chat(bot, app, 7, store))
+        self.assertTrue(await database.is_user_admin_of_main_chat(bot, app, 7, store))
+        bot.get_chat_member.assert_called_once_with(chat_id=-5, user_id=7)
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import telegram
+
+from barbot.app import AppSettings
+from barbot.outbox import Outbox, TokenBucket
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_waits_for_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=3, clock=clock)
+
+        self.assertEqual([0.0, 0.0, 0.0], [bucket.reserve() for _ in range(3)])
+        self.assertAlmostEqual(0.5, bucket.reserve())
+        self.assertAlmostEqual(1.0, bucket.reserve())
+
+        clock.now = 10
+        self.assertEqual(0.0, bucket.reserve())
+
+
+class TestOutbox(unittest.IsolatedAsyncioTestCase):
+    async def test_same_chat_in_order_other_chats_concurrent(self):
+        order = []
+        first_chat_started = asyncio.Event()
+        release_first_chat = asyncio.Event()
+
+        async def send_message(chat_id, text):
+            order.append(text)
+            if text == 'a1':
+                first_chat_started.set()
+                await release_first_chat.wait()
+            return text
+
+        bot = MagicMock()
+        bot.send_message = send_message
+        outbox = Outbox(bot, AppSettings({}))
+
+        a1 = outbox.send('send_message', chat_id=1, text='a1')
+        a2 = outbox.send('send_message', chat_id=1, text='a2')
+        b1 = outbox.send('send_message', chat_id=2, text='b1')
+        await first_chat_started.wait()
+        self.assertEqual('b1', await b1)
+        self.assertNotIn('a2', order)
+
+        release_first_chat.set()
+        self.assertEqual(['a1', 'a2'], [await a1, await a2])
+        self.assertEqual(['a1', 'b1', 'a2'], order)
+
+    async def test_retry_after_is_retried(self):
+        bot = MagicMock()
+        bot.send_message = AsyncMock(side_effect=[telegram.error.RetryAfter(0), 'sent'])
+        outbox = Outbox(bot, AppSettings({}))
+
+        self.assertEqual('sent', await outbox.call('send_message', chat_id=1, text='hi'))
+        self.assertEqual(2, bot.send_message.call_count)
+        self.assertEqual(1, outbox.metrics.get('send_message').retries)
+
+    async def test_gives_up_after_max_retries(self):
+        bot = MagicMock()
+        bot.send_message = AsyncMock(side_effect=telegram.error.RetryAfter(0))
+        outbox = Outbox(bot, AppSettings({'OUTBOX_MAX_RETRIES': '1'}))
+
+        with self.assertRaises(telegram.error.RetryAfter):
+            await outbox.call('send_message', chat_id=1, text='hi')
+        self.assertEqual(1, outbox.metrics.get('send_message').errors)
@@ -0,0 +1,232 @@
+import asyncio
+import random
+import unittest
+from typing import Any, Dict, List
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import telegram
+
+from barbot import polling
+from barbot.tests.fake_bot_api import FakeBotApi, TOKEN
+
+
+def make_message_update(update_id: int, chat_id: int) -> Dict[str, Any]:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'group'},
+            'text': f'message {update_id}',
+        }
+    }
+
+
+class TestOrderingKey(unittest.TestCase):
+    def test_messages_keyed_by_chat(self):
+        self.assertEqual('chat:5', polling.get_ordering_key(make_message_update(1, 5)))
+
+    def test_inline_queries_keyed_by_user(self):
+        update = {'update_id': 1, 'inline_query': {'id': '1', 'from': {'id': 7}, 'query': 'foo', 'offset': ''}}
+        self.assertEqual('user:7', polling.get_ordering_key(update))
+
+
+class TestUpdateDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_updates_in_same_chat_handled_in_order(self) -> None:
+        handled: Dict[int, List[int]] = {}
+        running = 0
+        max_running = 0
+
+        async def handler(update: Dict[str, Any]) -> None:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(random.uniform(0, 0.01))
+            chat_id = update['message']['chat']['id']
+            handled.setdefault(chat_id, []).append(update['update_id'])
+            running -= 1
+
+        dispatcher = polling.UpdateDispatcher(handler, worker_count=4, queue_size=2)
+        dispatcher.start()
+        for update_id in range(60):
+            await dispatcher.put(make_message_update(update_id, chat_id=update_id % 6))
+        await dispatcher.stop()
+
+        self.assertEqual(6, len(handled))
+        for chat_id, update_ids in handled.items():
+            self.assertEqual(sorted(update_ids), update_ids)
+            self.assertEqual(10, len(update_ids))
+        self.assertGreater(max_running, 1)
+
+    async def test_put_waits_when_worker_is_behind(self):
+        release = asyncio.Event()
+
+        async def handler(update: Dict[str, Any]) -> None:
+            await release.wait()
+
+        dispatcher = polling.UpdateDispatcher(handler, worker_count=1, queue_size=1)
+        dispatcher.start()
+        await dispatcher.put(make_message_update(1, 1))
+        await asyncio.sleep(0)  # let the worker pick it up
+        await dispatcher.put(make_message_update(2, 1))
+
+        blocked = asyncio.ensure_future(dispatcher.put(make_message_update(3, 1)))
+        await asyncio.sleep(0.05)
+        self.assertFalse(blocked.done())
+
+        release.set()
+        await blocked
+        await dispatcher.stop()
+
+    async def test_handler_errors_do_not_stop_worker(self):
+        handled = []
+
+        async def handler(update: Dict[str, Any]) -> None:
+            if update['update_id'] == 1:
+                raise ValueError('oops')
+            handled.append(update['update_id'])
+
+        dispatcher = polling.UpdateDispatcher(handler, worker_count=1, queue_size=4)
+        dispatcher.start()
+        await dispatcher.put(make_message_update(1, 1))
+        await dispatcher.put(make_message_update(2, 1))
+        await dispatcher.stop()
+
+        self.assertEqual([2], handled)
+
+
+class TestPollerWithFakeApi(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = FakeBotApi().start()
+        self.bot = telegram.Bot(TOKEN, base_url=self.api.base_url)
+
+    async def asyncTearDown(self):
+        await self.bot.shutdown()
+        self.api.stop()
+
+    async def test_updates_fetched_dispatched_and_answered(self):
+        for update_id in range(1, 6):
+            self.api.add_update(make_message_update(update_id, chat_id=update_id % 2))
+        self.api.add_update({
+            'update_id': 6,
+            'inline_query': {'id': 'q', 'from': {'id': 7, 'is_bot': False, 'first_name': 'A'}, 'query': 'x', 'offset': ''},
+        })
+
+        handled = []
+        done = asyncio.Event()
+
+        async def handler(update: Dict[str, Any]) -> None:
+            handled.append(update['update_id'])
+            if 'inline_query' in update:
+                await polling.call_method(self.bot, {
+                    'method': 'answerInlineQuery',
+                    'inline_query_id': update['inline_query']['id'],
+                    'results': [],
+                })
+            if len(handled) == 6:
+                done.set()
+
+        dispatcher = polling.UpdateDispatcher(handler, worker_count=3, queue_size=2)
+        dispatcher.start()
+        poller = polling.Poller(self.bot, dispatcher, timeout=1)
+        poll_task = asyncio.ensure_future(poller.run())
+        await asyncio.wait_for(done.wait(), timeout=5)
+        poller.stop()
+        await poll_task
+        await dispatcher.stop()
+
+        self.assertEqual(list(range(1, 7)), sorted(handled))
+        self.assertEqual(7, poller.offset)
+        self.assertEqual([{'inline_query_id': 'q', 'results': []}], self.api.calls_to('answerInlineQuery'))
+
+
+    async def test_offset_held_until_update_handled(self):
+        self.api.add_update(make_message_update(1, chat_id=1))
+        self.api.add_update(make_message_update(2, chat_id=4))
+
+        handled = []
+        release = asyncio.Event()
+        done = asyncio.Event()
+
+        async def handler(update: Dict[str, Any]) -> None:
+            if update['update_id'] == 1:
+                await release.wait()
+            handled.append(update['update_id'])
+            if len(handled) == 2:
+                done.set()
+
+        # Chats 1 and 4 go to different workers.
+        dispatcher = polling.UpdateDispatcher(handler, worker_count=2, queue_size=2)
+        dispatcher.start()
+        poller = polling.Poller(self.bot, dispatcher, timeout=1)
+        poll_task = asyncio.ensure_future(poller.run())
+        while handled != [2]:
+            await asyncio.sleep(0.01)
+
+        # Telegram keeps sending update 1 back, but it isn't handled twice.
+        await asyncio.sleep(0.1)
+        self.assertEqual(1, poller.offset)
+        self.assertEqual([1, 2], [u['update_id'] for u in self.api.updates])
+
+        release.set()
+        await asyncio.wait_for(done.wait(), timeout=5)
+        poller.stop()
+        await poll_task
+        await dispatcher.stop()
+
+        self.assertEqual([2, 1], handled)
+        self.assertEqual(3, poller.offset)
+
+
+class TestPollerErrors(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.handled = []
+
+        async def handler(update: Dict[str, Any]) -> None:
+            self.handled.append(update['update_id'])
+
+        self.dispatcher = polling.UpdateDispatcher(handler, worker_count=1, queue_size=2)
+        self.dispatcher.start()
+        self.bot = MagicMock()
+
+    async def test_conflict_retried(self):
+        poller = polling.Poller(self.bot, self.dispatcher, timeout=1)
+
+        responses: List[Any] = [
+            telegram.error.Conflict('terminated by other getUpdates request'),
+            [make_message_update(1, chat_id=1)],
+        ]
+
+        async def get_updates(*args, **kwargs):
+            if not responses:
+                poller.running = False
+                return []
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        self.bot.do_api_request = AsyncMock(side_effect=get_updates)
+
+        with patch.object(polling, 'CONFLICT_RETRY_SECONDS', 0):
+            await poller.run()
+        await self.dispatcher.stop()
+
+        self.assertEqual([1], self.handled)
+        self.assertEqual(2, poller.offset)
+
+    async def test_queued_updates_finished_when_polling_fails(self):
+        poller = polling.Poller(self.bot, self.dispatcher, timeout=1)
+        self.bot.do_api_request = AsyncMock(side_effect=[
+            [make_message_update(1, chat_id=1), make_message_update(2, chat_id=1)],
+            telegram.error.InvalidToken(),
+            True,
+        ])
+
+        with self.assertRaises(telegram.error.InvalidToken):
+            try:
+                await poller.run()
+            finally:
+                await polling.finish_polling(self.bot, poller, self.dispatcher)
+
+        self.assertEqual([1, 2], self.handled)
+        self.assertEqual({'offset': 3, 'timeout': 0}, self.bot.do_api_request.call_args.kwargs['api_kwargs'])
@@ -7,7 +7,7 @@ import telegram
 
 from barbot import sequence
 from barbot.app import AppSettings
-from barbot.database import ScheduledVenue, Suggestion
+from barbot.database import ScheduledVenue, Snapshot, Suggestion
 from barbot.sequence import SequenceServices
 
 
@@ -37,6 +37,12 @@ class MockServices(object):
     def __init__(self):
         db = MagicMock()
         db.return_value.get_current_poll_id.return_value = 1
+        db.return_value.get_stats.return_value = None
+        db.return_value.get_snapshot.side_effect = lambda: Snapshot(
+            db.return_value.get_current_poll_id(),
+            db.return_value.get_current_suggestions(),
+            db.return_value.get_scheduled_venues()
+        )
         self.db = db
 
         bot = MagicMock()
@@ -286,6 +292,21 @@ class TestChooseWinner(unittest.IsolatedAsyncioTestCase):
         mock_services.bot.return_value.pin_chat_message.assert_called_with(
             chat_id=mock_services.app_settings.MAIN_CHAT_ID, message_id=ANY)
 
+    async def test_result_recorded_in_stats(self):
+        mock_services = MockServices()
+        mock_services.configure_stop_poll([
+            telegram.PollOption('Foo', 5),
+            telegram.PollOption('Bar', 6),
+        ])
+
+        await sequence.handle_choose_winner({}, mock_services.make_services())
+
+        entry, aggregates, expected_version = mock_services.db.return_value.save_stats.call_args.args
+        self.assertEqual('Bar', entry['winner'])
+        self.assertEqual({'Foo': 5, 'Bar': 6}, entry['votes'])
+        self.assertEqual({'Bar': 1}, aggregates['wins'])
+        self.assertEqual(0, expected_version)
+
 
     @patch('barbot.schedule_util.get_now')
     async def test_noop_when_scheduled_event_conflicts(self, mock_get_now):
@@ -0,0 +1,70 @@
+import asyncio
+import importlib.util
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from barbot import bot_transport, services
+from barbot.app import AppSettings
+
+
+class TestServices(unittest.TestCase):
+    def tearDown(self):
+        services.reset_services()
+
+    def test_services_built_once(self):
+        shared = services.Services({'TELEGRAM_BOT_TOKEN': '123:abc', 'MAIN_CHAT_ID': '42'})
+
+        self.assertIs(shared.app, shared.app)
+        self.assertIs(shared.bot, shared.bot)
+        self.assertIs(shared.bars, shared.bars)
+        self.assertEqual(42, shared.app.MAIN_CHAT_ID)
+
+    def test_get_services_reused_until_reset(self):
+        first = services.get_services()
+        self.assertIs(first, services.get_services())
+
+        services.reset_services()
+        self.assertIsNot(first, services.get_services())
+
+    def test_reset_with_replacement(self):
+        replacement = services.Services({})
+        services.reset_services(replacement)
+        self.assertIs(replacement, services.get_services())
+
+
+class TestBotTransport(unittest.IsolatedAsyncioTestCase):
+    async def test_preconnect_can_be_disabled(self):
+        shared = services.Services({'TELEGRAM_BOT_TOKEN': '123:abc', 'TELEGRAM_PRECONNECT': 'false'})
+        await shared.prepare()
+        self.assertFalse(shared.bot._initialized)
+
+    async def test_preconnect_failure_is_not_fatal(self):
+        # Nothing is listening here, so getMe fails.
+        shared = services.Services({
+            'TELEGRAM_BOT_TOKEN': '123:abc',
+            'TELEGRAM_CONNECT_TIMEOUT': '0.5',
+        })
+        shared._bot = bot_transport.make_bot(shared.app)
+        shared._bot._base_url = 'http://127.0.0.1:9/bot123:abc'
+        await shared.prepare()
+        await shared._preconnect
+        self.assertFalse(shared.bot._initialized)
+
+    async def test_preconnect_not_waited_for(self):
+        shared = services.Services({'TELEGRAM_BOT_TOKEN': '123:abc'})
+        connected = asyncio.Event()
+        shared._bot = MagicMock()
+        shared._bot.initialize = AsyncMock(side_effect=connected.wait)
+
+        await asyncio.wait_for(shared.prepare(), 1)
+        self.assertFalse(shared._preconnect.done())
+
+        connected.set()
+        await shared._preconnect
+        shared._bot.initialize.assert_awaited_once()
+
+    def test_http2_falls_back_without_h2(self):
+        app = AppSettings({'TELEGRAM_BOT_TOKEN': '123:abc', 'TELEGRAM_HTTP2': 'true'})
+        request = bot_transport.make_request(app)
+        expected = '1.1' if importlib.util.find_spec('h2') is None else '2'
+        self.assertEqual(expected, request.http_version)
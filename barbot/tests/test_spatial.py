@@ -0,0 +1,59 @@
+import math
+import random
+import unittest
+
+from barbot import util
+from barbot.bars import Bar, BarCatalog
+from barbot.spatial import EARTH_RADIUS_METERS, SpatialIndex
+
+
+def make_bar(name: str, latitude: float, longitude: float) -> Bar:
+    return Bar(name, '', latitude, longitude, '', set())
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(4)
+        # Bars scattered around San Francisco, and a few much further away.
+        self.bars = [make_bar(f'sf{i}', 37.7 + rng.random() * 0.15, -122.5 + rng.random() * 0.15) for i in range(500)]
+        self.bars += [make_bar('oakland', 37.8044, -122.2712), make_bar('la', 34.0522, -118.2437)]
+        self.index = SpatialIndex(BarCatalog(self.bars))
+
+    def brute_force(self, lat: float, lon: float, k: int):
+        return sorted(self.bars, key=lambda b: distance(lat, lon, b.latitude, b.longitude))[:k]
+
+    def test_matches_brute_force(self):
+        for lat, lon in [(37.77, -122.42), (37.71, -122.49), (37.9, -122.3), (37.0, -123.0), (51.5, -0.12)]:
+            nearest = self.index.nearest(lat, lon, 5)
+            self.assertEqual(self.brute_force(lat, lon, 5), [bar for bar, _ in nearest])
+            for bar, meters in nearest:
+                self.assertAlmostEqual(distance(lat, lon, bar.latitude, bar.longitude), meters, delta=0.01)
+
+    def test_more_than_there_are(self):
+        index = SpatialIndex(BarCatalog(self.bars[:3]))
+        self.assertEqual(3, len(index.nearest(37.77, -122.42, 10)))
+
+    def test_empty(self):
+        self.assertEqual([], SpatialIndex(BarCatalog([])).nearest(37.77, -122.42, 5))
+
+    def test_known_distance(self):
+        (bar, meters), = self.index.nearest(34.0, -118.2, 1)
+        self.assertEqual('la', bar.name)
+        self.assertAlmostEqual(7065, meters, delta=5)
+
+    def test_catalog_index_built_once(self):
+        catalog = BarCatalog(self.bars)
+        self.assertIs(catalog.spatial_index, catalog.spatial_index)
+
+    def test_format(self):
+        self.assertEqual('350 m', util.format_distance(347))
+        self.assertEqual('1.2 km', util.format_distance(1234))
+        self.assertEqual('Trick Dog (1.2 km, 3010 20th St)', util.get_near_message_text([
+            (Bar('Trick Dog', '3010 20th St', 0, 0, '', set()), 1234)
+        ]))
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from barbot import services
+from barbot.app import MAX_SUGGESTIONS
+from barbot.sqlite_database import SqliteDatabase
+
+
+class TestSqliteDatabase(unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_poll_id(self):
+        self.assertEqual(0, self.db.get_current_poll_id())
+        self.db.set_current_poll_id(12)
+        self.assertEqual(12, self.db.get_current_poll_id())
+
+    def test_suggestions(self):
+        self.assertTrue(self.db.add_suggestion('a', 'First Bar', 1, 'one').added)
+        self.assertTrue(self.db.add_suggestion('b', 'Second Bar', 2, 'two').added)
+
+        self.assertEqual(['First Bar', 'Second Bar'], [s.venue for s in self.db.get_current_suggestions()])
+        self.assertEqual('two', self.db.get_suggestion_by_uuid('b').user_handle)
+        self.assertIsNone(self.db.get_suggestion_by_uuid('c'))
+
+        self.db.remove_suggestion('a')
+        self.assertEqual(1, self.db.get_suggestion_count())
+        self.db.clear_suggestions()
+        self.assertEqual([], self.db.get_current_suggestions())
+
+    def test_duplicate_reports_existing(self):
+        self.db.add_suggestion('a', "Smuggler's Cove", 1, 'one')
+
+        result = self.db.add_suggestion('b', 'smugglers cove', 2, 'two')
+
+        self.assertFalse(result.added)
+        self.assertEqual('a', result.existing.uuid)
+        self.assertEqual(1, self.db.get_suggestion_count())
+
+    def test_full(self):
+        for i in range(MAX_SUGGESTIONS):
+            self.db.add_suggestion(str(i), f'Bar {chr(ord("a") + i)}', 1, 'one')
+
+        result = self.db.add_suggestion('x', 'One Too Many', 2, 'two')
+
+        self.assertFalse(result.added)
+        self.assertTrue(result.full)
+        self.assertEqual(MAX_SUGGESTIONS, self.db.get_suggestion_count())
+
+    def test_scheduled_venues_and_snapshot(self):
+        self.db.add_scheduled_venue('e', 'El Rio', '0 19 ? * WED#4 *', 240)
+        self.db.add_suggestion('a', 'First Bar', 1, 'one')
+        self.db.set_current_poll_id(3)
+
+        snapshot = self.db.get_snapshot()
+
+        self.assertEqual(3, snapshot.poll_id)
+        self.assertEqual(['First Bar'], [s.venue for s in snapshot.suggestions])
+        self.assertEqual(240, snapshot.scheduled_venues[0].duration_minutes)
+
+        self.db.remove_scheduled_venue('e')
+        self.assertEqual([], self.db.get_scheduled_venues())
+
+
+class TestSqliteBackendSelection(unittest.TestCase):
+    def test_selected_by_config(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'barbot.sqlite3')
+            shared = services.Services({'DATABASE_BACKEND': 'sqlite', 'SQLITE_PATH': path})
+            db = shared.db
+            self.assertIsInstance(db, SqliteDatabase)
+            self.assertEqual('wal', db.connection.execute('PRAGMA journal_mode').fetchone()[0])
+            db.close()
@@ -0,0 +1,152 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock
+
+from barbot import stats
+from barbot.database import Suggestion
+from barbot.sqlite_database import SqliteDatabase
+
+WEEK_1 = datetime.date(2024, 1, 4)
+WEEK_2 = datetime.date(2024, 1, 11)
+WEEK_3 = datetime.date(2024, 1, 18)
+
+
+def suggest(*user_ids: int):
+    return [Suggestion(f'{user_id}', f'Bar {user_id}', user_id, f'user{user_id}') for user_id in user_ids]
+
+
+class TestFold(unittest.TestCase):
+    def test_counts(self):
+        aggregates = stats.rebuild([
+            stats.suggestions_entry(WEEK_1, suggest(1, 2)),
+            stats.result_entry(WEEK_1, 'Bar 1', {'Bar 1': 3, 'Bar 2': 1}, poll_id=10),
+            stats.suggestions_entry(WEEK_2, suggest(1)),
+            stats.result_entry(WEEK_2, 'Bar 1', {}),
+        ])
+
+        self.assertEqual(2, aggregates['polls'])
+        self.assertEqual({'Bar 1': 2}, aggregates['wins'])
+        self.assertEqual({'Bar 1': 3, 'Bar 2': 1}, aggregates['votes'])
+        self.assertEqual({'1': 2, '2': 1}, aggregates['suggestions'])
+        self.assertEqual('user2', aggregates['handles']['2'])
+
+    def test_entry_applied_once(self):
+        entry = stats.result_entry(WEEK_1, 'Bar 1', {'Bar 1': 3}, poll_id=10)
+
+        aggregates = stats.fold(stats.fold(stats.new_aggregates(), entry), entry)
+
+        self.assertEqual(1, aggregates['polls'])
+        self.assertEqual({'Bar 1': 3}, aggregates['votes'])
+
+    def test_fold_does_not_modify_input(self):
+        aggregates = stats.new_aggregates()
+
+        stats.fold(aggregates, stats.suggestions_entry(WEEK_1, suggest(1)))
+
+        self.assertEqual(stats.new_aggregates(), aggregates)
+
+    def test_streaks(self):
+        aggregates = stats.rebuild([
+            stats.suggestions_entry(WEEK_1, suggest(1, 2)),
+            stats.suggestions_entry(WEEK_2, suggest(1, 2)),
+            stats.suggestions_entry(WEEK_3, suggest(1)),
+        ])
+
+        self.assertEqual({'1': 3}, aggregates['streaks'])
+        self.assertEqual({'1': 3, '2': 2}, aggregates['best_streaks'])
+
+
+class TestRecord(unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_totals_match_rebuilt_archive(self):
+        stats.record(self.db, stats.suggestions_entry(WEEK_1, suggest(1, 2)))
+        stats.record(self.db, stats.result_entry(WEEK_1, 'Bar 2', {'Bar 1': 1, 'Bar 2': 2}, poll_id=10))
+        stats.record(self.db, stats.result_entry(WEEK_1, 'Bar 2', {'Bar 1': 1, 'Bar 2': 2}, poll_id=10))
+
+        archive = self.db.get_stats_archive()
+        self.assertEqual(2, len(archive))
+        aggregates = self.db.get_stats()
+        self.assertEqual(2, aggregates['version'])
+        self.assertEqual({**stats.rebuild(archive), 'version': 2}, aggregates)
+
+    def test_save_rejected_if_version_changed(self):
+        entry = stats.suggestions_entry(WEEK_1, suggest(1))
+        stats.record(self.db, entry)
+
+        self.assertFalse(self.db.save_stats(entry, stats.new_aggregates(), 0))
+        self.assertEqual(1, len(self.db.get_stats_archive()))
+
+    def test_retries_on_conflict(self):
+        db = MagicMock()
+        db.get_stats.return_value = None
+        db.save_stats.side_effect = [False, True]
+
+        stats.record(db, stats.suggestions_entry(WEEK_1, suggest(1)))
+
+        self.assertEqual(2, db.save_stats.call_count)
+
+    def test_failures_not_raised(self):
+        db = MagicMock()
+        db.get_stats.side_effect = Exception('oops')
+
+        stats.record(db, stats.suggestions_entry(WEEK_1, suggest(1)))
+
+
+class TestRebuildTotals(unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_totals_replaced(self):
+        stats.record(self.db, stats.suggestions_entry(WEEK_1, suggest(1, 2)))
+        stats.record(self.db, stats.result_entry(WEEK_1, 'Bar 2', {'Bar 1': 1, 'Bar 2': 2}, poll_id=10))
+        wrong = {**stats.new_aggregates(), 'version': 2, 'polls': 5}
+        self.assertTrue(self.db.replace_stats(wrong, 2))
+
+        aggregates = stats.rebuild_totals(self.db)
+
+        self.assertEqual({**stats.rebuild(self.db.get_stats_archive()), 'version': 3}, aggregates)
+        self.assertEqual(aggregates, self.db.get_stats())
+        self.assertEqual(2, len(self.db.get_stats_archive()))
+
+    def test_replace_rejected_if_version_changed(self):
+        stats.record(self.db, stats.suggestions_entry(WEEK_1, suggest(1)))
+
+        self.assertFalse(self.db.replace_stats(stats.new_aggregates(), 0))
+        self.assertEqual(1, self.db.get_stats()['version'])
+
+    def test_retries_on_conflict(self):
+        db = MagicMock()
+        db.get_stats.side_effect = [{'version': 1}, {'version': 2}]
+        db.get_stats_archive.return_value = [stats.suggestions_entry(WEEK_1, suggest(1))]
+        db.replace_stats.side_effect = [False, True]
+
+        aggregates = stats.rebuild_totals(db)
+
+        self.assertEqual(3, aggregates['version'])
+        db.replace_stats.assert_called_with(aggregates, 2)
+
+
+class TestFormatStats(unittest.TestCase):
+    def test_nothing_recorded(self):
+        self.assertEqual('No bar nights have been recorded yet.', stats.format_stats(None, 1))
+
+    def test_format(self):
+        aggregates = stats.rebuild([
+            stats.suggestions_entry(WEEK_1, suggest(1, 2)),
+            stats.result_entry(WEEK_1, 'Bar 1', {'Bar 1': 3, 'Bar 2': 1}),
+        ])
+
+        text = stats.format_stats(aggregates, 2)
+
+        self.assertIn('Bar nights decided: 1', text)
+        self.assertIn('Bar 1: 1', text)
+        self.assertIn('@user1: 1', text)
+        self.assertIn('You have suggested 1 venues. Current streak: 1 weeks, best: 1 weeks.', text)
@@ -1,3 +1,4 @@
+import time
 import unittest
 from datetime import datetime
 from unittest.mock import AsyncMock, ANY, MagicMock
@@ -6,13 +7,18 @@ import telegram
 
 from barbot import webhook
 from barbot.app import AppSettings
-from barbot.bars import Bars
+from barbot.bars import Bar, BarCatalog, Bars
+from barbot.database import AddSuggestionResult, Suggestion
+from barbot.membership import MemoryMembershipStore
+from barbot.outbox import Outbox
+from barbot.webhook_response import WebhookResponse, to_api_params
 
 
 class MockServices(object):
     def __init__(self):
         db = MagicMock()
         db.return_value.get_current_poll_id.return_value = 1
+        db.return_value.add_suggestion.return_value = AddSuggestionResult(added=True)
         self.db = db
 
         bot = MagicMock()
@@ -55,3 +61,169 @@ class TestWebhookMessage(unittest.IsolatedAsyncioTestCase):
             reaction=telegram.ReactionTypeEmoji(emoji="✍"),
             is_big=ANY
         )
+
+
+    async def test_duplicate_reported_from_add_result(self):
+        mock_services = MockServices()
+        app_settings = AppSettings({})
+        bars = Bars(app_settings.BAR_SPREADSHEET)
+        db = mock_services.db()
+        db.add_suggestion.return_value = AddSuggestionResult(
+            added=False, existing=Suggestion('abc', 'Smuggler\'s Cove', 5, 'first')
+        )
+
+        await webhook.add_suggestion('smugglers cove', 0, 'second', 2, db, mock_services.bot(), app_settings, bars)
+
+        db.get_current_suggestions.assert_not_called()
+        mock_services.bot.return_value.send_message.assert_called_once_with(
+            chat_id=app_settings.MAIN_CHAT_ID,
+            text=ANY
+        )
+        self.assertIn('already suggested by first', mock_services.bot.return_value.send_message.call_args.kwargs['text'])
+
+    async def test_reaction_returned_in_webhook_response(self):
+        mock_services = MockServices()
+        app_settings = AppSettings({})
+        bars = Bars(app_settings.BAR_SPREADSHEET)
+        bot = mock_services.bot()
+
+        update = telegram.Update(
+            update_id=1,
+        )
+        message = telegram.Message(
+            message_id=2,
+            date=datetime.utcnow(),
+            text='Smuggler\'s Cove #barnight',
+            chat=telegram.Chat(
+                id=app_settings.MAIN_CHAT_ID,
+                type=telegram.constants.ChatType.GROUP
+            ),
+            from_user=telegram.User(id=0, first_name='Ceres', is_bot=False)
+        )
+
+        response = WebhookResponse(bot)
+        await webhook.handle_message(update, message, mock_services.db(), bot, app_settings, bars, response)
+
+        bot.set_message_reaction.assert_not_called()
+        self.assertEqual({
+            'method': 'setMessageReaction',
+            'chat_id': app_settings.MAIN_CHAT_ID,
+            'message_id': 2,
+            'reaction': [{'type': 'emoji', 'emoji': '✍'}],
+            'is_big': False,
+        }, response.take())
+
+
+class TestWebhookResponse(unittest.IsolatedAsyncioTestCase):
+    async def test_earlier_deferred_call_sent_first(self):
+        bot = MagicMock()
+        bot.send_message = AsyncMock()
+        response = WebhookResponse(bot)
+
+        await response.defer('send_message', chat_id=1, text='first')
+        bot.send_message.assert_not_called()
+        await response.defer('send_message', chat_id=2, text='second', reply_to_message_id=5)
+
+        bot.send_message.assert_called_once_with(chat_id=1, text='first')
+        self.assertEqual({
+            'method': 'sendMessage',
+            'chat_id': 2,
+            'text': 'second',
+            'reply_parameters': {'message_id': 5},
+        }, response.take())
+        self.assertIsNone(response.take())
+
+    async def test_not_deferrable_calls_right_away(self):
+        bot = MagicMock()
+        bot.send_message = AsyncMock()
+        response = WebhookResponse(bot, deferrable=False)
+
+        await response.defer('send_message', chat_id=1, text='hi')
+
+        bot.send_message.assert_called_once_with(chat_id=1, text='hi')
+        self.assertIsNone(response.take())
+
+    def test_api_params_drop_unset_values(self):
+        self.assertEqual(
+            {'method': 'deleteMessage', 'chat_id': 1, 'message_id': 2},
+            to_api_params('delete_message', {'chat_id': 1, 'message_id': 2, 'read_timeout': None}),
+        )
+
+    async def test_calls_to_other_chats_go_through_outbox(self):
+        bot = MagicMock()
+        bot.send_message = AsyncMock()
+        outbox = Outbox(bot, AppSettings({}))
+        response = WebhookResponse(bot, outbox=outbox)
+
+        await response.defer('send_message', chat_id=1, text='removed')
+        await response.defer('send_message', chat_id=2, text='announcement')
+        result = await response.finish()
+
+        bot.send_message.assert_called_once_with(chat_id=1, text='removed')
+        self.assertEqual({'method': 'sendMessage', 'chat_id': 2, 'text': 'announcement'}, result)
+
+
+class TestInlineQuery(unittest.IsolatedAsyncioTestCase):
+    async def test_offers_suggestions_and_bars(self):
+        mock_services = MockServices()
+        db = mock_services.db()
+        db.get_current_suggestions.return_value = [Suggestion('abc', 'Zeitgeist', 1, 'one')]
+        app_settings = AppSettings({'MAIN_CHAT_ID': '-100'})
+        members = MemoryMembershipStore(60)
+        members.put(-100, 2, telegram.ChatMember.MEMBER)
+        bars = Bars(app_settings.BAR_SPREADSHEET)
+        bars._catalog = BarCatalog([Bar('Zeitgeist', '', 0, 0, '', set()), Bar('Zam Zam', '', 0, 0, '', set())])
+        bars._checked_at = time.monotonic()
+        query = telegram.InlineQuery(
+            id='1', from_user=telegram.User(id=2, first_name='Ceres', is_bot=False), query='z', offset=''
+        )
+
+        result = await webhook.handle_inline_query(
+            telegram.Update(update_id=1), query, db, mock_services.bot(), app_settings, members, bars
+        )
+
+        self.assertEqual(
+            [('null', 'z'), ('abc', 'Zeitgeist'), ('bar0', 'Zam Zam')],
+            [(answer['id'], answer['title']) for answer in result['results']]
+        )
+
+
+class TestNear(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.mock_services = MockServices()
+        self.app_settings = AppSettings({'MAIN_CHAT_ID': '-100'})
+        self.members = MemoryMembershipStore(60)
+        self.members.put(-100, 2, telegram.ChatMember.MEMBER)
+        self.bars = Bars(self.app_settings.BAR_SPREADSHEET)
+        self.bars._catalog = BarCatalog([
+            Bar('Trick Dog', '3010 20th St', 37.75921458, -122.4111932, '', set()),
+            Bar('Zeitgeist', '199 Valencia St', 37.77002787, -122.4221187, '', set()),
+        ])
+        self.bars._checked_at = time.monotonic()
+
+    async def send(self, **kwargs) -> str:
+        message = telegram.Message(
+            message_id=2,
+            date=datetime.utcnow(),
+            chat=telegram.Chat(id=2, type=telegram.constants.ChatType.PRIVATE),
+            from_user=telegram.User(id=2, first_name='Ceres', is_bot=False),
+            **kwargs
+        )
+        bot = self.mock_services.bot()
+        await webhook.handle_message(
+            telegram.Update(update_id=1), message, self.mock_services.db(), bot, self.app_settings, self.bars,
+            members=self.members
+        )
+        return bot.send_message.call_args.kwargs['text']
+
+    async def test_shared_location(self):
+        text = await self.send(location=telegram.Location(latitude=37.7700, longitude=-122.4220))
+
+        self.assertEqual(
+            'The closest bars to you:\n\nZeitgeist (10 m, 199 Valencia St)\nTrick Dog (1.5 km, 3010 20th St)', text
+        )
+
+    async def test_near_bar(self):
+        text = await self.send(text='/near trick dog')
+
+        self.assertEqual('The closest bars to Trick Dog:\n\nZeitgeist (1.5 km, 199 Valencia St)', text)
@@ -2,17 +2,29 @@ from typing import List, Tuple
 
 from barbot.app import AppSettings
 from barbot.database import Suggestion
-from barbot.bars import Bars
-from barbot import geo
+from barbot.bars import Bar, Bars
 
 
 def get_list_suggestions_message_text(suggestions: List[Suggestion]) -> str:
     return '\n'.join(f'{s.venue} (Suggested by @{s.user_handle})' for s in suggestions)
 
 
+def format_distance(meters: float) -> str:
+    if meters < 1000:
+        return f'{round(meters, -1):.0f} m'
+    return f'{meters / 1000:.1f} km'
+
+
+def get_near_message_text(nearby: List[Tuple[Bar, float]]) -> str:
+    return '\n'.join(f'{bar.name} ({format_distance(meters)}, {bar.address})' for bar, meters in nearby)
+
+
 async def get_map_suggestions_message_data(bars: Bars, suggestions: List[Suggestion], app: AppSettings) -> Tuple[bytes, str]:
     """Get the map photo and (MarkdownV2) text for some suggestions"""
+    from barbot import geo
+
     names = [s.venue for s in suggestions]
+    await bars.ensure_loaded()
     unrecognised_names, barlist = bars.match_bars(names)
     letter_map, png = await geo.map_bars_to_png(barlist, (720, 720), app)
     if not png:
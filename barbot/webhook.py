@@ -1,6 +1,4 @@
-import difflib
 import json
-import os
 import re
 import sys
 import traceback
@@ -10,10 +8,15 @@ from typing import Dict, Any, Optional
 
 import telegram
 
-from . import database, util
-from .app import AppSettings, MIN_VENUE_LENGTH, MAX_VENUE_LENGTH, BARNIGHT_HASHTAG, MAX_SUGGESTIONS, asyncio_loop
+from . import database, stats, util
+from .app import AppSettings, MIN_VENUE_LENGTH, MAX_VENUE_LENGTH, BARNIGHT_HASHTAG, MAX_SUGGESTIONS, asyncio_loop, \
+    MAX_INLINE_BAR_RESULTS, NEAR_RESULTS
+from .autocomplete import NameIndex
 from .bars import Bars
-from .database import Database
+from .database import Database, normalize_venue
+from .membership import MembershipStore
+from .services import Services, get_services
+from .webhook_response import WebhookResponse
 
 
 def error(message: str):
@@ -26,6 +29,7 @@ def handle_webhook(event: Dict[str, Any], context: Dict[str, Any]) -> Dict[str,
     body_json = event['body']
     body = json.loads(body_json)
     result = asyncio_loop.run_until_complete(handle_webhook_async(body))
+    get_services().log_stats()
 
     if result:
         return result
@@ -34,45 +38,93 @@ def handle_webhook(event: Dict[str, Any], context: Dict[str, Any]) -> Dict[str,
 
 
 async def handle_webhook_async(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    print(f'Received webhook! {body}')
+    services = get_services()
+
+    # Telegram re-delivers updates when we're slow to respond. Drop those before doing any work.
+    update_id = body.get('update_id')
+    if isinstance(update_id, int) and not services.ledger.claim(update_id):
+        print(f'Skipping update {update_id}, which has already been handled')
+        return None
 
-    app_settings = AppSettings(os.environ)
+    try:
+        return await handle_update(body, services)
+    except:
+        if isinstance(update_id, int):
+            services.ledger.release(update_id)
+        raise
 
-    assert app_settings.TELEGRAM_BOT_TOKEN is not None
-    bot = telegram.Bot(
-        token=app_settings.TELEGRAM_BOT_TOKEN
-    )
 
-    db = database.DynamoDatabase(app_settings)
+async def handle_update(body: Dict[str, Any], services: Services) -> Optional[Dict[str, Any]]:
+    print(f'Received webhook! {body}')
 
-    bars = Bars(app_settings.BAR_SPREADSHEET)
+    await services.prepare()
+    bot = services.bot
 
     update = telegram.Update.de_json(body, bot)
     if not update:
         error('Failed to parse Update body')
         return None
 
+    # Group messages belong to their own chat. Private messages and inline queries are about the chat their sender is
+    # in, as far as we know (see Services.chat_for_user).
+    chat_id = None
+    member_update = update.chat_member or update.my_chat_member
+    if member_update is not None:
+        chat_id = member_update.chat.id
+    elif update.message is not None and update.message.chat.type != telegram.Chat.PRIVATE:
+        chat_id = update.message.chat.id
+    user = update.inline_query.from_user if update.inline_query is not None else None
+    if update.message is not None and update.message.chat.type == telegram.Chat.PRIVATE:
+        user = update.message.from_user
+    chat = services.chat_for_user(user.id) if user is not None else services.chat(chat_id)
+    if chat is None:
+        print(f'Ignoring update from chat {chat_id}, which the bot is not set up for')
+        return None
+
+    if member_update is not None:
+        record_membership(member_update, services.members)
+        return None
+    app_settings = chat.app
+    db = services.instrument(chat.db)
+    db.begin_invocation()
+    bars = chat.bars
+
     if update.inline_query is not None:
-        return await handle_inline_query(update, update.inline_query, db, bot, app_settings)
+        return await handle_inline_query(update, update.inline_query, db, bot, app_settings, services.members, bars)
 
     if update.message is not None:
-        await handle_message(update, update.message, db, bot, app_settings, bars)
-        return None
+        response = WebhookResponse(bot, outbox=services.outbox)
+        await handle_message(update, update.message, db, bot, app_settings, bars, response, services.members)
+        return await response.finish()
 
     return None
 
 
-async def handle_inline_query(udpate: telegram.Update, query: telegram.InlineQuery, db: Database, bot: telegram.Bot, app: AppSettings) -> Optional[Dict[str, Any]]:
+def record_membership(member_update: telegram.ChatMemberUpdated, members: MembershipStore) -> None:
+    member = member_update.new_chat_member
+    status = member.status
+    # Restricted users can have left the chat, in which case they're no more a member than anyone else who left.
+    if isinstance(member, telegram.ChatMemberRestricted) and not member.is_member:
+        status = telegram.ChatMember.LEFT
+    print(f'User {member.user.id} is now {status} in chat {member_update.chat.id}')
+    members.put(member_update.chat.id, member.user.id, status, member_update.date.timestamp())
+
+
+async def handle_inline_query(udpate: telegram.Update, query: telegram.InlineQuery, db: Database, bot: telegram.Bot, app: AppSettings, members: Optional[MembershipStore] = None, bars: Optional[Bars] = None) -> Optional[Dict[str, Any]]:
     # Make sure the user is part of the chatroom
-    is_member = await database.is_user_part_of_main_chat(bot, app, user_id=query.from_user.id)
+    is_member = await database.is_user_part_of_main_chat(bot, app, user_id=query.from_user.id, members=members)
 
     query_text = query.query
     answers = []
     if query_text and is_member:
         current_suggestions = db.get_current_suggestions()
-        possibilities = [x.venue for x in current_suggestions]
         suggestions_by_name = {s.venue: s for s in current_suggestions}
-        matches = difflib.get_close_matches(query_text, possibilities, n=5, cutoff=0.1)
+        matches = NameIndex((s.venue, [s.venue]) for s in current_suggestions).search(query_text, limit=5)
+        # Bars from the list that haven't been suggested yet. Never waits for the list, every keystroke is a query.
+        catalog = bars.get_catalog() if bars is not None else None
+        bar_matches = catalog.search_index.search(query_text, limit=MAX_INLINE_BAR_RESULTS) if catalog else []
+        suggested_keys = {normalize_venue(s.venue) for s in current_suggestions}
+        bar_matches = [name for name in bar_matches if normalize_venue(name) not in suggested_keys]
 
         def make_result(hex_uuid: str, match_name: str) -> Dict[str, Any]:
             return {
@@ -84,9 +136,11 @@ async def handle_inline_query(udpate: telegram.Update, query: telegram.InlineQue
                 }
             }
 
-        if query_text not in suggestions_by_name:
+        if query_text not in suggestions_by_name and query_text not in bar_matches:
             answers.append(make_result('null', query_text))
         answers.extend(make_result(suggestions_by_name[x].uuid, x) for x in matches)
+        # Result ids only have to be unique within the answer.
+        answers.extend(make_result(f'bar{i}', name) for i, name in enumerate(bar_matches))
 
     print(f'returning {len(answers)} answers')
 
@@ -99,76 +153,115 @@ async def handle_inline_query(udpate: telegram.Update, query: telegram.InlineQue
     }
 
 
-async def add_suggestion(venue: str, user_id: int, username: str, message_id: int, db: Database, bot: telegram.Bot, app: AppSettings, bars: Bars) -> None:
+async def add_suggestion(venue: str, user_id: int, username: str, message_id: int, db: Database, bot: telegram.Bot, app: AppSettings, bars: Bars, response: Optional[WebhookResponse] = None) -> None:
+    if response is None:
+        response = WebhookResponse(bot, deferrable=False)
+
     venue = re.sub(r'\s+', ' ', venue).strip().lower().capitalize()
     venue = re.sub(r'\s\S', lambda m: m.group(0).title(), venue)
 
     if len(venue) < MIN_VENUE_LENGTH:
         return
     if len(venue) > MAX_VENUE_LENGTH:
-        await bot.send_message(
-            app.MAIN_CHAT_ID,
-            f'Sorry @{username}, venue suggestions must be between {MIN_VENUE_LENGTH} and {MAX_VENUE_LENGTH} '
+        await response.defer(
+            'send_message',
+            chat_id=app.MAIN_CHAT_ID,
+            text=f'Sorry @{username}, venue suggestions must be between {MIN_VENUE_LENGTH} and {MAX_VENUE_LENGTH} '
             f'characters long.'
         )
         return
 
     # try to use the canonical name of the bar (if we can find one)
-    bar = bars.match_bar(venue)
+    bar = (await bars.ensure_loaded()).match_bar(venue)
     venue = bar.name if bar else venue
 
-    suggestions = db.get_current_suggestions(bypass_cache=True)
-
-    found_suggestion: Optional[database.Suggestion] = None
-
-    normalized_venue = [c.lower() for c in venue if c.isalpha()]
-
-    for suggestion in suggestions:
-        normalized_suggestion_venue = [c.lower() for c in suggestion.venue if c.isalpha()]
-        if normalized_venue == normalized_suggestion_venue:
-            found_suggestion = suggestion
-            break
+    # Checking for duplicates, checking the limit and adding the suggestion all happen in the one write.
+    venue_uuid = uuid.uuid4().hex
+    try:
+        result = db.add_suggestion(venue_uuid, venue, user_id, username)
+    except:
+        traceback.print_exc()
+        await response.defer(
+            'send_message',
+            chat_id=app.MAIN_CHAT_ID,
+            text=f'Sorry @{username}, I was unable to add your suggestion for "{venue}". Please try again.'
+        )
+        return
 
-    if found_suggestion is not None:
-        await bot.send_message(
+    if result.existing is not None:
+        await response.defer(
+            'send_message',
             chat_id=app.MAIN_CHAT_ID,
             text=f'@{username} has suggested "{venue}" for {BARNIGHT_HASHTAG}, '
-                 f'which was already suggested by {found_suggestion.user_handle}'
+                 f'which was already suggested by {result.existing.user_handle}'
+        )
+    elif result.full:
+        await response.defer(
+            'send_message',
+            chat_id=app.MAIN_CHAT_ID,
+            text=f'Sorry, I could not add @{username}\'s suggestion for "{venue}" since we have hit the max number '
+                 f'of suggestions for the next poll ({MAX_SUGGESTIONS}).'
         )
     else:
-        if len(suggestions) >= MAX_SUGGESTIONS:
-            await bot.send_message(
-                chat_id=app.MAIN_CHAT_ID,
-                text=f'Sorry, I could not add @{username}\'s suggestion for "{venue}" since we have hit the max number '
-                     f'of suggestions for the next poll ({MAX_SUGGESTIONS}).'
-            )
-        else:
-            venue_uuid = uuid.uuid4().hex
-            try:
-                db.add_suggestion(venue_uuid, venue, user_id, username)
-            except:
-                traceback.print_exc()
-                await bot.send_message(
-                    app.MAIN_CHAT_ID,
-                    f'Sorry @{username}, I was unable to add your suggestion for "{venue}". Please try again.'
-                )
-                return
-
-            venue_markdown = util.escape_markdown_v2(venue)
-            if bar:
-                link = f'https://www.google.com/maps/search/?api=1&query={urllib.parse.quote_plus(venue + ", " + bar.address)}'
-                venue_markdown = f'[{venue_markdown}]({link})'
-
-            # Send message to the main chat to let people know that a suggestion was added.
-            await bot.set_message_reaction(
-                chat_id=app.MAIN_CHAT_ID,
-                message_id=message_id,
-                reaction=telegram.ReactionTypeEmoji(emoji='✍'),
-                is_big=False
-            )
+        venue_markdown = util.escape_markdown_v2(venue)
+        if bar:
+            link = f'https://www.google.com/maps/search/?api=1&query={urllib.parse.quote_plus(venue + ", " + bar.address)}'
+            venue_markdown = f'[{venue_markdown}]({link})'
+
+        # Send message to the main chat to let people know that a suggestion was added.
+        await response.defer(
+            'set_message_reaction',
+            chat_id=app.MAIN_CHAT_ID,
+            message_id=message_id,
+            reaction=telegram.ReactionTypeEmoji(emoji='✍'),
+            is_big=False
+        )
+
+
+async def send_nearby_bars(message: telegram.Message, bot: telegram.Bot, app: AppSettings, bars: Bars, response: WebhookResponse, members: Optional[MembershipStore], bar_name: str = '') -> None:
+    assert message.from_user is not None
+    if not await database.is_user_part_of_main_chat(bot, app, message.from_user.id, members):
+        await response.defer(
+            'send_message',
+            chat_id=message.chat.id,
+            text='You must be a member of the main chatroom to look for bars.'
+        )
+        return
+
+    catalog = await bars.ensure_loaded()
+    if message.location is not None:
+        latitude, longitude = message.location.latitude, message.location.longitude
+        near_bar = None
+        message_text = 'The closest bars to you:\n\n'
+    elif bar_name:
+        near_bar = catalog.match_bar(bar_name)
+        if near_bar is None:
+            await response.defer('send_message', chat_id=message.chat.id, text=f'Sorry, I don\'t know where "{bar_name}" is.')
+            return
+        latitude, longitude = near_bar.latitude, near_bar.longitude
+        message_text = f'The closest bars to {near_bar.name}:\n\n'
+    else:
+        await response.defer(
+            'send_message',
+            chat_id=message.chat.id,
+            text='Send me a location, or use /near <bar name>, and I\'ll list the closest bars.'
+        )
+        return
+
+    nearby = catalog.spatial_index.nearest(latitude, longitude, NEAR_RESULTS + 1)
+    nearby = [(bar, meters) for bar, meters in nearby if bar is not near_bar][:NEAR_RESULTS]
+    if not nearby:
+        await response.defer('send_message', chat_id=message.chat.id, text='Sorry, I don\'t know of any bars yet.')
+        return
+    message_text += util.get_near_message_text(nearby)
+    await response.defer('send_message', chat_id=message.chat.id, text=message_text)
+
 
+async def handle_message(update: telegram.Update, message: telegram.Message, db: Database, bot: telegram.Bot, app: AppSettings, bars: Bars, response: Optional[WebhookResponse] = None, members: Optional[MembershipStore] = None) -> None:
+    # The last call we make can be returned in the webhook response. Without one, just make every call right away.
+    if response is None:
+        response = WebhookResponse(bot, deferrable=False)
 
-async def handle_message(update: telegram.Update, message: telegram.Message, db: Database, bot: telegram.Bot, app: AppSettings, bars: Bars) -> None:
     # Can't do anything if we don't know who sent this message.
     if message.from_user is None:
         return
@@ -177,11 +270,16 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
     if message.from_user.is_bot:
         return
 
+    # A location sent to the bot is a /near for wherever it is.
+    if message.location is not None and message.chat.type == telegram.Chat.PRIVATE:
+        await send_nearby_bars(message, bot, app, bars, response, members)
+        return
+
     # Only accept messages with text.
     if not message.text:
         return
 
-    is_admin = await database.is_user_admin_of_main_chat(bot, app, message.from_user.id)
+    is_admin = await database.is_user_admin_of_main_chat(bot, app, message.from_user.id, members)
 
     message_lower = message.text.lower()
 
@@ -190,14 +288,15 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
             message_text = f'Hello there! You can use me to suggest venues for bar night!\n\n' \
                     f'To suggest a venue, send a message to the main chatroom with the hashtag #barnight. ' \
                     f'You can also use @{app.BOT_USERNAME} in your message to suggest a venue.'
-            await bot.send_message(message.chat.id, message_text)
+            await response.defer('send_message', chat_id=message.chat.id, text=message_text)
 
         elif message_lower.startswith('/delete ') or message_lower == '/delete':
             venue_name = message.text[len('/delete '):].strip()
             if not venue_name:
-                await bot.send_message(
-                    message.chat.id,
-                    'Usage: /delete <venue_name>'
+                await response.defer(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text='Usage: /delete <venue_name>'
                 )
             else:
                 suggestions = db.get_current_suggestions(bypass_cache=False)
@@ -207,49 +306,70 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
                         try:
                             db.remove_suggestion(suggestion.uuid)
                         except:
-                            await bot.send_message(
-                                message.chat.id,
-                                f'Was unable to remove suggestion "{venue_name}" :('
+                            await response.defer(
+                                'send_message',
+                                chat_id=message.chat.id,
+                                text=f'Was unable to remove suggestion "{venue_name}" :('
                             )
                             traceback.print_exc()
                             return
-                        await bot.send_message(
-                            message.chat.id,
-                            f'Successfully removed "{venue_name}" from suggestions.'
+                        await response.defer(
+                            'send_message',
+                            chat_id=message.chat.id,
+                            text=f'Successfully removed "{venue_name}" from suggestions.'
                         )
-                        await bot.send_message(
-                            app.MAIN_CHAT_ID,
-                            f'@{message.from_user.username} has removed @{suggestion.user_handle}\'s suggestion for '
+                        await response.defer(
+                            'send_message',
+                            chat_id=app.MAIN_CHAT_ID,
+                            text=f'@{message.from_user.username} has removed @{suggestion.user_handle}\'s suggestion for '
                             f'"{suggestion.venue}"'
                         )
                     else:
-                        await bot.send_message(
-                            message.chat.id,
-                            'Sorry, you can only delete venues that you suggested. '
+                        await response.defer(
+                            'send_message',
+                            chat_id=message.chat.id,
+                            text='Sorry, you can only delete venues that you suggested. '
                             '(Only admins can delete any suggestion)'
                         )
                 else:
-                    await bot.send_message(
-                        message.chat.id,
-                        f'Could not find suggestion "{venue_name}" to remove.'
+                    await response.defer(
+                        'send_message',
+                        chat_id=message.chat.id,
+                        text=f'Could not find suggestion "{venue_name}" to remove.'
                     )
 
         elif message_lower.startswith('/list') or message_lower == '/list':
-            if await database.is_user_part_of_main_chat(bot, app, message.from_user.id):
+            if await database.is_user_part_of_main_chat(bot, app, message.from_user.id, members):
                 suggestions = db.get_current_suggestions()
                 message_text = 'Current suggested venues:\n\n'
                 message_text += util.get_list_suggestions_message_text(suggestions)
-                await bot.send_message(message.chat.id, message_text)
+                await response.defer('send_message', chat_id=message.chat.id, text=message_text)
             else:
-                await bot.send_message(
-                    message.chat.id,
-                    'You must be a member of the main chatroom to list suggestions.'
+                await response.defer(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text='You must be a member of the main chatroom to list suggestions.'
                 )
 
+        elif message_lower.startswith('/stats'):
+            if await database.is_user_part_of_main_chat(bot, app, message.from_user.id, members):
+                message_text = stats.format_stats(db.get_stats(), message.from_user.id)
+                await response.defer('send_message', chat_id=message.chat.id, text=message_text)
+            else:
+                await response.defer(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text='You must be a member of the main chatroom to see bar night stats.'
+                )
+
+        elif message_lower.startswith('/near'):
+            await send_nearby_bars(message, bot, app, bars, response, members, message.text[len('/near'):].strip())
+
         elif message_lower.startswith('/map'):
-            temp_message = await bot.send_message(
-                message.chat.id,
-                'One sec, let me get you a map of the current suggestions...',
+            temp_message = await response.call(
+                'send_message',
+                chat_id=message.chat.id,
+                text='One sec, let me get you a map of the current suggestions...',
                 reply_to_message_id=message.id,
             )
             try:
@@ -258,36 +378,40 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
                 )
             except Exception as err:
                 print(f'Map rendering failed: {err}')
-                await bot.send_message(
-                    message.chat.id,
-                    "Sorry: We're having some trouble generate maps right now.",
+                await response.defer(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text="Sorry: We're having some trouble generate maps right now.",
                     reply_to_message_id=message.id,
                 )
             else:
                 if png:
-                    await bot.send_photo(
-                        message.chat.id,
-                        png,
-                        message_text,
+                    await response.call(
+                        'send_photo',
+                        chat_id=message.chat.id,
+                        photo=png,
+                        caption=message_text,
                         parse_mode='MarkdownV2',
                         reply_to_message_id=message.id,
                     )
                 else:
-                    await bot.send_message(
-                        message.chat.id,
-                        "There aren't any suggested bars that we can map.",
+                    await response.defer(
+                        'send_message',
+                        chat_id=message.chat.id,
+                        text="There aren't any suggested bars that we can map.",
                         reply_to_message_id=message.id,
                     )
             finally:
+                # Nothing needs to wait for the temporary message to go away, so let telegram delete it after we respond.
                 try:
-                    await bot.delete_message(message.chat.id, temp_message.message_id)
+                    await response.defer('delete_message', chat_id=message.chat.id, message_id=temp_message.message_id)
                 except:
                     pass
 
         elif message_lower.startswith('/newevent'):
             json_body = message.text[len('/newevent '):].strip()
             if not is_admin:
-                await bot.send_message(message.chat.id, 'You must be an admin to use this command.')
+                await response.defer('send_message', chat_id=message.chat.id, text='You must be an admin to use this command.')
             elif not json_body:
                 message_text = \
                     'Usage: /newevent \\<json\\>\n\n' \
@@ -299,7 +423,7 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
                     '    "duration_minutes": 240\n' \
                     '}\n' \
                     '```'
-                await bot.send_message(message.chat.id, message_text, parse_mode='MarkdownV2')
+                await response.defer('send_message', chat_id=message.chat.id, text=message_text, parse_mode='MarkdownV2')
             else:
                 try:
                     data = json.loads(json_body)
@@ -307,17 +431,17 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
                     db.add_scheduled_venue(event_uuid, str(data['venue_name']), str(data['cron']), int(data['duration_minutes']))
                 except:
                     traceback.print_exc()
-                    await bot.send_message(message.chat.id, 'Sorry, I had trouble parsing that json.')
+                    await response.defer('send_message', chat_id=message.chat.id, text='Sorry, I had trouble parsing that json.')
                     return
 
-                await bot.send_message(message.chat.id, 'Event created!')
+                await response.defer('send_message', chat_id=message.chat.id, text='Event created!')
 
         elif message_lower.startswith('/delevent'):
             event_name = message.text[len('/delevent '):].strip()
             if not is_admin:
-                await bot.send_message(message.chat.id, 'You must be an admin to use this command.')
+                await response.defer('send_message', chat_id=message.chat.id, text='You must be an admin to use this command.')
             elif not event_name:
-                await bot.send_message(message.chat.id, 'Usage: /newevent <scheduled event name>')
+                await response.defer('send_message', chat_id=message.chat.id, text='Usage: /newevent <scheduled event name>')
             else:
                 events = db.get_scheduled_venues()
                 event = next((e for e in events if e.venue_name.lower() == event_name.lower()), None)
@@ -327,18 +451,19 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
                         db.remove_scheduled_venue(event.uuid)
                     except:
                         traceback.print_exc()
-                        await bot.send_message(message.chat.id,f'Sorry, I had trouble deleting the scheduled event.')
+                        await response.defer('send_message', chat_id=message.chat.id, text=f'Sorry, I had trouble deleting the scheduled event.')
                         return
 
-                    await bot.send_message(message.chat.id, f'Deleted scheduled event "{event_name}".')
+                    await response.defer('send_message', chat_id=message.chat.id, text=f'Deleted scheduled event "{event_name}".')
 
                 else:
-                    await bot.send_message(message.chat.id,f'Could not find scheduled event "{event_name}" to remove.')
+                    await response.defer('send_message', chat_id=message.chat.id, text=f'Could not find scheduled event "{event_name}" to remove.')
 
         elif BARNIGHT_HASHTAG in message_lower:
-            await bot.send_message(
-                message.chat.id,
-                f'Please send venue suggestions in the main chatroom.',
+            await response.defer(
+                'send_message',
+                chat_id=message.chat.id,
+                text=f'Please send venue suggestions in the main chatroom.',
                 reply_to_message_id=message.id,
             )
 
@@ -352,4 +477,4 @@ async def handle_message(update: telegram.Update, message: telegram.Message, db:
                 pass
             else:
                 suggestion_text = left_of_hashtag if len(left_of_hashtag) > len(right_of_hashtag) else right_of_hashtag
-                await add_suggestion(suggestion_text, message.from_user.id, message.from_user.username or 'unknown', message.id, db, bot, app, bars)
+                await add_suggestion(suggestion_text, message.from_user.id, message.from_user.username or 'unknown', message.id, db, bot, app, bars, response)
@@ -0,0 +1,107 @@
+"""
+Telegram lets a webhook answer an update by putting one Bot API call in its HTTP response body, which saves us a round
+trip to api.telegram.org. https://core.telegram.org/bots/api#making-requests-when-getting-updates
+"""
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import telegram
+
+from .outbox import Outbox
+
+
+def _to_camel_case(name: str) -> str:
+    first, *rest = name.split('_')
+    return first + ''.join(part.title() for part in rest)
+
+
+def _to_api_value(value: Any) -> Any:
+    if isinstance(value, telegram.TelegramObject):
+        return value.to_dict()
+    if isinstance(value, (list, tuple)):
+        return [_to_api_value(v) for v in value]
+    return value
+
+
+def to_api_params(method: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert keyword arguments for a `telegram.Bot` method into the parameters the Bot API itself expects."""
+    params: Dict[str, Any] = {}
+    for key, value in kwargs.items():
+        if value is None:
+            continue
+        # python-telegram-bot still accepts a few parameters that the Bot API has replaced.
+        if key == 'reply_to_message_id':
+            params['reply_parameters'] = {'message_id': value}
+        elif key == 'disable_web_page_preview':
+            params['link_preview_options'] = {'is_disabled': value}
+        elif key == 'reaction' and not isinstance(value, (list, tuple)):
+            params['reaction'] = [_to_api_value(telegram.ReactionTypeEmoji(value) if isinstance(value, str) else value)]
+        else:
+            params[key] = _to_api_value(value)
+    return {'method': _to_camel_case(method), **params}
+
+
+class WebhookResponse(object):
+    """Holds the (at most one) Bot API call that will be made by returning it in the webhook response.
+
+    Telegram only sees the response once the handler has finished, so a deferred call always happens after every call
+    the handler makes itself. To keep calls in the order the handler made them, deferring a call sends the previously
+    deferred one right away, and calls that happen after a deferred one should go through `call()`.
+
+    Only calls whose result we don't need can be deferred, and Telegram never tells us whether they succeeded.
+
+    Calls that aren't deferred go through the outbox if there is one, which keeps calls to the same chat in order while
+    letting calls to different chats go out concurrently.
+    """
+    def __init__(self, bot: telegram.Bot, deferrable: bool = True, outbox: Optional[Outbox] = None):
+        self.bot = bot
+        self.deferrable = deferrable
+        self.outbox = outbox
+        self.pending: Optional[Tuple[str, Dict[str, Any]]] = None
+        # Deferred calls that were pushed out of the way by a later one and handed to the outbox.
+        self.queued: List[asyncio.Task[Any]] = []
+
+    async def call(self, method: str, **kwargs: Any) -> Any:
+        """Make a call right away, after the pending deferred call (if any)."""
+        await self.flush()
+        return await self._send(method, kwargs)
+
+    async def _send(self, method: str, kwargs: Dict[str, Any]) -> Any:
+        if self.outbox is not None:
+            return await self.outbox.call(method, **kwargs)
+        return await getattr(self.bot, method)(**kwargs)
+
+    async def defer(self, method: str, **kwargs: Any) -> None:
+        if not self.deferrable:
+            await self.call(method, **kwargs)
+            return
+        await self.flush()
+        self.pending = (method, kwargs)
+
+    async def flush(self) -> None:
+        """Send the pending deferred call. With an outbox this only queues it; see `finish()`."""
+        if self.pending is None:
+            return
+        method, kwargs = self.pending
+        self.pending = None
+        if self.outbox is not None:
+            self.queued.append(self.outbox.send(method, **kwargs))
+        else:
+            await getattr(self.bot, method)(**kwargs)
+
+    async def finish(self) -> Optional[Dict[str, Any]]:
+        """Wait for every call queued so far to be sent, then get the body for the webhook response."""
+        results = await asyncio.gather(*self.queued, return_exceptions=True)
+        self.queued.clear()
+        for result in results:
+            if isinstance(result, Exception):
+                print(f'Bot API call failed: {result!r}')
+        return self.take()
+
+    def take(self) -> Optional[Dict[str, Any]]:
+        """Get the body for the webhook response, if there's a deferred call."""
+        if self.pending is None:
+            return None
+        method, kwargs = self.pending
+        self.pending = None
+        return to_api_params(method, kwargs)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Measures how long it takes to import the lambda entry points, and keeps the webhook's cold start honest.
+
+    ./import-report.py            # print the report
+    ./import-report.py --write    # update import-report.txt
+    ./import-report.py --check    # exit non-zero if the webhook import budget has regressed
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+os.chdir(os.path.normpath(os.path.join(__file__, '..')))
+
+REPORT_PATH = 'import-report.txt'
+ENTRY_MODULE = 'barbot.webhook'
+
+# Total cumulative import time allowed for ENTRY_MODULE. This is measured on a CI runner, which is a lot faster than a
+# 128MB lambda, so treat it as a tripwire rather than an accurate cold start number.
+WEBHOOK_IMPORT_BUDGET_MS = 500
+
+# Modules that are only needed to render maps. If any of these are loaded by just importing the webhook, every cold
+# start pays for them.
+FORBIDDEN_MODULES = ['folium', 'branca', 'jinja2', 'numpy', 'selenium']
+
+# Modules cheaper than this are left out of the report to keep it readable.
+REPORT_THRESHOLD_US = 1000
+
+importtime_regex = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+
+
+def measure(module: str) -> Dict[str, Tuple[int, int]]:
+    """Returns {module: (cumulative_us, depth)} for one fresh interpreter importing `module`"""
+    p = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if p.returncode != 0:
+        sys.stderr.write(p.stderr)
+        sys.exit(p.returncode)
+    results = {}
+    for line in p.stderr.splitlines():
+        match = importtime_regex.match(line)
+        if not match:
+            continue
+        # importtime indents nested imports by two spaces per level.
+        depth = (len(match.group(3)) - 1) // 2
+        results[match.group(4)] = (int(match.group(2)), depth)
+    return results
+
+
+def measure_best_of(module: str, runs: int) -> Dict[str, Tuple[int, int]]:
+    best: Dict[str, Tuple[int, int]] = {}
+    for _ in range(runs):
+        for name, (cumulative, depth) in measure(module).items():
+            if name not in best or cumulative < best[name][0]:
+                best[name] = (cumulative, depth)
+    return best
+
+
+def make_report(results: Dict[str, Tuple[int, int]]) -> str:
+    total_us = results[ENTRY_MODULE][0]
+    lines: List[str] = [
+        f'# Generated by ./import-report.py --write. Cumulative import cost of `{ENTRY_MODULE}`.',
+        f'budget_ms: {WEBHOOK_IMPORT_BUDGET_MS}',
+        f'total_ms: {total_us / 1000:.1f}',
+        '',
+        f'{"cumulative_ms":>14}  module',
+    ]
+    ranked = sorted(results.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (cumulative, depth) in ranked:
+        if cumulative < REPORT_THRESHOLD_US:
+            continue
+        lines.append(f'{cumulative / 1000:>14.1f}  {"  " * depth}{name}')
+    return '\n'.join(lines) + '\n'
+
+
+def check(results: Dict[str, Tuple[int, int]]) -> List[str]:
+    problems = []
+    loaded = set(name.split('.')[0] for name in results)
+    for module in FORBIDDEN_MODULES:
+        if module in loaded:
+            problems.append(f'`{module}` is imported by `{ENTRY_MODULE}`. Import it lazily where it is used.')
+    total_ms = results[ENTRY_MODULE][0] / 1000
+    if total_ms > WEBHOOK_IMPORT_BUDGET_MS:
+        problems.append(f'Importing `{ENTRY_MODULE}` took {total_ms:.1f}ms, '
+                        f'which is over the budget of {WEBHOOK_IMPORT_BUDGET_MS}ms.')
+    return problems
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--write', action='store_true', help=f'Write the report to {REPORT_PATH}')
+parser.add_argument('--check', action='store_true', help='Fail if the import budget has regressed')
+parser.add_argument('--runs', type=int, default=5, help='Take the best of this many measurements')
+
+
+def main():
+    args = parser.parse_args()
+    results = measure_best_of(ENTRY_MODULE, args.runs)
+    report = make_report(results)
+
+    if args.write:
+        with open(REPORT_PATH, 'w') as handle:
+            handle.write(report)
+    else:
+        print(report, end='')
+
+    if args.check:
+        problems = check(results)
+        for problem in problems:
+            print(f'ERROR: {problem}', file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Rebuilds a chat's stats totals from its stats archive, replacing whatever totals it has now.
+
+Reads the same environment variables as the lambdas (table names, DATABASE_BACKEND and so on), and AWS credentials
+from the usual places.
+
+    ./rebuild-stats.py              # the default chat, MAIN_CHAT_ID
+    ./rebuild-stats.py -100123456   # another chat from the chats table
+"""
+import argparse
+import sys
+
+from barbot import stats
+from barbot.services import get_services
+
+parser = argparse.ArgumentParser()
+parser.add_argument("chat_id", nargs="?", type=int, help="Chat to rebuild the stats of. Defaults to MAIN_CHAT_ID.")
+
+
+def main():
+    args = parser.parse_args()
+    chat = get_services().chat(args.chat_id)
+    if chat is None:
+        print(f"The bot isn't set up for chat {args.chat_id}")
+        sys.exit(1)
+
+    aggregates = stats.rebuild_totals(chat.db)
+    print(f"Rebuilt the stats of chat {chat.app.MAIN_CHAT_ID} from {aggregates['polls']} polls, "
+          f"now at version {aggregates['version']}")
+
+
+if __name__ == "__main__":
+    main()
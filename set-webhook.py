@@ -8,6 +8,7 @@ import sys
 import urllib.request
 import subprocess
 
+from barbot.app import ALLOWED_UPDATES
 
 docker_compose_path = os.path.normpath(os.path.join(__file__, '..', 'docker-compose.yaml'))
 
@@ -63,7 +64,8 @@ def main():
         url=f'https://api.telegram.org/bot{bot_token}/setWebhook',
         data=json.dumps({
             'url': webhook_url,
-            'secret_token': webhook_secret
+            'secret_token': webhook_secret,
+            'allowed_updates': ALLOWED_UPDATES
         }).encode('utf-8'),
         headers={
             'Content-Type': 'application/json',
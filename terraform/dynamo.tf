@@ -21,13 +21,77 @@ resource "aws_dynamodb_table" "barnight_events" {
   }
 }
 
+resource "aws_dynamodb_table" "barnight_updates" {
+  name         = "${var.prefix}_updates"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# One partition per chat. Only used with DATABASE_BACKEND=dynamo_chats, see barbot/chat_database.py.
+resource "aws_dynamodb_table" "barnight_state" {
+  name         = "${var.prefix}_state"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+  range_key    = "sk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  attribute {
+    name = "sk"
+    type = "S"
+  }
+}
+
+# Chats besides main_chat_id, and their settings. See barbot/chats.py.
+resource "aws_dynamodb_table" "barnight_chats" {
+  name         = "${var.prefix}_chats"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "chat_id"
+
+  attribute {
+    name = "chat_id"
+    type = "N"
+  }
+}
+
+resource "aws_dynamodb_table" "barnight_members" {
+  name         = "${var.prefix}_members"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
 resource "aws_dynamodb_table_item" "current_week" {
   table_name = aws_dynamodb_table.barnight_week.name
   hash_key = aws_dynamodb_table.barnight_week.hash_key
   item = <<EOF
 {
   "id": {"S": "current"},
-  "venues": {"M": {} }
+  "venues": {"M": {} },
+  "venue_keys": {"M": {} },
+  "version": {"N": "0"}
 }
 EOF
 
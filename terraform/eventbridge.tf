@@ -17,6 +17,16 @@ locals {
       event_type = "ChooseWinner"
     }
   }
+
+  # The same schedules for each chat in var.chats, whose events say which chat they're for.
+  chat_schedules = merge([
+    for chat_id, chat in var.chats : {
+      "${chat_id}_first_reminder" = { chat_id = chat_id, cron = chat.first_reminder_cron, event_type = "AskForSuggestions" }
+      "${chat_id}_create_poll"    = { chat_id = chat_id, cron = chat.create_poll_cron, event_type = "CreatePoll" }
+      "${chat_id}_last_call"      = { chat_id = chat_id, cron = chat.last_call_cron, event_type = "PollReminder" }
+      "${chat_id}_close_poll"     = { chat_id = chat_id, cron = chat.close_poll_cron, event_type = "ChooseWinner" }
+    }
+  ]...)
 }
 
 resource "aws_scheduler_schedule_group" "barbot" {
@@ -49,4 +59,41 @@ EOF
     }
 
   }
-}
\ No newline at end of file
+}
+
+resource "aws_scheduler_schedule" "chat_schedules" {
+  for_each = local.chat_schedules
+
+  name = "${var.prefix}_${each.key}"
+  group_name = aws_scheduler_schedule_group.barbot.name
+  schedule_expression = "cron(${each.value.cron})"
+  schedule_expression_timezone = var.chats[each.value.chat_id].timezone
+
+  lifecycle {
+    precondition {
+      # The dynamo backend only keeps state for main_chat_id, so these would run against the main chat's tables.
+      condition     = var.database_backend == "dynamo_chats"
+      error_message = "chats needs database_backend = \"dynamo_chats\"."
+    }
+  }
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  target {
+    arn = aws_lambda_function.api["sequence"].arn
+    role_arn = aws_iam_role.apigateway_lambda_invoker.arn
+    input = <<EOF
+{
+  "barnight_event_type": "${each.value.event_type}",
+  "chat_id": ${each.value.chat_id}
+}
+EOF
+
+    retry_policy {
+      maximum_event_age_in_seconds = 60 * 60 * 1  # hours
+    }
+
+  }
+}
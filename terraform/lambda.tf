@@ -38,11 +38,16 @@ data "aws_iam_policy_document" "lambda" {
       "dynamodb:BatchWriteItem",
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:DeleteItem",
       "dynamodb:DescribeTable"
     ]
     resources = [
       aws_dynamodb_table.barnight_week.arn,
-      aws_dynamodb_table.barnight_events.arn
+      aws_dynamodb_table.barnight_events.arn,
+      aws_dynamodb_table.barnight_updates.arn,
+      aws_dynamodb_table.barnight_state.arn,
+      aws_dynamodb_table.barnight_chats.arn,
+      aws_dynamodb_table.barnight_members.arn
     ]
   }
   statement {
@@ -102,11 +107,16 @@ resource "aws_lambda_function" "api" {
   environment {
     variables = {
       MAIN_CHAT_ID: var.main_chat_id
+      DATABASE_BACKEND: var.database_backend
       TELEGRAM_BOT_TOKEN: var.telegram_bot_token,
       TELEGRAM_BOT_API_SECRET_TOKEN: random_password.webhook_secret.result
       BOT_USERNAME: var.bot_username,
       DYNAMO_WEEK_TABLE_NAME: aws_dynamodb_table.barnight_week.name
       DYNAMO_EVENTS_TABLE_NAME: aws_dynamodb_table.barnight_events.name
+      DYNAMO_UPDATES_TABLE_NAME: aws_dynamodb_table.barnight_updates.name
+      DYNAMO_STATE_TABLE_NAME: aws_dynamodb_table.barnight_state.name
+      DYNAMO_CHATS_TABLE_NAME: aws_dynamodb_table.barnight_chats.name
+      DYNAMO_MEMBERS_TABLE_NAME: aws_dynamodb_table.barnight_members.name
       SCHEDULE_GROUP_NAME: aws_scheduler_schedule_group.barbot.name
       CREATE_POLL_SCHEDULE_NAME = "${var.prefix}_create_poll"
       CLOSE_POLL_SCHEDULE_NAME = "${var.prefix}_close_poll"
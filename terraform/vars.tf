@@ -76,4 +76,36 @@ variable "main_event_cron" {
 variable "main_event_duration_minutes" {
   description = "How long the main event takes place for (in minutes)"
   type        = number
-}
\ No newline at end of file
+}
+
+variable "database_backend" {
+  description = <<EOF
+Where the bot keeps its state. "dynamo" uses the week and events tables, which only hold MAIN_CHAT_ID's state.
+"dynamo_chats" uses the state table, with a partition per chat, and is required when chats is set. Switching doesn't
+copy the existing state over.
+EOF
+  type        = string
+  default     = "dynamo"
+
+  validation {
+    condition     = contains(["dynamo", "dynamo_chats"], var.database_backend)
+    error_message = "database_backend must be \"dynamo\" or \"dynamo_chats\"."
+  }
+}
+
+variable "chats" {
+  description = <<EOF
+Chats besides main_chat_id, keyed by chat ID, and when their bar night sequence runs. Each chat also needs an item in
+the chats table, whose settings should set CREATE_POLL_SCHEDULE_NAME and CLOSE_POLL_SCHEDULE_NAME to
+"<prefix>_<chat ID>_create_poll" and "<prefix>_<chat ID>_close_poll". See barbot/chats.py. Needs
+database_backend = "dynamo_chats".
+EOF
+  type = map(object({
+    timezone            = string
+    first_reminder_cron = string
+    create_poll_cron    = string
+    last_call_cron      = string
+    close_poll_cron     = string
+  }))
+  default = {}
+}